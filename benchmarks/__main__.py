@@ -0,0 +1,202 @@
+import os
+import sys
+import time
+import json
+import socket
+import signal
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+from . import load
+from . import monitor
+from . import scenarios
+from . import request_parser
+from . import response_serializer
+from . import websocket_frames
+
+def parse_arguments():
+    argument_parser = argparse.ArgumentParser(prog = "python -m benchmarks",description = "Runs the load scenarios against a local outside server and reports throughput, latency, CPU and memory.")
+    argument_parser.add_argument("--engine",default = "connection",choices = ["connection","process","thread","async"],help = "Server mode: one process per connection, process/thread worker pool or event loops")
+    argument_parser.add_argument("--scenarios",help = "Comma separated scenario names (default: all)")
+    argument_parser.add_argument("--duration",type = float,default = 10,help = "Seconds per scenario")
+    argument_parser.add_argument("--processes",type = int,default = max(((os.cpu_count() or 2) // 2),1),help = "Load generator processes")
+    argument_parser.add_argument("--port",type = int,default = 8480)
+    argument_parser.add_argument("--file-mb",type = int,default = 1024,help = "Size of the downloaded file")
+    argument_parser.add_argument("--upload-mb",type = int,default = 100,help = "Size of the uploaded body")
+    argument_parser.add_argument("--file-cache-mb",type = int,help = "Server \"file_cache_mb\" (default: the server's default, 0 disables the cache)")
+    argument_parser.add_argument("--micro",action = "store_true",help = "Also run the single-process benchmarks of the parser, serializer and frame reader")
+    argument_parser.add_argument("--output",help = "Write the results as JSON to this file (\"-\" for stdout)")
+    argument_parser.add_argument("--compare",help = "JSON results of an earlier run to compare with")
+    return argument_parser.parse_args()
+
+def create_certificate(directory):
+    # Self-signed certificate for the TLS scenario, needs the openssl command
+    if (not shutil.which("openssl")):
+        return None
+    certificate = (os.path.join(directory,"cert.pem"),os.path.join(directory,"key.pem"))
+    subprocess.run(
+        ["openssl","req","-x509","-newkey","rsa:2048","-nodes","-days","1","-subj","/CN=127.0.0.1","-out",certificate[0],"-keyout",certificate[1]],
+        check = True,
+        stdout = subprocess.DEVNULL,
+        stderr = subprocess.DEVNULL
+    )
+    return certificate
+
+def start_server(arguments,port,certificate = None):
+    server_command = [sys.executable,"-m","benchmarks.app","--engine",arguments.engine,"--port",str(port),"--file-mb",str(arguments.file_mb),"--upload-mb",str(arguments.upload_mb)]
+    if (arguments.file_cache_mb != None):
+        server_command.extend(["--file-cache-mb",str(arguments.file_cache_mb)])
+    if (certificate):
+        server_command.extend(["--certfile",certificate[0],"--keyfile",certificate[1]])
+    server_process = subprocess.Popen(server_command)
+    for attempt_index in range(100):
+        if (server_process.poll() != None):
+            raise RuntimeError(f"Server exited with code {str(server_process.returncode)}.")
+        try:
+            socket.create_connection(("127.0.0.1",port),timeout = 1).close()
+            return server_process
+        except OSError:
+            time.sleep(0.1)
+    stop_server(server_process)
+    raise RuntimeError(f"Server is not listening on {str(port)}.")
+
+def stop_server(server_process):
+    server_process.send_signal(signal.SIGTERM)
+    try:
+        server_process.wait(timeout = 30)
+    except subprocess.TimeoutExpired:
+        server_process.kill()
+        server_process.wait()
+
+def run_scenario(scenario,arguments,port,server_process):
+    server_monitor = monitor.ServerMonitor(server_process.pid)
+    start_cpu_seconds = server_monitor.get_cpu_seconds()
+    server_monitor.start()
+    load_result = load.run_load(scenario,("127.0.0.1",port),arguments.processes,arguments.duration)
+    server_monitor.stop()
+    # Give the supervisor one accept_timeout to reap workers of closed connections
+    time.sleep(1.2)
+    end_cpu_seconds = server_monitor.get_cpu_seconds()
+
+    scenario_result = {"scenario": scenario["name"],"connections": scenario["connections"]}
+    scenario_result.update(load_result)
+    scenario_result["server_cpu_seconds"] = None
+    scenario_result["server_peak_memory_mb"] = None
+    if (server_monitor.available):
+        scenario_result["server_cpu_seconds"] = round((end_cpu_seconds - start_cpu_seconds),3)
+        scenario_result["server_peak_memory_mb"] = round((server_monitor.peak_memory / 1024 / 1024),1)
+    return scenario_result
+
+def run_micro_benchmarks():
+    return [
+        {"scenario": "micro_request_parser","value": round(request_parser.run_benchmark(200000,len(request_parser.REQUEST_HEAD))),"unit": "heads/s"},
+        {"scenario": "micro_response_head","value": round(response_serializer.run_head_benchmark(200000,True)),"unit": "heads/s"},
+        {"scenario": "micro_response_send","value": round(response_serializer.run_benchmark(200000,True)),"unit": "responses/s"},
+        {"scenario": "micro_websocket_frames","value": round(websocket_frames.run_benchmark((64 * 1024),(256 * 1024 * 1024),True),1),"unit": "MB/s"}
+    ]
+
+def get_metadata(arguments):
+    try:
+        commit = subprocess.run(["git","rev-parse","HEAD"],capture_output = True,text = True,check = True).stdout.strip()
+    except (OSError,subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%SZ",time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "engine": arguments.engine,
+        "duration": arguments.duration,
+        "processes": arguments.processes,
+        "file_mb": arguments.file_mb,
+        "upload_mb": arguments.upload_mb,
+        "file_cache_mb": arguments.file_cache_mb
+    }
+
+def print_result(scenario_result):
+    if ("value" in scenario_result):
+        print(f"[BENCH] {scenario_result['scenario']}: {str(scenario_result['value'])} {scenario_result['unit']}")
+        return
+    latency_ms = scenario_result["latency_ms"]
+    print(
+        f"[BENCH] {scenario_result['scenario']}: {str(scenario_result['requests_per_second'])} req/s, {str(scenario_result['mb_per_second'])} MB/s, "
+        f"p50 {str(latency_ms['p50'])}ms, p99 {str(latency_ms['p99'])}ms, p999 {str(latency_ms['p999'])}ms, "
+        f"server CPU {str(scenario_result['server_cpu_seconds'])}s, peak memory {str(scenario_result['server_peak_memory_mb'])}MB, "
+        f"errors {str(scenario_result['errors'])}"
+    )
+
+def compare_results(old_results,new_results):
+    old_scenarios = {scenario_result["scenario"]: scenario_result for scenario_result in old_results["results"]}
+    print(f"[BENCH] Compared with {str(old_results['metadata']['commit'])} ({old_results['metadata']['engine']}):")
+    for scenario_result in new_results["results"]:
+        old_result = old_scenarios.get(scenario_result["scenario"])
+        if (not old_result):
+            continue
+        if ("value" in scenario_result):
+            compared_values = [("value",scenario_result["value"],old_result["value"])]
+        else:
+            compared_values = [
+                ("req/s",scenario_result["requests_per_second"],old_result["requests_per_second"]),
+                ("p99",scenario_result["latency_ms"]["p99"],old_result["latency_ms"]["p99"])
+            ]
+        compared_lines = []
+        for value_name,new_value,old_value in compared_values:
+            if (old_value and (new_value != None)):
+                compared_lines.append(f"{value_name} {str(old_value)} -> {str(new_value)} ({((new_value / old_value) - 1) * 100:+.1f}%)")
+        if (compared_lines):
+            print(f"[BENCH]   {scenario_result['scenario']}: {', '.join(compared_lines)}")
+
+def main():
+    arguments = parse_arguments()
+    scenario_list = scenarios.create_scenarios(arguments.file_mb,arguments.upload_mb)
+    if (arguments.scenarios):
+        scenario_names = arguments.scenarios.split(",")
+        unknown_names = (set(scenario_names) - set(scenario["name"] for scenario in scenario_list))
+        if (unknown_names):
+            raise SystemExit(f"Unknown scenarios: {', '.join(sorted(unknown_names))}")
+        scenario_list = [scenario for scenario in scenario_list if (scenario["name"] in scenario_names)]
+
+    results = {"metadata": get_metadata(arguments),"results": []}
+    if (arguments.micro):
+        for scenario_result in run_micro_benchmarks():
+            print_result(scenario_result)
+            results["results"].append(scenario_result)
+
+    certificate_directory = tempfile.mkdtemp(prefix = "outside-bench-tls-")
+    try:
+        for use_tls in (False,True):
+            server_scenarios = [scenario for scenario in scenario_list if (bool(scenario.get("tls")) == use_tls)]
+            if (not server_scenarios):
+                continue
+            certificate = None
+            if (use_tls):
+                certificate = create_certificate(certificate_directory)
+                if (not certificate):
+                    print("[BENCH] Skipping TLS scenarios, the openssl command is not available.")
+                    continue
+            server_process = start_server(arguments,arguments.port,certificate)
+            try:
+                for scenario in server_scenarios:
+                    scenario_result = run_scenario(scenario,arguments,arguments.port,server_process)
+                    print_result(scenario_result)
+                    results["results"].append(scenario_result)
+            finally:
+                stop_server(server_process)
+    finally:
+        shutil.rmtree(certificate_directory,ignore_errors = True)
+
+    if (arguments.output == "-"):
+        print(json.dumps(results,indent = 2))
+    elif (arguments.output):
+        with open(arguments.output,"w") as output_file:
+            json.dump(results,output_file,indent = 2)
+    if (arguments.compare):
+        with open(arguments.compare) as compare_file:
+            compare_results(json.load(compare_file),results)
+
+if (__name__ == "__main__"):
+    main()
@@ -0,0 +1,129 @@
+import os
+import argparse
+import tempfile
+import shutil
+
+import outside
+import outside.protocol_http
+import outside.protocol_websocket
+
+TINY_CONTENT = b"ok"
+STATIC_SIZE = (250 * 1024)
+
+def create_file(directory,file_mb):
+    # A sparse file, the benchmark measures sending it and not the disk
+    file_path = os.path.join(directory,"download.bin")
+    with open(file_path,"wb") as open_file:
+        open_file.truncate(file_mb * 1024 * 1024)
+    return file_path
+
+def create_static_file(directory):
+    # Small enough for the in-memory file cache (file_cache_max_kb), with real content unlike the sparse download
+    file_path = os.path.join(directory,"static.bin")
+    with open(file_path,"wb") as open_file:
+        open_file.write(os.urandom(STATIC_SIZE))
+    return file_path
+
+def create_server(engine,port,file_path,static_path,upload_mb,file_cache_mb = None,certificate = None):
+    if (engine == "async"):
+        server = outside.OutsideAsyncHTTP(("127.0.0.1",port))
+        server.config["max_workers"] = 64
+    else:
+        server = outside.OutsideHTTP(("127.0.0.1",port))
+        server.config["max_workers"] = 512
+        if (engine in ("process","thread")):
+            server.config["worker_pool"] = engine
+            server.config["worker_pool_size"] = 64
+    server.config["backlog_length"] = 1024
+    server.config["log_level"] = "ERROR"
+    server.config["max_socket_reuse"] = 1000000
+    server.config["max_body_size_mb"] = max(server.config["max_body_size_mb"],(upload_mb + 1))
+    if (file_cache_mb != None):
+        server.config["file_cache_mb"] = file_cache_mb
+    if (certificate):
+        server.config["ssl_enabled"] = True
+        server.config["ssl_certfile"],server.config["ssl_keyfile"] = certificate
+
+    def tiny_route(request):
+        return outside.protocol_http.Response(
+            status_code = 200,
+            headers = {"Content-Type": "text/plain"},
+            content = TINY_CONTENT
+        )
+
+    def json_route(request):
+        return outside.protocol_http.Response(
+            status_code = 200,
+            headers = {},
+            content = {"received": len(request.json()["items"])}
+        )
+
+    def file_route(request):
+        return outside.protocol_http.Response(
+            status_code = 200,
+            headers = {"Content-Type": "application/octet-stream"},
+            content = outside.protocol_http.FilePath(file_path)
+        )
+
+    def static_route(request):
+        return outside.protocol_http.Response(
+            status_code = 200,
+            headers = {"Content-Type": "application/octet-stream"},
+            content = outside.protocol_http.FilePath(static_path)
+        )
+
+    def upload_route(request):
+        body_size = 0
+        for body_chunk in request.stream(1024 * 1024):
+            body_size = (body_size + len(body_chunk))
+        return outside.protocol_http.Response(
+            status_code = 200,
+            headers = {},
+            content = {"received": body_size}
+        )
+
+    echo_websocket = outside.protocol_websocket.WebSocket()
+    if (engine == "async"):
+        async def echo_handler(connection):
+            while True:
+                await connection.send(await connection.recv())
+    else:
+        def echo_handler(connection):
+            while True:
+                connection.send(connection.recv())
+    echo_websocket.connection_handler = echo_handler
+
+    server.set_route("/tiny",tiny_route,exact = True)
+    server.set_route("/json",json_route,methods = ["POST"],exact = True)
+    server.set_route("/file",file_route,exact = True)
+    server.set_route("/static",static_route,exact = True)
+    server.set_route("/upload",upload_route,methods = ["POST"],exact = True)
+    server.set_route("/echo",echo_websocket,exact = True)
+    return server
+
+if (__name__ == "__main__"):
+    argument_parser = argparse.ArgumentParser(description = "Server under test for the load generator.")
+    argument_parser.add_argument("--engine",default = "connection",choices = ["connection","process","thread","async"])
+    argument_parser.add_argument("--port",type = int,default = 8480)
+    argument_parser.add_argument("--file-mb",type = int,default = 1024)
+    argument_parser.add_argument("--upload-mb",type = int,default = 100)
+    argument_parser.add_argument("--file-cache-mb",type = int)
+    argument_parser.add_argument("--certfile")
+    argument_parser.add_argument("--keyfile")
+    arguments = argument_parser.parse_args()
+
+    certificate = None
+    if (arguments.certfile):
+        certificate = (arguments.certfile,arguments.keyfile)
+    file_directory = tempfile.mkdtemp(prefix = "outside-bench-")
+    server = create_server(
+        arguments.engine,
+        arguments.port,
+        create_file(file_directory,arguments.file_mb),
+        create_static_file(file_directory),
+        arguments.upload_mb,
+        arguments.file_cache_mb,
+        certificate
+    )
+    server.config["server_cleanup"] = (lambda: shutil.rmtree(file_directory,ignore_errors = True))
+    server.run()
@@ -0,0 +1,247 @@
+import os
+import time
+import ssl
+import math
+import array
+import asyncio
+import multiprocessing
+
+WEBSOCKET_KEY = "dGhlIHNhbXBsZSBub25jZQ=="
+MASK_KEY = b"\x37\xfa\x21\x3d"
+BODY_PART_SIZE = (1024 * 1024)
+BODY_PART = bytes(BODY_PART_SIZE)
+
+def build_request(method,path,headers = {},body_data = b"",body_size = 0,keep_alive = True):
+    # Bodies above a few KB are not part of the request data, the connection sends body_size zero bytes after the head
+    head_lines = [f"{method} {path} HTTP/1.1","Host: 127.0.0.1"]
+    if (not keep_alive):
+        head_lines.append("Connection: close")
+    for header_name,header_value in headers.items():
+        head_lines.append(f"{header_name}: {header_value}")
+    if (body_data or body_size):
+        head_lines.append(f"Content-Length: {str(len(body_data) or body_size)}")
+    return (("\r\n".join(head_lines) + "\r\n\r\n").encode("utf-8") + body_data)
+
+def build_websocket_frame(payload_data):
+    header_data = bytearray([0x82])
+    payload_length = len(payload_data)
+    if (payload_length <= 125):
+        header_data.append(0x80 | payload_length)
+    elif (payload_length <= (2 ** 16 - 1)):
+        header_data.append(0x80 | 126)
+        header_data.extend(payload_length.to_bytes(2,"big"))
+    else:
+        header_data.append(0x80 | 127)
+        header_data.extend(payload_length.to_bytes(8,"big"))
+    header_data.extend(MASK_KEY)
+    # The key never changes, so the frame is masked once and sent again for every message
+    mask_data = (MASK_KEY * ((payload_length // 4) + 1))[:payload_length]
+    masked_data = (int.from_bytes(payload_data,"big") ^ int.from_bytes(mask_data,"big")).to_bytes(payload_length,"big")
+    return (bytes(header_data) + masked_data)
+
+def create_client_context():
+    # No session is stored, every connection runs a full handshake
+    client_context = ssl.create_default_context()
+    client_context.check_hostname = False
+    client_context.verify_mode = ssl.CERT_NONE
+    return client_context
+
+async def read_response(reader):
+    response_head = await reader.readuntil(b"\r\n\r\n")
+    status_code = int(response_head[9:12])
+    content_length = None
+    connection_close = False
+    for header_line in response_head.split(b"\r\n")[1:]:
+        header_name,header_separator,header_value = header_line.partition(b":")
+        header_name = header_name.strip().lower()
+        if (header_name == b"content-length"):
+            content_length = int(header_value)
+        elif ((header_name == b"connection") and (header_value.strip().lower() == b"close")):
+            connection_close = True
+
+    response_size = len(response_head)
+    if (content_length == None):
+        while True:
+            body_data = await reader.read(BODY_PART_SIZE)
+            if (not body_data):
+                break
+            response_size = (response_size + len(body_data))
+        return status_code,response_size,True
+    body_left = content_length
+    while (body_left > 0):
+        body_data = await reader.read(min(body_left,BODY_PART_SIZE))
+        if (not body_data):
+            raise asyncio.IncompleteReadError(b"",body_left)
+        body_left = (body_left - len(body_data))
+    return status_code,(response_size + content_length),connection_close
+
+async def read_websocket_message(reader):
+    message_size = 0
+    while True:
+        frame_head = await reader.readexactly(2)
+        payload_length = (frame_head[1] & 0x7f)
+        if (payload_length == 126):
+            payload_length = int.from_bytes(await reader.readexactly(2),"big")
+        elif (payload_length == 127):
+            payload_length = int.from_bytes(await reader.readexactly(8),"big")
+        await reader.readexactly(payload_length)
+        if ((frame_head[0] & 0x0f) in (0x09,0x0a)):
+            continue
+        message_size = (message_size + payload_length)
+        if (frame_head[0] & 0x80):
+            return message_size
+
+class LoadStats:
+    def __init__(self):
+        self.latencies = array.array("d")
+        self.requests = 0
+        self.bytes = 0
+        self.errors = 0
+
+    def add(self,latency,transferred_size):
+        self.latencies.append(latency)
+        self.requests = (self.requests + 1)
+        self.bytes = (self.bytes + transferred_size)
+
+async def run_http_connection(scenario,address,client_context,deadline,connection_index,stats):
+    request_list = scenario["requests"]
+    request_index = connection_index
+    reader = None
+    writer = None
+    while (time.perf_counter() < deadline):
+        request_data = request_list[request_index % len(request_list)]
+        request_index = (request_index + 1)
+        start_time = time.perf_counter()
+        try:
+            if (not writer):
+                reader,writer = await asyncio.open_connection(address[0],address[1],ssl = client_context)
+            writer.write(request_data)
+            body_left = scenario.get("body_size",0)
+            while (body_left > 0):
+                writer.write(BODY_PART[:min(body_left,BODY_PART_SIZE)])
+                body_left = (body_left - BODY_PART_SIZE)
+                await writer.drain()
+            await writer.drain()
+            status_code,response_size,connection_close = await read_response(reader)
+        except (OSError,asyncio.IncompleteReadError,asyncio.LimitOverrunError,ValueError):
+            stats.errors = (stats.errors + 1)
+            if (writer):
+                writer.close()
+            writer = None
+            continue
+        stats.add((time.perf_counter() - start_time),(len(request_data) + scenario.get("body_size",0) + response_size))
+        if (status_code >= 400):
+            stats.errors = (stats.errors + 1)
+        if (connection_close or (not scenario["keep_alive"])):
+            writer.close()
+            writer = None
+    if (writer):
+        writer.close()
+
+async def run_websocket_connection(scenario,address,client_context,deadline,connection_index,stats):
+    try:
+        reader,writer = await asyncio.open_connection(address[0],address[1],ssl = client_context)
+        writer.write(build_request("GET",scenario["path"],{
+            "Upgrade": "websocket",
+            "Connection": "Upgrade",
+            "Sec-WebSocket-Key": WEBSOCKET_KEY,
+            "Sec-WebSocket-Version": "13"
+        }))
+        response_head = await reader.readuntil(b"\r\n\r\n")
+        if (int(response_head[9:12]) != 101):
+            raise ValueError("Handshake not accepted.")
+    except (OSError,asyncio.IncompleteReadError,asyncio.LimitOverrunError,ValueError):
+        stats.errors = (stats.errors + 1)
+        return
+
+    frame_data = scenario["frame"]
+    try:
+        while (time.perf_counter() < deadline):
+            start_time = time.perf_counter()
+            writer.write(frame_data)
+            await writer.drain()
+            message_size = await read_websocket_message(reader)
+            stats.add((time.perf_counter() - start_time),(len(frame_data) + message_size))
+        writer.write(b"\x88\x80" + MASK_KEY)
+        await writer.drain()
+    except (OSError,asyncio.IncompleteReadError):
+        stats.errors = (stats.errors + 1)
+    finally:
+        writer.close()
+
+async def run_connections(scenario,address,connection_count,deadline,connection_offset):
+    client_context = None
+    if (scenario.get("tls")):
+        client_context = create_client_context()
+    run_function = run_http_connection
+    if (scenario["kind"] == "websocket"):
+        run_function = run_websocket_connection
+    stats = LoadStats()
+    await asyncio.gather(*[
+        run_function(scenario,address,client_context,deadline,(connection_offset + connection_index),stats)
+        for connection_index in range(connection_count)
+    ])
+    return stats
+
+def run_worker(scenario,address,connection_count,connection_offset,start_time,duration,result_queue):
+    # Workers start together at start_time (wall clock), the deadline is converted to the monotonic clock
+    time.sleep(max((start_time - time.time()),0))
+    start_times = os.times()
+    deadline = (time.perf_counter() + (start_time + duration - time.time()))
+    stats = asyncio.run(run_connections(scenario,address,connection_count,deadline,connection_offset))
+    end_times = os.times()
+    result_queue.put({
+        "latencies": stats.latencies,
+        "requests": stats.requests,
+        "bytes": stats.bytes,
+        "errors": stats.errors,
+        "cpu_seconds": ((end_times.user - start_times.user) + (end_times.system - start_times.system)),
+        "end_time": time.time()
+    })
+
+def get_percentile(sorted_values,percentile):
+    if (not sorted_values):
+        return None
+    return sorted_values[min((len(sorted_values) - 1),max((math.ceil(percentile * len(sorted_values)) - 1),0))]
+
+def run_load(scenario,address,process_count,duration):
+    # Connections are spread over process_count processes, each running them on its own event loop
+    connection_count = scenario["connections"]
+    process_count = max(min(process_count,connection_count),1)
+    result_queue = multiprocessing.Queue()
+    start_time = (time.time() + 0.5)
+    worker_processes = []
+    connection_offset = 0
+    for process_index in range(process_count):
+        process_connections = (connection_count // process_count)
+        if (process_index < (connection_count % process_count)):
+            process_connections = (process_connections + 1)
+        worker_process = multiprocessing.Process(
+            target = run_worker,
+            name = f"[outside] load worker {str(process_index)}",
+            args = [scenario,address,process_connections,connection_offset,start_time,duration,result_queue]
+        )
+        worker_process.start()
+        worker_processes.append(worker_process)
+        connection_offset = (connection_offset + process_connections)
+
+    worker_results = [result_queue.get() for worker_process in worker_processes]
+    for worker_process in worker_processes:
+        worker_process.join()
+
+    latencies = sorted(latency for worker_result in worker_results for latency in worker_result["latencies"])
+    elapsed_time = max((max(worker_result["end_time"] for worker_result in worker_results) - start_time),0.001)
+    request_count = sum(worker_result["requests"] for worker_result in worker_results)
+    transferred_size = sum(worker_result["bytes"] for worker_result in worker_results)
+    return {
+        "requests": request_count,
+        "errors": sum(worker_result["errors"] for worker_result in worker_results),
+        "seconds": round(elapsed_time,3),
+        "requests_per_second": round((request_count / elapsed_time),1),
+        "mb_per_second": round((transferred_size / elapsed_time / 1024 / 1024),1),
+        "latency_ms": {
+            percentile_name: (round((get_percentile(latencies,percentile) * 1000),3) if latencies else None)
+            for percentile_name,percentile in (("p50",0.5),("p99",0.99),("p999",0.999))
+        },
+        "client_cpu_seconds": round(sum(worker_result["cpu_seconds"] for worker_result in worker_results),3)
+    }
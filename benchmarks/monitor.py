@@ -0,0 +1,95 @@
+import os
+import threading
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+def read_stat(pid):
+    # Fields after the process name: state, ppid, ..., utime (14), stime (15), cutime (16), cstime (17)
+    with open(f"/proc/{str(pid)}/stat","rb") as stat_file:
+        stat_data = stat_file.read()
+    stat_fields = stat_data[(stat_data.rindex(b")") + 2):].split()
+    return {
+        "ppid": int(stat_fields[1]),
+        "cpu_seconds": ((int(stat_fields[11]) + int(stat_fields[12])) / CLOCK_TICKS),
+        "children_cpu_seconds": ((int(stat_fields[13]) + int(stat_fields[14])) / CLOCK_TICKS)
+    }
+
+def read_memory(pid):
+    # Forked workers share most of their pages, the proportional set size splits them between the processes
+    try:
+        with open(f"/proc/{str(pid)}/smaps_rollup","rb") as smaps_file:
+            for smaps_line in smaps_file:
+                if (smaps_line.startswith(b"Pss:")):
+                    return (int(smaps_line.split()[1]) * 1024)
+    except FileNotFoundError:
+        pass
+    with open(f"/proc/{str(pid)}/statm","rb") as statm_file:
+        return (int(statm_file.read().split()[1]) * PAGE_SIZE)
+
+def get_process_tree(root_pid):
+    parent_pids = {}
+    for pid_name in os.listdir("/proc"):
+        if (not pid_name.isdigit()):
+            continue
+        try:
+            parent_pids[int(pid_name)] = read_stat(pid_name)["ppid"]
+        except (OSError,ValueError,IndexError):
+            continue
+    tree_pids = [root_pid]
+    for tree_pid in tree_pids:
+        tree_pids.extend(pid for pid,parent_pid in parent_pids.items() if (parent_pid == tree_pid))
+    return tree_pids
+
+class ServerMonitor:
+    # Samples the server and all its worker processes, /proc is only available on Linux
+    def __init__(self,root_pid,sample_interval = 0.25):
+        self.root_pid = root_pid
+        self.sample_interval = sample_interval
+        self.available = os.path.isdir("/proc")
+        self.peak_memory = 0
+        self._stop_event = threading.Event()
+        self._sample_thread = None
+
+    def get_cpu_seconds(self):
+        # Exited workers are added to cutime/cstime of their parent once they are reaped, so nothing is counted twice
+        if (not self.available):
+            return None
+        cpu_seconds = 0
+        for tree_pid in get_process_tree(self.root_pid):
+            try:
+                process_stat = read_stat(tree_pid)
+            except (OSError,ValueError,IndexError):
+                continue
+            cpu_seconds = (cpu_seconds + process_stat["cpu_seconds"] + process_stat["children_cpu_seconds"])
+        return cpu_seconds
+
+    def get_memory(self):
+        if (not self.available):
+            return None
+        memory = 0
+        for tree_pid in get_process_tree(self.root_pid):
+            try:
+                memory = (memory + read_memory(tree_pid))
+            except (OSError,ValueError,IndexError):
+                continue
+        return memory
+
+    def start(self):
+        self.peak_memory = 0
+        self._stop_event.clear()
+        if (not self.available):
+            return
+        self._sample_thread = threading.Thread(target = self._sample_function,daemon = True)
+        self._sample_thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if (self._sample_thread):
+            self._sample_thread.join()
+            self._sample_thread = None
+
+    def _sample_function(self):
+        while (not self._stop_event.is_set()):
+            self.peak_memory = max(self.peak_memory,(self.get_memory() or 0))
+            self._stop_event.wait(self.sample_interval)
@@ -0,0 +1,39 @@
+import sys
+import time
+
+import outside
+import outside.protocol_http
+import outside.request_parser
+
+REQUEST_HEAD = (
+    b"GET /api/items?page=2&limit=50 HTTP/1.1\r\n"
+    b"Host: example.com\r\n"
+    b"User-Agent: Mozilla/5.0 (X11; Linux x86_64; rv:120.0) Gecko/20100101 Firefox/120.0\r\n"
+    b"Accept: application/json\r\n"
+    b"Accept-Language: en-US,en;q=0.5\r\n"
+    b"Accept-Encoding: gzip, deflate\r\n"
+    b"Connection: keep-alive\r\n"
+    b"\r\n"
+)
+
+def run_benchmark(head_count,recv_size):
+    config = outside.OutsideHTTP(("127.0.0.1",0)).config
+    head_chunks = [REQUEST_HEAD[chunk_start:(chunk_start + recv_size)] for chunk_start in range(0,len(REQUEST_HEAD),recv_size)]
+    head_parser = outside.request_parser.RequestParser(config)
+
+    start_time = time.perf_counter()
+    for head_index in range(head_count):
+        request_class = outside.protocol_http.Request("",{},b"","","",("127.0.0.1",0))
+        for head_chunk in head_chunks:
+            head_parser.feed(head_chunk)
+            if (head_parser.find_head()):
+                break
+        head_parser.parse_head(request_class)
+    return (head_count / (time.perf_counter() - start_time))
+
+if (__name__ == "__main__"):
+    head_count = 200000
+    if (len(sys.argv) > 1):
+        head_count = int(sys.argv[1])
+    for recv_size in (len(REQUEST_HEAD),64,16):
+        print(f"[BENCH] recv_size={str(recv_size)}: {str(round(run_benchmark(head_count,recv_size)))} heads/sec")
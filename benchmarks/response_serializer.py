@@ -0,0 +1,97 @@
+import sys
+import time
+import socket
+import threading
+
+import outside
+import outside.protocol_http
+import outside.activity_slots
+import outside.code_description
+
+RESPONSE_CONTENT = (b"{\"items\": [" + b", ".join([b"{\"id\": 1, \"name\": \"item\"}"] * 20) + b"]}")
+
+def build_concatenated_head(response_class):
+    # The previous serializer, kept as the baseline
+    response_data = (b"HTTP/1.1 " + str(response_class.status_code).encode("utf-8") + b" " + outside.code_description.get_description(response_class.status_code).encode("utf-8") + b"\r\n")
+    for header_name in response_class.headers:
+        header_value = response_class.headers[header_name]
+        if (isinstance(header_value,int)):
+            header_value = str(header_value)
+        response_data = (response_data + header_name.encode("utf-8") + b": " + header_value.encode("utf-8") + b"\r\n")
+    for cookie_name,cookie_value in response_class.cookies.items():
+        response_data = (response_data + b"Set-Cookie: " + cookie_name.encode("utf-8") + b"=" + cookie_value.value.encode("utf-8"))
+        if (cookie_value.max_age):
+            response_data = (response_data + f"; Max-Age={str(cookie_value.max_age)}".encode("utf-8"))
+        if (cookie_value.domain):
+            response_data = (response_data + f"; Domain={cookie_value.domain}".encode("utf-8"))
+        if (cookie_value.http_only):
+            response_data = (response_data + f"; HttpOnly".encode("utf-8"))
+        if (cookie_value.secure):
+            response_data = (response_data + f"; Secure".encode("utf-8"))
+        if (cookie_value.path):
+            response_data = (response_data + f"; Path={cookie_value.path}".encode("utf-8"))
+        if (cookie_value.same_site):
+            response_data = (response_data + f"; SameSite={cookie_value.same_site}".encode("utf-8"))
+        response_data = (response_data + b"\r\n")
+    return (response_data + b"\r\n")
+
+def create_response():
+    response_class = outside.protocol_http.Response(
+        status_code = 200,
+        headers = {
+            "Content-Type": "application/json",
+            "Content-Length": len(RESPONSE_CONTENT),
+            "Cache-Control": "no-store",
+            "Connection": "keep-alive",
+            "Keep-Alive": "timeout=5, max=100"
+        },
+        content = RESPONSE_CONTENT,
+        cookies = {
+            "session": outside.protocol_http.ResponseCookie("abcdef0123456789",None,None,True,True,"/",None)
+        }
+    )
+    return response_class
+
+def drain_socket(receiving_socket):
+    while (receiving_socket.recv(1048576)):
+        pass
+
+def run_benchmark(response_count,use_serializer):
+    response_class = create_response()
+    activity_slot = outside.activity_slots.create_slots(1)[0]
+    sending_socket,receiving_socket = socket.socketpair()
+    drain_thread = threading.Thread(target = drain_socket,args = [receiving_socket],daemon = True)
+    drain_thread.start()
+
+    start_time = time.perf_counter()
+    for response_index in range(response_count):
+        if (use_serializer):
+            outside.protocol_http.send_buffers(sending_socket,[outside.protocol_http.build_response_head(response_class),response_class.content],65536,activity_slot)
+        else:
+            sending_socket.sendall(build_concatenated_head(response_class) + response_class.content)
+    elapsed_time = (time.perf_counter() - start_time)
+
+    sending_socket.close()
+    drain_thread.join()
+    receiving_socket.close()
+    return (response_count / elapsed_time)
+
+def run_head_benchmark(response_count,use_serializer):
+    response_class = create_response()
+    build_function = build_concatenated_head
+    if (use_serializer):
+        build_function = outside.protocol_http.build_response_head
+
+    start_time = time.perf_counter()
+    for response_index in range(response_count):
+        build_function(response_class)
+    return (response_count / (time.perf_counter() - start_time))
+
+if (__name__ == "__main__"):
+    response_count = 200000
+    if (len(sys.argv) > 1):
+        response_count = int(sys.argv[1])
+    print(f"[BENCH] head, concatenated: {str(round(run_head_benchmark(response_count,False)))} heads/sec")
+    print(f"[BENCH] head, serializer: {str(round(run_head_benchmark(response_count,True)))} heads/sec")
+    print(f"[BENCH] head + body, concatenated + sendall: {str(round(run_benchmark(response_count,False)))} responses/sec")
+    print(f"[BENCH] head + body, serializer + sendmsg: {str(round(run_benchmark(response_count,True)))} responses/sec")
@@ -0,0 +1,90 @@
+import json
+import random
+
+from . import load
+
+RANGE_SIZE = (64 * 1024)
+RANGE_REQUEST_COUNT = 256
+
+def create_scenarios(file_mb,upload_mb):
+    json_body = json.dumps({"items": [{"id": item_id,"name": "item","tags": ["a","b"]} for item_id in range(32)]}).encode("utf-8")
+    range_random = random.Random(0)
+    range_starts = [(range_random.randrange((file_mb * 1024 * 1024) // RANGE_SIZE) * RANGE_SIZE) for request_index in range(RANGE_REQUEST_COUNT)]
+
+    scenarios = [
+        {
+            "name": "tiny_get_keep_alive",
+            "kind": "http",
+            "connections": 64,
+            "keep_alive": True,
+            "requests": [load.build_request("GET","/tiny")]
+        },
+        {
+            "name": "tiny_get_close",
+            "kind": "http",
+            "connections": 16,
+            "keep_alive": False,
+            "requests": [load.build_request("GET","/tiny",keep_alive = False)]
+        },
+        {
+            "name": "json_post",
+            "kind": "http",
+            "connections": 64,
+            "keep_alive": True,
+            "requests": [load.build_request("POST","/json",{"Content-Type": "application/json"},json_body)]
+        },
+        {
+            "name": "file_download",
+            "kind": "http",
+            "connections": 4,
+            "keep_alive": True,
+            "requests": [load.build_request("GET","/file")]
+        },
+        {
+            "name": "static_file",
+            "kind": "http",
+            "connections": 16,
+            "keep_alive": True,
+            "requests": [load.build_request("GET","/static")]
+        },
+        {
+            "name": "range_get",
+            "kind": "http",
+            "connections": 32,
+            "keep_alive": True,
+            "requests": [load.build_request("GET","/file",{"Range": f"bytes={str(range_start)}-{str(range_start + RANGE_SIZE - 1)}"}) for range_start in range_starts]
+        },
+        {
+            "name": "upload",
+            "kind": "http",
+            "connections": 2,
+            "keep_alive": True,
+            "body_size": (upload_mb * 1024 * 1024),
+            "requests": [load.build_request("POST","/upload",{"Content-Type": "application/octet-stream"},body_size = (upload_mb * 1024 * 1024))]
+        },
+        {
+            "name": "static_file_tls",
+            "kind": "http",
+            "connections": 16,
+            "keep_alive": True,
+            "tls": True,
+            "requests": [load.build_request("GET","/static")]
+        },
+        {
+            "name": "tls_handshake",
+            "kind": "http",
+            "connections": 16,
+            "keep_alive": False,
+            "tls": True,
+            "requests": [load.build_request("GET","/tiny",keep_alive = False)]
+        }
+    ]
+    for message_size,message_name in ((128,"128b"),((16 * 1024),"16kb"),((1024 * 1024),"1mb")):
+        scenarios.append({
+            "name": f"websocket_echo_{message_name}",
+            "kind": "websocket",
+            "connections": (4 if (message_size >= (1024 * 1024)) else 16),
+            "path": "/echo",
+            "frame": load.build_websocket_frame((bytes(range(256)) * ((message_size // 256) + 1))[:message_size])
+        })
+    return scenarios
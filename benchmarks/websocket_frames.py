@@ -0,0 +1,83 @@
+import os
+import sys
+import time
+import socket
+import threading
+
+import outside
+import outside.protocol_websocket
+import outside.activity_slots
+
+MESSAGE_SIZES = [1024,(64 * 1024),(8 * 1024 * 1024)]
+
+def build_frame(payload_data,mask_key):
+    header_data = bytearray([0x82])
+    payload_length = len(payload_data)
+    if (payload_length <= 125):
+        header_data.append(0x80 | payload_length)
+    elif (payload_length <= (2 ** 16 - 1)):
+        header_data.append(0x80 | 126)
+        header_data.extend(payload_length.to_bytes(2,"big"))
+    else:
+        header_data.append(0x80 | 127)
+        header_data.extend(payload_length.to_bytes(8,"big"))
+    header_data.extend(mask_key)
+    return (bytes(header_data) + outside.protocol_websocket.toggle_mask(bytearray(payload_data),mask_key))
+
+def read_frame_bytewise(http_socket):
+    # The previous reader, kept as the baseline: one recv call per byte
+    first_byte = http_socket.recv(1)[0]
+    second_byte = http_socket.recv(1)[0]
+    payload_length = (second_byte & 0x7F)
+    if (payload_length == 126):
+        payload_length = int.from_bytes(http_socket.recv(2),"big")
+    elif (payload_length == 127):
+        payload_length = int.from_bytes(http_socket.recv(8),"big")
+    mask_key = http_socket.recv(4)
+    payload_data = bytearray()
+    for byte in range(payload_length):
+        payload_data.extend(http_socket.recv(1))
+    toggled_data = bytearray()
+    for byte in range(len(payload_data)):
+        toggled_data.append(payload_data[byte] ^ mask_key[byte % 4])
+    return toggled_data
+
+def send_frames(sending_socket,frame_data,frame_count):
+    for frame_index in range(frame_count):
+        sending_socket.sendall(frame_data)
+
+def run_benchmark(message_size,total_size,use_reader):
+    payload_data = os.urandom(message_size)
+    frame_data = build_frame(payload_data,os.urandom(4))
+    frame_count = max((total_size // message_size),1)
+    activity_slot = outside.activity_slots.create_slots(1)[0]
+    sending_socket,receiving_socket = socket.socketpair()
+    send_thread = threading.Thread(target = send_frames,args = [sending_socket,frame_data,frame_count],daemon = True)
+
+    frame_reader = outside.protocol_websocket.FrameReader(receiving_socket,activity_slot,message_size)
+    start_time = time.perf_counter()
+    send_thread.start()
+    for frame_index in range(frame_count):
+        if (use_reader):
+            received_data = frame_reader.read_frame()[2]
+        else:
+            received_data = read_frame_bytewise(receiving_socket)
+    elapsed_time = (time.perf_counter() - start_time)
+
+    send_thread.join()
+    sending_socket.close()
+    receiving_socket.close()
+    if (received_data != payload_data):
+        raise ValueError("Received payload does not match.")
+    return ((frame_count * message_size) / elapsed_time / (1024 * 1024))
+
+if (__name__ == "__main__"):
+    total_size = (256 * 1024 * 1024)
+    if (len(sys.argv) > 1):
+        total_size = (int(sys.argv[1]) * 1024 * 1024)
+    print(f"[BENCH] numpy unmasking: {str(outside.protocol_websocket.numpy != None)}")
+    for message_size in MESSAGE_SIZES:
+        if (message_size <= (64 * 1024)):
+            # The bytewise reader is far too slow for large totals
+            print(f"[BENCH] {str(message_size // 1024)}KB messages, bytewise: {str(round(run_benchmark(message_size,(1024 * 1024),False),1))} MB/s")
+        print(f"[BENCH] {str(message_size // 1024)}KB messages, frame reader: {str(round(run_benchmark(message_size,total_size,True),1))} MB/s")
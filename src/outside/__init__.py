@@ -1,11 +1,22 @@
 import time
 import sys
+import os
 import socket
 import signal
 import multiprocessing
-import queue
+import threading
 
+from . import log
 from . import protocol_http
+from . import protocol_http_async
+from . import activity_slots
+from . import route_table
+from . import tls_context
+from . import file_cache
+from . import compression
+from . import pubsub
+from . import metrics
+from . import profiling
 from . import code_description
 
 class OutsideHTTP:
@@ -14,21 +25,70 @@ class OutsideHTTP:
             "host": ("0.0.0.0",80), # The Host (IP,Port)
             "backlog_length": 50, # Amount of waiting clients allowed
             "max_workers": 150, # Max. amount of ongoing requests (running subprocesses) allowed (includes websockets)
+            "worker_pool": None, # Serve connections from long-lived workers instead of one process per connection (None, "process" or "thread")
+            "acceptors": 1, # Amount of processes accepting on their own SO_REUSEPORT socket, each running its share of "max_workers"
+            "worker_pool_size": 0, # Amount of pool workers, 0 means "max_workers" (never more than "max_workers")
             "process_timeout": 60, # Time until a process with no send/recv activity gets terminated
             "termination_timeout": 5, # Time until a process which is being terminated is getting killed
             "recv_size": 1024, # Receiving packet size
+            "max_head_size_kb": 16, # Max. size of the request line and headers (431 if exceeded)
+            "max_header_count": 100, # Max. amount of header fields (431 if exceeded)
+            "max_url_length": 8192, # Max. length of the request line in bytes (414 if exceeded)
             "send_size": 1024, # Sending packet size
             "keep_alive": True, # Allow more requests after one request is finished over the same socket
             "max_socket_reuse": 100, # How often one socket can be used using "Connection: keep-alive"
+            "keep_alive_timeout": 5, # Time an idle keep-alive connection waits for its next request before being closed
             "ssl_enabled": False, # Enable/Disable SSL
             "ssl_keyfile": "", # SSL Private Key File, e.g.: "/etc/letsencrypt/live/billplayz.de/privkey.pem"
             "ssl_certfile": "", # SSL Public Certificate, e.g.: "/etc/letsencrypt/live/billplayz.de/cert.pem"
+            "ssl_session_tickets": 2, # Amount of TLS 1.3 session tickets sent for resumption (0 disables tickets)
+            "ssl_alpn_protocols": ["http/1.1"], # Protocols offered via ALPN
+            "ssl_reload_signal": getattr(signal,"SIGHUP",None), # Reload "ssl_keyfile" and "ssl_certfile" without a restart when this signal is received (None disables it, Windows has no SIGHUP)
             "accept_timeout": 1, # Interval between checking running processes for activity
             "max_body_size_mb": 250, # Max. upload (from client) body size
-            "allow_range_from_mb": 50, # Request browser to split the request into multiple from x+ MB response size ("FilePath" response only)
+            "body_spool_mb": 8, # Bodies above x MB are written to a temporary file instead of memory (see Request.stream/Request.body_file)
+            "body_buffer_kb": 64, # Receiving buffer size for bodies written to a temporary file
+            "allow_range_from_mb": 0, # Accept range requests for "FilePath" responses from x+ MB file size (-1 disables range requests)
+            "max_range_count": 16, # Range headers with more ranges are ignored and the full file is sent
             "big_definition_mb": 50, # x MB is considered as "big" and response gets sent with higher transmission speed (increses latency)
             "big_send_limit_mb": 100, # x MB is the max. packet send size for "big" responses
+            "sendfile_size_mb": 8, # Max. amount of "FilePath" data sent per sendfile call (activity is reported in between)
+            "file_buffer_kb": 256, # Buffer size for reading "FilePath" data on SSL sockets (sendfile is not possible there)
+            "file_cache_mb": 32, # Memory for caching small "FilePath" files sent over TLS, plain connections use sendfile (0 disables the cache)
+            "file_cache_max_kb": 256, # Files above x KB are never cached, with "file_cache_shared" every cached file takes x KB
+            "file_cache_shared": True, # Share the cache between all worker processes (needed for cache hits with one process per connection)
+            "file_cache_control": "no-cache", # Cache-Control header added to "FilePath" responses (None to leave it out)
+            "compression": True, # Compress responses with gzip/deflate if the client accepts it
+            "compression_level": 6, # zlib compression level (1-9), can be overridden per route with set_route(compression_level = x), 0 disables compression
+            "compression_min_size": 1024, # Responses below x bytes are sent uncompressed
+            "compression_types": ["text/","application/json","application/javascript","application/xml","image/svg+xml"], # Content-Type prefixes which get compressed
+            "compression_file_max_mb": 16, # "FilePath" files above x MB are only sent compressed if a ".gz" file exists next to them
+            "compression_cache_mb": 64, # Disk space for compressed variants of "FilePath" files (0 disables compressing files)
+            "compression_cache_dir": None, # Directory for the compressed variants, None creates a temporary directory
+            "websocket_queue_length": 16, # Received websocket messages waiting for connection.recv(), the client is not read from while the queue is full
+            "websocket_max_message_mb": 64, # Max. size of a received websocket message (also after decompressing), bigger messages close the connection
+            "websocket_deflate": True, # Negotiate permessage-deflate compression with websocket clients offering it
+            "websocket_deflate_level": 6, # zlib compression level for sent websocket messages
+            "websocket_deflate_min_size": 256, # Websocket messages below x bytes are sent uncompressed
+            "websocket_deflate_window_bits": 15, # Max. deflate window (9-15) used for sent messages, smaller windows need less memory per connection
+            "websocket_deflate_no_context_takeover": False, # Compress every sent message on its own instead of keeping the compression context (less memory, worse ratio)
+            "websocket_hub": False, # Start a hub process for connection.subscribe(topic) and server.hub.publish(topic,data)
+            "websocket_hub_queue_length": 256, # Published messages queued per subscribed connection, connections falling further behind are closed
+            "log_level": "INFO", # Messages below this level are not written ("DEBUG" adds a few lines per request, "INFO", "WARN", "ERROR" or "NONE")
+            "access_log": None, # Write one record per response to this file ("-" for stdout), None disables the access log
+            "access_log_format": "clf", # "clf" (Common Log Format) or "json" (one object per line)
+            "access_log_flush_interval": 1, # Access log records are collected per worker and written by a background thread every x seconds
+            "access_log_batch_size": 256, # ... or as soon as x records are waiting
+            "metrics": False, # Count requests, status codes, bytes and phase latencies per route in shared memory (see server.metrics)
+            "metrics_route": "/metrics", # Serve the metrics in the Prometheus text format on this route (None to not serve them)
+            "profile_sample_rate": 0, # Profile this fraction (0-1) of all requests with cProfile, from the handler until the response is sent
+            "profile_routes": [], # Profile every request to these routes (as passed to set_route)
+            "profile_dir": None, # Directory for the profiles (one pstats file "<route>.prof" per route), None creates a temporary directory
+            "profile_flush_interval": 5, # Workers merge their profiles into "profile_dir" every x seconds and when they exit
+            "profile_route": None, # Serve the profiles as text on this route, e.g. "/_profile" (?route=/x&sort=cumulative&limit=40)
+            "profile_slow_ms": 0, # Log the head, handler and send time of requests taking x ms or longer (0 disables it)
             "post_callback": None, # Call this function with the request and response data for e.g. statistics
+            "pre_body": None, # Call this function with the request before its body is received, return a Response or (status_code, message) to reject it
             "pre_send": None, # Modify the final response before sending
             "server_cleanup": None # Call this function after the webserver has terminated
         }
@@ -36,9 +96,12 @@ class OutsideHTTP:
 
         self._active_requests = []
         self._routes = {}
-        self._route_names = []
+        self._route_table = None
         self._error_routes = {}
         self._is_halting = False
+        self._main_socket = None
+        self.hub = None
+        self.metrics = None
 
         def _create_errorhandler(error_code,error_description):
             def _errorhandler(request,message = None):
@@ -53,16 +116,31 @@ class OutsideHTTP:
         for error_code,error_description in code_description.code_info.items():
             self.set_errorhandler(error_code,_create_errorhandler(error_code,error_description))
 
-    def set_route(self,route,handler):
-        self._routes[route] = handler
-        self._route_names.append(route)
-        self._route_names.sort(
-            key = len,
-            reverse = True
-        )
+    def set_route(self,route,handler,methods = None,exact = False,compression_level = None):
+        route_data = self._routes.get(route)
+        if ((not route_data) or (route_data["exact"] != exact)):
+            route_data = {
+                "exact": exact,
+                "handlers": {},
+                "compression_level": None
+            }
+            self._routes[route] = route_data
+        if (compression_level != None):
+            route_data["compression_level"] = compression_level
+        if (methods == None):
+            route_data["handlers"][None] = handler
+        else:
+            for method in methods:
+                route_data["handlers"][method.upper()] = handler
 
-    def remove_route(self,route):
-        del self._routes[route]
+    def remove_route(self,route,methods = None):
+        if (methods == None):
+            del self._routes[route]
+        else:
+            for method in methods:
+                del self._routes[route]["handlers"][method.upper()]
+            if (not self._routes[route]["handlers"]):
+                del self._routes[route]
 
     def set_errorhandler(self,errorcode,handler):
         self._error_routes[errorcode] = handler
@@ -72,52 +150,63 @@ class OutsideHTTP:
 
     def terminate(self,signum = None,stackframe = None):
         if (self._is_halting):
-            print(f"[MAIN/HTTP - WARN] Multiple signals received.")
+            log.warn("MAIN/HTTP","Multiple signals received.")
             return
         if (signum):
-            print(f"[MAIN/HTTP - INFO] Signal {signum} received.")
+            log.info("MAIN/HTTP",f"Signal {signum} received.")
         else:
-            print("[MAIN/HTTP - INFO] No signal received.")
-        print(f"[MAIN/HTTP - INFO] Terminating, closing sockets.")
+            log.info("MAIN/HTTP","No signal received.")
+        log.info("MAIN/HTTP","Terminating, closing sockets.")
         self._is_halting = True
 
-        self._main_socket.shutdown(socket.SHUT_RDWR)
-        self._main_socket.close()
+        self._close_main_socket()
 
-        for running_process,activity_queue,process_data in self._active_requests:
-            if (self._check_process(running_process)):
-                running_process.terminate()
-                print(f"[MAIN/HTTP - INFO] Waiting on {process_data['address'][0]} to terminate in final steps.")
-                running_process.join(timeout = self.config["termination_timeout"])
-                if (self._check_process(running_process)):
-                    print(f"[MAIN/HTTP - ERROR] Killing {process_data['address'][0]} in final steps. (Did not terminate!)")
-                    running_process.kill()
-                else:
-                    print(f"[MAIN/HTTP - INFO] {process_data['address'][0]} exited in final steps.")
-            else:
-                print(f"[MAIN/HTTP - WARN] {process_data['address'][0]} is already terminated in final steps. (Low rate!)")
-
-        self._active_requests = []
-        print("[MAIN/HTTP - INFO] All processes have exited.")
+        termination_timeout = self.config["termination_timeout"]
+        if (self.config["acceptors"] > 1):
+            # Acceptors need their own termination timeout to stop their processes
+            termination_timeout = (termination_timeout * 2)
+        self._terminate_workers(termination_timeout)
+        log.info("MAIN/HTTP","All processes have exited.")
         if (self.config["server_cleanup"]):
-            print("[MAIN/HTTP - INFO] Running server cleanup.")
+            log.info("MAIN/HTTP","Running server cleanup.")
             self.config["server_cleanup"]()
-        print("[MAIN/HTTP - INFO] Terminated.")
+        compression.remove_cache_directory()
+        pubsub.stop_hub()
+        profiling.flush()
+        profiling.remove_directory()
+        log.info("MAIN/HTTP","Terminated.")
+        log.flush()
         sys.exit(0)
 
     def run(self):
         signal.signal(signal.SIGINT,self.terminate)
         signal.signal(signal.SIGTERM,self.terminate)
 
-        self._main_socket = socket.socket(
-            family = socket.AF_INET,
-            type = socket.SOCK_STREAM
-        )
-        self._main_socket.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEADDR,1)
-        self._main_socket.bind(self.config["host"])
-        self._main_socket.listen(self.config["backlog_length"])
+        # The module state of log, profiling, metrics, tls_context, file_cache, compression and pubsub is set up here, before
+        # any worker is started: forked workers inherit it, and the parts living in shared memory are shared by all of them
+        log.configure(self.config)
+        self._load_profiling()
+        connection_capacity = self.config["max_workers"]
+        if (self.config["worker_pool"]):
+            connection_capacity = self._get_pool_size()
+        self._load_metrics(connection_capacity,self.config["max_workers"])
+        self._route_table = route_table.RouteTable(self._routes)
+        self._load_tls_context()
+        file_cache.get_cache(self.config)
+        compression.get_cache_directory(self.config)
+        self.hub = pubsub.get_hub(self.config)
+        if (self.config["acceptors"] > 1):
+            self._run_acceptors()
+        self._main_socket = self._create_main_socket()
+        self._serve()
 
-        print(f"[MAIN/HTTP - INFO] Listening on {str(self.config['host'][1])}.")
+    def _serve(self):
+        self._activity_slots = activity_slots.create_slots(self.config["max_workers"])
+        self._free_slots = list(range(self.config["max_workers"]))
+
+        log.info("MAIN/HTTP",f"Listening on {str(self.config['host'][1])}.")
+        if (self.config["worker_pool"]):
+            self._run_pool()
         last_inactive_check = (-self.config["accept_timeout"])
         while (True):
             try:
@@ -130,59 +219,324 @@ class OutsideHTTP:
                 
                 self._main_socket.settimeout(next_inactive_check)
                 accepted_socket,address = self._main_socket.accept()
-                print(f"[MAIN/HTTP - INFO] Connected to {address[0]}:{str(address[1])}.")
+                log.debug("MAIN/HTTP","Connected to %s:%d.",address[0],address[1])
             except socket.timeout:
                 last_inactive_check = time.perf_counter()
                 real_time = time.time()
-                for running_process,activity_queue,process_data in self._active_requests:
+                for running_process,slot_index,process_data in list(self._active_requests):
                     if (not self._check_process(running_process)):
-                        print(f"[MAIN/HTTP - INFO] Removing {process_data['address'][0]}:{str(process_data['address'][1])}. (Process exited)")
-                        self._active_requests.remove((running_process,activity_queue,process_data))
+                        log.debug("MAIN/HTTP","Removing %s:%d. (Process exited)",process_data["address"][0],process_data["address"][1])
+                        self._active_requests.remove((running_process,slot_index,process_data))
+                        metrics.reset_worker(slot_index)
+                        self._free_slots.append(slot_index)
                         continue
-                    self._check_process_activity(activity_queue,process_data)
-                    if ((real_time - process_data["last_activity"]) >= self.config["process_timeout"]):
+                    if (self._activity_slots[slot_index].is_inactive(self.config["process_timeout"])):
                         if (process_data.get("terminating_at")):
                             if ((real_time - process_data["terminating_at"]) >= self.config["termination_timeout"]):
-                                print(f"[MAIN/HTTP - ERROR] Killing {process_data['address'][0]}:{str(process_data['address'][1])}. (Did not terminate!)")
+                                log.error("MAIN/HTTP",f"Killing {process_data['address'][0]}:{str(process_data['address'][1])}. (Did not terminate! {self._activity_slots[slot_index].describe()})")
                                 running_process.kill()
-                                self._active_requests.remove((running_process,activity_queue,process_data))
+                                running_process.join()
+                                self._active_requests.remove((running_process,slot_index,process_data))
+                                metrics.reset_worker(slot_index)
+                                self._free_slots.append(slot_index)
                         else:
-                            print(f"[MAIN/HTTP - INFO] Terminating {process_data['address'][0]}:{str(process_data['address'][1])}. (No further activity!)")
+                            log.info("MAIN/HTTP",f"Terminating {process_data['address'][0]}:{str(process_data['address'][1])}. (No further activity! {self._activity_slots[slot_index].describe()})")
                             running_process.terminate()
                             process_data["terminating_at"] = real_time
             except OSError:
                 continue
             else:
-                new_queue = multiprocessing.Queue()
+                slot_index = self._free_slots.pop()
+                self._activity_slots[slot_index].reset(activity_slots.SLOT_RECEIVING)
                 new_process = multiprocessing.Process(
                     target = protocol_http.process_request,
                     name = f"[outside] {address[0]}:{str(address[1])}",
                     daemon = False,
-                    args = [new_queue,accepted_socket,address,self.config,self._route_names,self._routes,self._error_routes]
+                    args = [self._activity_slots,slot_index,accepted_socket,address,self.config,self._route_table,self._error_routes]
                 )
                 new_process.start()
                 self._active_requests.append(
                     (
                         new_process,
-                        new_queue,
+                        slot_index,
                         {
-                            "last_activity": time.time(),
-                            "address": address
+                            "address": address,
+                            "name": address[0]
                         }
                     )
                 )
 
+    def _terminate_workers(self,termination_timeout):
+        for running_process,slot_index,process_data in self._active_requests:
+            if (self._check_process(running_process)):
+                if (isinstance(running_process,threading.Thread)):
+                    log.info("MAIN/HTTP",f"Waiting on {process_data['name']} to finish in final steps.")
+                    running_process.join(timeout = termination_timeout)
+                    continue
+                running_process.terminate()
+                log.info("MAIN/HTTP",f"Waiting on {process_data['name']} to terminate in final steps.")
+                running_process.join(timeout = termination_timeout)
+                if (self._check_process(running_process)):
+                    log.error("MAIN/HTTP",f"Killing {process_data['name']} in final steps. (Did not terminate!)")
+                    running_process.kill()
+                else:
+                    log.info("MAIN/HTTP",f"{process_data['name']} exited in final steps.")
+            else:
+                log.warn("MAIN/HTTP",f"{process_data['name']} is already terminated in final steps. (Low rate!)")
+        self._active_requests = []
+
+    def _load_metrics(self,connection_capacity,worker_count):
+        if (self.config["metrics"] and self.config["metrics_route"]):
+            self.set_route(self.config["metrics_route"],self._metrics_route,methods = ["GET"],exact = True)
+        self.metrics = metrics.get_metrics(self.config,self._routes.keys(),connection_capacity,worker_count)
+
+    def _metrics_route(self,request):
+        return protocol_http.Response(
+            status_code = 200,
+            headers = {
+                "Content-Type": "text/plain; version=0.0.4; charset=utf-8",
+                "Cache-Control": "no-store"
+            },
+            content = self.metrics.render()
+        )
+
+    def _load_profiling(self):
+        profiling.configure(self.config)
+        if (profiling.profile_config and self.config["profile_route"]):
+            self.set_route(self.config["profile_route"],self._profile_route,methods = ["GET"],exact = True)
+
+    def _profile_route(self,request):
+        try:
+            profile_report = profiling.render(request.params.get("route"),request.params.get("sort","cumulative"),int(request.params.get("limit",40)))
+        except (KeyError,ValueError):
+            return (400,"Unknown sort key or limit.")
+        except FileNotFoundError:
+            return (404,"This route has not been profiled yet.")
+        return protocol_http.Response(
+            status_code = 200,
+            headers = {
+                "Content-Type": "text/plain; charset=utf-8",
+                "Cache-Control": "no-store"
+            },
+            content = profile_report
+        )
+
+    def _load_tls_context(self):
+        if (not self.config["ssl_enabled"]):
+            return
+        tls_context.server_context = tls_context.create_context(self.config)
+        if (self.config["ssl_reload_signal"] != None):
+            signal.signal(self.config["ssl_reload_signal"],self._reload_certificate)
+
+    def _reload_certificate(self,signum = None,stackframe = None):
+        tls_context.reload_certificate(self.config)
+        for running_process,slot_index,process_data in self._active_requests:
+            # Processes serving a single connection keep the certificate they started with
+            if (process_data.get("long_lived") and isinstance(running_process,multiprocessing.Process) and self._check_process(running_process)):
+                os.kill(running_process.pid,signum)
+
+    def _create_main_socket(self,reuse_port = False):
+        main_socket = socket.socket(
+            family = socket.AF_INET,
+            type = socket.SOCK_STREAM
+        )
+        main_socket.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEADDR,1)
+        if (reuse_port):
+            main_socket.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEPORT,1)
+        main_socket.bind(self.config["host"])
+        main_socket.listen(self.config["backlog_length"])
+        return main_socket
+
+    def _close_main_socket(self):
+        if (not self._main_socket):
+            return
+        self._main_socket.shutdown(socket.SHUT_RDWR)
+        self._main_socket.close()
+
+    def _run_acceptors(self):
+        acceptor_count = min(self.config["acceptors"],self.config["max_workers"])
+        for acceptor_index in range(acceptor_count):
+            self._active_requests.append(self._start_acceptor(acceptor_index))
+        log.info("MAIN/HTTP",f"Started {str(acceptor_count)} acceptors on {str(self.config['host'][1])}.")
+        self._supervise_processes(self._start_acceptor)
+
+    def _start_acceptor(self,acceptor_index):
+        new_process = multiprocessing.Process(
+            target = self._run_acceptor,
+            name = f"[outside] acceptor {str(acceptor_index)}",
+            daemon = False,
+            args = [acceptor_index]
+        )
+        new_process.start()
+        return (
+            new_process,
+            None,
+            {
+                "name": f"acceptor {str(acceptor_index)}",
+                "long_lived": True
+            }
+        )
+
+    def _run_acceptor(self,acceptor_index):
+        signal.signal(signal.SIGINT,self._terminate_acceptor)
+        signal.signal(signal.SIGTERM,self._terminate_acceptor)
+
+        acceptor_count = min(self.config["acceptors"],self.config["max_workers"])
+        max_workers = (self.config["max_workers"] // acceptor_count)
+        if (acceptor_index < (self.config["max_workers"] % acceptor_count)):
+            max_workers = (max_workers + 1)
+        metrics.set_worker_offset((acceptor_index * (self.config["max_workers"] // acceptor_count)) + min(acceptor_index,(self.config["max_workers"] % acceptor_count)))
+        self.config = dict(self.config)
+        self.config["max_workers"] = max_workers
+        self._active_requests = []
+
+        self._main_socket = self._create_main_socket(reuse_port = True)
+        self._serve()
+
+    def _terminate_acceptor(self,signum = None,stackframe = None):
+        if (self._is_halting):
+            return
+        self._is_halting = True
+        self._close_main_socket()
+        self._terminate_workers(self.config["termination_timeout"])
+        profiling.flush()
+        log.flush()
+        sys.exit(0)
+
+    def _supervise_processes(self,start_function):
+        while (True):
+            time.sleep(self.config["accept_timeout"])
+            for process_index,(running_process,slot_index,process_data) in enumerate(self._active_requests):
+                if (not self._check_process(running_process)):
+                    log.warn("MAIN/HTTP",f"Restarting {process_data['name']}. (Process exited)")
+                    self._active_requests[process_index] = start_function(process_index)
+
+    def _run_pool(self):
+        if (self.config["worker_pool"] not in ("process","thread")):
+            raise ValueError(f"Unknown worker_pool mode: {self.config['worker_pool']}")
+        pool_size = self._get_pool_size()
+
+        for worker_index in range(pool_size):
+            self._active_requests.append(self._start_pool_worker(worker_index))
+        log.info("MAIN/HTTP",f"Started {str(pool_size)} {self.config['worker_pool']} workers.")
+
+        while (True):
+            time.sleep(self.config["accept_timeout"])
+            real_time = time.time()
+            for worker_index,(running_worker,slot_index,worker_data) in enumerate(self._active_requests):
+                if (not self._check_process(running_worker)):
+                    log.warn("MAIN/HTTP",f"Restarting {worker_data['name']}. (Worker exited)")
+                    self._active_requests[worker_index] = self._start_pool_worker(worker_index)
+                    continue
+                if (self._activity_slots[slot_index].is_inactive(self.config["process_timeout"])):
+                    if (isinstance(running_worker,threading.Thread)):
+                        if (not worker_data.get("terminating_at")):
+                            log.warn("MAIN/HTTP",f"{worker_data['name']} is stuck. (Threads can not be terminated! {self._activity_slots[slot_index].describe()})")
+                            worker_data["terminating_at"] = real_time
+                    elif (worker_data.get("terminating_at")):
+                        if ((real_time - worker_data["terminating_at"]) >= self.config["termination_timeout"]):
+                            log.error("MAIN/HTTP",f"Killing {worker_data['name']}. (Did not terminate! {self._activity_slots[slot_index].describe()})")
+                            running_worker.kill()
+                    else:
+                        log.info("MAIN/HTTP",f"Terminating {worker_data['name']}. (No further activity! {self._activity_slots[slot_index].describe()})")
+                        running_worker.terminate()
+                        worker_data["terminating_at"] = real_time
+                elif (worker_data.get("terminating_at")):
+                    del worker_data["terminating_at"]
+
+    def _get_pool_size(self):
+        pool_size = self.config["worker_pool_size"]
+        if ((pool_size <= 0) or (pool_size > self.config["max_workers"])):
+            pool_size = self.config["max_workers"]
+        return pool_size
+
+    def _start_pool_worker(self,worker_index):
+        worker_name = f"[outside] pool worker {str(worker_index)}"
+        worker_args = [self._activity_slots,worker_index,self._main_socket,self.config,self._route_table,self._error_routes]
+        self._activity_slots[worker_index].reset()
+        metrics.reset_worker(worker_index)
+        if (self.config["worker_pool"] == "thread"):
+            new_worker = threading.Thread(
+                target = protocol_http.serve_pool,
+                name = worker_name,
+                daemon = True,
+                args = worker_args
+            )
+        else:
+            new_worker = multiprocessing.Process(
+                target = protocol_http.pool_worker,
+                name = worker_name,
+                daemon = False,
+                args = worker_args
+            )
+        new_worker.start()
+        return (
+            new_worker,
+            worker_index,
+            {
+                "name": f"pool worker {str(worker_index)}",
+                "long_lived": True
+            }
+        )
+
     def _check_process(self,process):
+        if (isinstance(process,threading.Thread)):
+            return process.is_alive()
         return (process.exitcode == None)
-    
-    def _check_process_activity(self,activity_queue,process_data):
-        while True:
-            try:
-                queue_item = activity_queue.get(block = False)
-            except queue.Empty:
-                return
-            if (process_data["last_activity"] < queue_item):
-                process_data["last_activity"] = queue_item
+
+class OutsideAsyncHTTP(OutsideHTTP):
+    def __init__(self,host):
+        super().__init__(host)
+        self.config["event_loops"] = 0 # Amount of event loop processes, 0 means one per CPU core
+        self.config["max_connections"] = 10000 # Max. amount of open connections per event loop (includes keep-alive connections)
+        self.config["max_workers"] = 32 # Max. amount of threads per event loop running non-async handlers
+        self.config["websocket_ping_interval"] = 20 # Websockets silent for x seconds are pinged (0 disables pings)
+        self.config["websocket_ping_timeout"] = 20 # Websockets not answering a ping within x seconds are closed
+
+    def run(self):
+        signal.signal(signal.SIGINT,self.terminate)
+        signal.signal(signal.SIGTERM,self.terminate)
+
+        log.configure(self.config)
+        self._load_profiling()
+        loop_count = self.config["event_loops"]
+        if (loop_count <= 0):
+            loop_count = (os.cpu_count() or 1)
+        self._load_metrics((self.config["max_connections"] * loop_count),loop_count)
+        self._route_table = route_table.RouteTable(self._routes)
+        self._load_tls_context()
+        file_cache.get_cache(self.config)
+        compression.get_cache_directory(self.config)
+        self.hub = pubsub.get_hub(self.config)
+        self._main_socket = self._create_main_socket()
+
+        log.info("MAIN/HTTP",f"Listening on {str(self.config['host'][1])}.")
+        for loop_index in range(loop_count):
+            self._active_requests.append(self._start_event_loop(loop_index))
+        log.info("MAIN/HTTP",f"Started {str(loop_count)} event loops.")
+        self._supervise_processes(self._start_event_loop)
+
+    def _close_main_socket(self):
+        # The event loops keep listening on their copy until they are terminated
+        self._main_socket.close()
+
+    def _start_event_loop(self,loop_index):
+        metrics.reset_worker(loop_index)
+        new_process = multiprocessing.Process(
+            target = protocol_http_async.run_event_loop,
+            name = f"[outside] event loop {str(loop_index)}",
+            daemon = False,
+            args = [loop_index,self._main_socket,self.config,self._route_table,self._error_routes]
+        )
+        new_process.start()
+        return (
+            new_process,
+            None,
+            {
+                "name": f"event loop {str(loop_index)}",
+                "long_lived": True
+            }
+        )
 
 class OutsideHTTP_Redirect:
     def __init__(self,host,destination):
@@ -0,0 +1,67 @@
+import ctypes
+import multiprocessing
+import time
+
+SLOT_IDLE = 0
+SLOT_RECEIVING = 1
+SLOT_HANDLING = 2
+SLOT_SENDING = 3
+SLOT_WEBSOCKET = 4
+SLOT_KEEP_ALIVE = 5
+
+state_names = {
+    SLOT_IDLE: "idle",
+    SLOT_RECEIVING: "receiving",
+    SLOT_HANDLING: "handling",
+    SLOT_SENDING: "sending",
+    SLOT_WEBSOCKET: "websocket",
+    SLOT_KEEP_ALIVE: "keep-alive"
+}
+
+class ActivitySlot(ctypes.Structure):
+    # Every slot is only written by the worker owning it, the supervisor only reads
+    _fields_ = [
+        ("last_activity",ctypes.c_double),
+        ("bytes_sent",ctypes.c_uint64),
+        ("bytes_received",ctypes.c_uint64),
+        ("requests",ctypes.c_uint64),
+        ("state",ctypes.c_int32),
+        ("route",ctypes.c_char * 128)
+    ]
+
+    def report(self,bytes_sent = 0):
+        self.last_activity = time.monotonic()
+        self.bytes_sent = (self.bytes_sent + bytes_sent)
+
+    def report_received(self,bytes_received):
+        self.last_activity = time.monotonic()
+        self.bytes_received = (self.bytes_received + bytes_received)
+
+    def set_state(self,state,route = None):
+        self.last_activity = time.monotonic()
+        self.state = state
+        if (route != None):
+            self.route = route.encode("utf-8")[:127]
+
+    def reset(self,state = SLOT_IDLE):
+        self.last_activity = time.monotonic()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.requests = 0
+        self.state = state
+        self.route = b""
+
+    def is_inactive(self,timeout):
+        # Keep-alive slots are closed by the worker itself after keep_alive_timeout
+        return ((self.state not in (SLOT_IDLE,SLOT_KEEP_ALIVE)) and ((time.monotonic() - self.last_activity) >= timeout))
+
+    def describe(self):
+        # What the worker was doing, for the supervisor's log lines about it
+        return (
+            f"{state_names.get(self.state,'unknown')} {self.route.decode('utf-8','replace') or '-'}, "
+            f"{str(self.requests)} requests, {str(self.bytes_received)}B received, {str(self.bytes_sent)}B sent, "
+            f"idle for {(time.monotonic() - self.last_activity):.1f}s"
+        )
+
+def create_slots(slot_count):
+    return multiprocessing.RawArray(ActivitySlot,slot_count)
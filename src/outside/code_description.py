@@ -68,4 +68,10 @@ code_info = {
 }
 
 def get_description(code):
-    return code_info[code]
\ No newline at end of file
+    return code_info[code]
+
+# Encoded once at import, every response head starts with one of these
+status_lines = {code: f"HTTP/1.1 {str(code)} {description}\r\n".encode("utf-8") for code,description in code_info.items()}
+
+def get_status_line(code):
+    return status_lines[code]
@@ -0,0 +1,169 @@
+import os
+import zlib
+import hashlib
+import tempfile
+import shutil
+
+# All workers write their compressed variants to this directory
+cache_directory = None
+created_directory = False
+
+encoding_suffixes = {
+    "gzip": ".gz",
+    "deflate": ".zz"
+}
+
+def select_encoding(accept_encoding):
+    if (not accept_encoding):
+        return None
+    encoding_weights = {}
+    for encoding_item in accept_encoding.split(","):
+        encoding_name,parameter_separator,encoding_parameters = encoding_item.partition(";")
+        encoding_weight = 1.0
+        for encoding_parameter in encoding_parameters.split(";"):
+            parameter_name,value_separator,parameter_value = encoding_parameter.partition("=")
+            if (parameter_name.strip().lower() == "q"):
+                try:
+                    encoding_weight = float(parameter_value)
+                except ValueError:
+                    encoding_weight = 0.0
+        encoding_weights[encoding_name.strip().lower()] = encoding_weight
+
+    # gzip is preferred on equal weight, "*" stands for every encoding not listed
+    best_encoding = None
+    best_weight = 0.0
+    for encoding_name in ("gzip","deflate"):
+        encoding_weight = encoding_weights.get(encoding_name,encoding_weights.get("*",0.0))
+        if (encoding_weight > best_weight):
+            best_encoding = encoding_name
+            best_weight = encoding_weight
+    return best_encoding
+
+def is_compressible(content_type,config):
+    if (not content_type):
+        return False
+    content_type = content_type.partition(";")[0].strip().lower()
+    for allowed_type in config["compression_types"]:
+        if (content_type.startswith(allowed_type)):
+            return True
+    return False
+
+def get_level(request_class,config):
+    if (request_class._compression_level != None):
+        return request_class._compression_level
+    return config["compression_level"]
+
+def create_compressor(encoding,level):
+    if (encoding == "gzip"):
+        return zlib.compressobj(level,zlib.DEFLATED,31)
+    return zlib.compressobj(level,zlib.DEFLATED,15)
+
+def compress(data,encoding,level):
+    compressor = create_compressor(encoding,level)
+    return (compressor.compress(data) + compressor.flush())
+
+def add_vary(response_class):
+    vary_header = response_class.headers.get("Vary")
+    if (not vary_header):
+        response_class.headers["Vary"] = "Accept-Encoding"
+    elif ("accept-encoding" not in vary_header.lower()):
+        response_class.headers["Vary"] = f"{vary_header}, Accept-Encoding"
+
+def compress_response(request_class,response_class,config):
+    if ((not config["compression"]) or (response_class.status_code in (101,204,206,304)) or response_class.headers.get("Content-Encoding")):
+        return
+    if (not is_compressible(response_class.headers.get("Content-Type"),config)):
+        return
+    add_vary(response_class)
+    compression_level = get_level(request_class,config)
+    content_encoding = select_encoding(request_class.headers.get("Accept-Encoding"))
+    if ((compression_level <= 0) or (not content_encoding)):
+        return
+    if (isinstance(response_class.content,bytes)):
+        if (len(response_class.content) < config["compression_min_size"]):
+            return
+        response_class.content = compress(response_class.content,content_encoding,compression_level)
+    else:
+        # Streams are compressed chunk by chunk, their size is unknown up front
+        response_class.content._compressor = create_compressor(content_encoding,compression_level)
+    response_class.headers["Content-Encoding"] = content_encoding
+
+def select_file_variant(request_class,response_class,config):
+    # Returns the path and encoding to send instead: a ".gz" sidecar next to the file or a variant from the compression cache
+    file_path = response_class.content
+    if ((not config["compression"]) or response_class.headers.get("Content-Encoding") or (file_path._segments != None)):
+        return None,None
+    if ((file_path.read_start != 0) or (file_path.read_end != file_path._stat_result.st_size)):
+        return None,None
+    if (not is_compressible(response_class.headers.get("Content-Type"),config)):
+        return None,None
+    add_vary(response_class)
+    compression_level = get_level(request_class,config)
+    content_encoding = select_encoding(request_class.headers.get("Accept-Encoding"))
+    if ((compression_level <= 0) or (not content_encoding) or (file_path._stat_result.st_size < config["compression_min_size"])):
+        return None,None
+
+    if (content_encoding == "gzip"):
+        try:
+            if (os.stat(file_path.path + ".gz").st_mtime_ns >= file_path._stat_result.st_mtime_ns):
+                return (file_path.path + ".gz"),content_encoding
+        except OSError:
+            pass
+    if (file_path._stat_result.st_size <= (config["compression_file_max_mb"] * 1024 * 1024)):
+        return get_cached_variant(file_path,content_encoding,compression_level,config),content_encoding
+    return None,None
+
+def get_cached_variant(file_path,content_encoding,compression_level,config):
+    cache_path = get_cache_directory(config)
+    if (not cache_path):
+        return None
+    stat_result = file_path._stat_result
+    variant_key = f"{file_path.path}:{str(stat_result.st_mtime_ns)}:{str(stat_result.st_size)}:{str(compression_level)}"
+    variant_path = os.path.join(cache_path,(hashlib.sha1(variant_key.encode("utf-8")).hexdigest() + encoding_suffixes[content_encoding]))
+    if (os.path.exists(variant_path)):
+        return variant_path
+
+    # Written to a temporary name first, workers compressing the same file at once just replace each other's result
+    with open(file_path.path,"rb") as open_file:
+        compressed_data = compress(open_file.read(),content_encoding,compression_level)
+    temporary_descriptor,temporary_path = tempfile.mkstemp(dir = cache_path,suffix = ".tmp")
+    with os.fdopen(temporary_descriptor,"wb") as temporary_file:
+        temporary_file.write(compressed_data)
+    os.replace(temporary_path,variant_path)
+    trim_cache(cache_path,(config["compression_cache_mb"] * 1024 * 1024))
+    return variant_path
+
+def trim_cache(cache_path,max_size):
+    cached_files = []
+    cache_size = 0
+    for directory_entry in os.scandir(cache_path):
+        try:
+            entry_stat = directory_entry.stat()
+        except OSError:
+            continue
+        cached_files.append((entry_stat.st_mtime,entry_stat.st_size,directory_entry.path))
+        cache_size = (cache_size + entry_stat.st_size)
+    # Oldest variants are removed first
+    for file_mtime,file_size,file_path in sorted(cached_files):
+        if (cache_size <= max_size):
+            break
+        try:
+            os.remove(file_path)
+        except OSError:
+            pass
+        cache_size = (cache_size - file_size)
+
+def get_cache_directory(config):
+    global cache_directory,created_directory
+    if ((cache_directory == None) and (config["compression_cache_mb"] > 0)):
+        if (config["compression_cache_dir"]):
+            cache_directory = config["compression_cache_dir"]
+            os.makedirs(cache_directory,exist_ok = True)
+        else:
+            cache_directory = tempfile.mkdtemp(prefix = "outside-compression-")
+            created_directory = True
+    return cache_directory
+
+def remove_cache_directory():
+    if (created_directory and cache_directory):
+        shutil.rmtree(cache_directory,ignore_errors = True)
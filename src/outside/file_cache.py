@@ -0,0 +1,168 @@
+import ctypes
+import multiprocessing
+import threading
+import collections
+import email.utils
+import zlib
+
+# Entries and file contents live in shared memory, a file read by one worker is cached for all of them
+server_cache = None
+
+CACHE_WAYS = 4
+
+class SharedCacheEntry(ctypes.Structure):
+    _fields_ = [
+        ("path",ctypes.c_char * 512),
+        ("mtime_ns",ctypes.c_int64),
+        ("size",ctypes.c_int64),
+        ("last_used",ctypes.c_uint64),
+        ("generation",ctypes.c_uint64)
+    ]
+
+class SharedFileCache:
+    # Set-associative cache in shared memory: a path can only live in the CACHE_WAYS entries of its set,
+    # every entry owns a block of max_file_size bytes and the least recently used entry of a set is replaced.
+    # Lookups take no lock: a writer makes the generation of its entry odd while it rewrites it, readers which saw an odd or
+    # changed generation treat the entry as a miss (a seqlock). Writers are serialized by a lock they never wait for,
+    # so a worker killed while storing can only stop further stores, never a response.
+    def __init__(self,cache_size,max_file_size):
+        self.max_file_size = max_file_size
+        self.set_count = max((cache_size // (max_file_size * CACHE_WAYS)),1)
+        self._entries = multiprocessing.RawArray(SharedCacheEntry,(self.set_count * CACHE_WAYS))
+        self._data = multiprocessing.RawArray(ctypes.c_char,(self.set_count * CACHE_WAYS * max_file_size))
+        self._clock = multiprocessing.RawValue(ctypes.c_uint64,0)
+        self._store_lock = multiprocessing.Lock()
+
+    def lookup(self,path,stat_result):
+        path_data = path.encode("utf-8")
+        set_start = self._get_set_start(path_data)
+        for entry_index in range(set_start,(set_start + CACHE_WAYS)):
+            cache_entry = self._entries[entry_index]
+            generation = cache_entry.generation
+            if ((generation & 1) or (cache_entry.path != path_data)):
+                continue
+            if ((cache_entry.mtime_ns != stat_result.st_mtime_ns) or (cache_entry.size != stat_result.st_size)):
+                return None
+            content = ctypes.string_at((ctypes.addressof(self._data) + (entry_index * self.max_file_size)),stat_result.st_size)
+            if (cache_entry.generation != generation):
+                return None
+            # Racing readers may lose an update of the clock, which only makes the replacement less exact
+            self._clock.value = (self._clock.value + 1)
+            cache_entry.last_used = self._clock.value
+            return content
+        return None
+
+    def store(self,path,stat_result,content):
+        path_data = path.encode("utf-8")
+        if ((len(path_data) >= SharedCacheEntry.path.size) or (len(content) > self.max_file_size)):
+            return
+        if (not self._store_lock.acquire(block = False)):
+            # Another worker is storing, the content is simply not cached this time
+            return
+        try:
+            entry_index = self._find_entry(path_data)
+            if (entry_index == None):
+                set_start = self._get_set_start(path_data)
+                entry_index = min(range(set_start,(set_start + CACHE_WAYS)),key = lambda current_index: self._entries[current_index].last_used)
+            cache_entry = self._entries[entry_index]
+            cache_entry.generation = (cache_entry.generation + 1)
+            ctypes.memmove((ctypes.addressof(self._data) + (entry_index * self.max_file_size)),content,len(content))
+            self._clock.value = (self._clock.value + 1)
+            cache_entry.path = path_data
+            cache_entry.mtime_ns = stat_result.st_mtime_ns
+            cache_entry.size = len(content)
+            cache_entry.last_used = self._clock.value
+            cache_entry.generation = (cache_entry.generation + 1)
+        finally:
+            self._store_lock.release()
+
+    def _get_set_start(self,path_data):
+        return ((zlib.crc32(path_data) % self.set_count) * CACHE_WAYS)
+
+    def _find_entry(self,path_data):
+        set_start = self._get_set_start(path_data)
+        for entry_index in range(set_start,(set_start + CACHE_WAYS)):
+            if (self._entries[entry_index].path == path_data):
+                return entry_index
+        return None
+
+class FileCache:
+    # Per-process LRU, only useful for long-lived workers (worker pool, event loop)
+    def __init__(self,cache_size,max_file_size):
+        self.max_file_size = max_file_size
+        self.cache_size = cache_size
+        self._entries = collections.OrderedDict()
+        self._used_size = 0
+        self._lock = threading.Lock()
+
+    def lookup(self,path,stat_result):
+        with self._lock:
+            cache_entry = self._entries.get(path)
+            if ((not cache_entry) or (cache_entry[0] != stat_result.st_mtime_ns) or (cache_entry[1] != stat_result.st_size)):
+                return None
+            self._entries.move_to_end(path)
+            return cache_entry[2]
+
+    def store(self,path,stat_result,content):
+        if (len(content) > self.max_file_size):
+            return
+        with self._lock:
+            old_entry = self._entries.pop(path,None)
+            if (old_entry):
+                self._used_size = (self._used_size - len(old_entry[2]))
+            while (self._entries and ((self._used_size + len(content)) > self.cache_size)):
+                self._used_size = (self._used_size - len(self._entries.popitem(last = False)[1][2]))
+            self._entries[path] = (stat_result.st_mtime_ns,len(content),content)
+            self._used_size = (self._used_size + len(content))
+
+def create_cache(config):
+    cache_size = (config["file_cache_mb"] * 1024 * 1024)
+    max_file_size = (config["file_cache_max_kb"] * 1024)
+    if (config["file_cache_shared"]):
+        return SharedFileCache(cache_size,max_file_size)
+    return FileCache(cache_size,max_file_size)
+
+def get_cache(config):
+    # Only TLS connections use the cache: plain sockets send files with sendfile from the page cache, which a copy in memory can not beat
+    global server_cache
+    if ((server_cache == None) and (config["file_cache_mb"] > 0) and config["ssl_enabled"]):
+        server_cache = create_cache(config)
+    return server_cache
+
+def get_content(config,path,stat_result):
+    cache = get_cache(config)
+    if ((not cache) or (stat_result.st_size > cache.max_file_size)):
+        return None
+    content = cache.lookup(path,stat_result)
+    if (content == None):
+        with open(path,"rb") as open_file:
+            content = open_file.read(stat_result.st_size)
+        if (len(content) != stat_result.st_size):
+            return None
+        cache.store(path,stat_result,content)
+    return content
+
+def get_etag(stat_result,content_encoding = None):
+    if (content_encoding):
+        return f"\"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}-{content_encoding}\""
+    return f"\"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}\""
+
+def get_last_modified(stat_result):
+    return email.utils.formatdate(stat_result.st_mtime,usegmt = True)
+
+def is_not_modified(request_headers,etag,stat_result):
+    if (request_headers.get("If-None-Match") != None):
+        for request_etag in request_headers["If-None-Match"].split(","):
+            request_etag = request_etag.strip()
+            if (request_etag.startswith("W/")):
+                request_etag = request_etag[2:]
+            if ((request_etag == "*") or (request_etag == etag)):
+                return True
+        return False
+    if (request_headers.get("If-Modified-Since")):
+        try:
+            modified_since = email.utils.parsedate_to_datetime(request_headers["If-Modified-Since"]).timestamp()
+        except (TypeError,ValueError):
+            return False
+        return (int(stat_result.st_mtime) <= modified_since)
+    return False
@@ -0,0 +1,145 @@
+import os
+import sys
+import time
+import json
+import threading
+import traceback
+
+DEBUG = 10
+INFO = 20
+WARN = 30
+ERROR = 40
+NONE = 100
+
+level_names = {
+    DEBUG: "DEBUG",
+    INFO: "INFO",
+    WARN: "WARN",
+    ERROR: "ERROR",
+    NONE: "NONE"
+}
+level_values = {level_name: level_value for level_value,level_name in level_names.items()}
+
+# Set from the config by configure(), access_log is opened by every process on its first entry
+log_level = INFO
+access_log_config = None
+access_log = None
+
+def configure(config):
+    global log_level,access_log_config
+    if (config["log_level"].upper() not in level_values):
+        raise ValueError(f"Unknown log_level: {config['log_level']}")
+    log_level = level_values[config["log_level"].upper()]
+    if (config["access_log"]):
+        if (config["access_log_format"] not in ("clf","json")):
+            raise ValueError(f"Unknown access_log_format: {config['access_log_format']}")
+        access_log_config = config
+
+def write(level,name,message,message_args):
+    # Arguments are only formatted once the level is enabled
+    if (message_args):
+        message = (message % message_args)
+    sys.stdout.write(f"[{name} - {level_names[level]}] {message}\n")
+
+def debug(name,message,*message_args):
+    if (log_level <= DEBUG):
+        write(DEBUG,name,message,message_args)
+
+def info(name,message,*message_args):
+    if (log_level <= INFO):
+        write(INFO,name,message,message_args)
+
+def warn(name,message,*message_args):
+    if (log_level <= WARN):
+        write(WARN,name,message,message_args)
+
+def error(name,message,*message_args):
+    if (log_level <= ERROR):
+        write(ERROR,name,message,message_args)
+
+def exception(name,message,*message_args):
+    # Logs an error followed by the traceback of the exception being handled
+    if (log_level <= ERROR):
+        write(ERROR,name,message,message_args)
+        sys.stdout.write(traceback.format_exc())
+
+class AccessLog:
+    # Records are collected per worker and written by a background thread, one write per batch
+    def __init__(self,config):
+        self.flush_interval = config["access_log_flush_interval"]
+        self.batch_size = config["access_log_batch_size"]
+        self.log_format = config["access_log_format"]
+        if (config["access_log"] == "-"):
+            self._descriptor = sys.stdout.fileno()
+        else:
+            self._descriptor = os.open(config["access_log"],(os.O_WRONLY | os.O_CREAT | os.O_APPEND),0o644)
+        self._records = []
+        self._condition = threading.Condition()
+        self._pid = os.getpid()
+        self._writer_thread = threading.Thread(
+            target = self._writer_function,
+            daemon = True
+        )
+        self._writer_thread.start()
+
+    def add(self,record_line):
+        with self._condition:
+            self._records.append(record_line)
+            if (len(self._records) >= self.batch_size):
+                self._condition.notify()
+
+    def flush(self):
+        with self._condition:
+            record_lines = self._records
+            self._records = []
+        if (record_lines):
+            record_data = "".join(record_lines).encode("utf-8")
+            while record_data:
+                record_data = record_data[os.write(self._descriptor,record_data):]
+
+    def _writer_function(self):
+        while True:
+            with self._condition:
+                if (len(self._records) < self.batch_size):
+                    self._condition.wait(self.flush_interval)
+            try:
+                self.flush()
+            except OSError as exception:
+                sys.stdout.write(f"[ACCESS - ERROR] Writing the access log failed: {str(exception)}\n")
+
+def get_access_log():
+    # Every process starts its own writer thread, threads do not survive a fork
+    global access_log
+    if (not access_log_config):
+        return None
+    if ((access_log == None) or (access_log._pid != os.getpid())):
+        access_log = AccessLog(access_log_config)
+    return access_log
+
+def access(request_class,response_class,duration):
+    if (not access_log_config):
+        return
+    content_length = response_class.headers.get("Content-Length","-")
+    if (access_log_config["access_log_format"] == "json"):
+        record_line = (json.dumps({
+            "time": time.time(),
+            "address": request_class.address[0],
+            "method": request_class.method,
+            "url": request_class.url,
+            "version": request_class.version,
+            "status": response_class.status_code,
+            "bytes": content_length,
+            "duration_ms": round((duration * 1000),3),
+            "referer": request_class.headers.get("Referer"),
+            "user_agent": request_class.headers.get("User-Agent")
+        }) + "\n")
+    else:
+        if (content_length == 0):
+            content_length = "-"
+        record_line = f"{request_class.address[0]} - - [{time.strftime('%d/%b/%Y:%H:%M:%S +0000',time.gmtime())}] \"{request_class.method} {request_class.url} {request_class.version}\" {str(response_class.status_code)} {str(content_length)}\n"
+    get_access_log().add(record_line)
+
+def flush():
+    if (access_log and (access_log._pid == os.getpid())):
+        access_log.flush()
+    sys.stdout.flush()
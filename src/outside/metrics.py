@@ -0,0 +1,210 @@
+import ctypes
+import multiprocessing
+import threading
+import bisect
+
+from . import code_description
+
+# worker_offset and current_worker select the slot of the calling worker (see set_worker)
+server_metrics = None
+worker_offset = 0
+current_worker = threading.local()
+
+PHASE_HEAD = 0
+PHASE_HANDLER = 1
+PHASE_SEND = 2
+
+phase_names = {
+    PHASE_HEAD: "head",
+    PHASE_HANDLER: "handler",
+    PHASE_SEND: "send"
+}
+
+GAUGE_CONNECTIONS = 0
+GAUGE_WEBSOCKETS = 1
+GAUGE_SATURATED = 2
+
+# Upper bounds (in seconds) of the latency buckets, one more bucket counts everything above
+LATENCY_BUCKETS = (0.0005,0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10)
+STATUS_CODES = sorted(code_description.code_info.keys())
+status_indexes = {status_code: status_index for status_index,status_code in enumerate(STATUS_CODES)}
+
+# Requests not matching any route (e.g. 404) are counted under this route label
+UNMATCHED_ROUTE = "-"
+
+class RouteMetrics(ctypes.Structure):
+    _fields_ = [
+        ("bytes_received",ctypes.c_uint64),
+        ("bytes_sent",ctypes.c_uint64),
+        ("status_counts",ctypes.c_uint64 * len(STATUS_CODES)),
+        ("latency_counts",(ctypes.c_uint64 * (len(LATENCY_BUCKETS) + 1)) * len(phase_names)),
+        ("latency_sums",ctypes.c_double * len(phase_names))
+    ]
+
+class MetricsStore:
+    # Every worker counts into its own slot of shared memory (one entry per route and its gauges), no lock is shared between
+    # workers, so a killed worker can not block the others. Readers add the slots up.
+    def __init__(self,routes,capacity,worker_count):
+        self.routes = ([UNMATCHED_ROUTE] + list(routes))
+        self.capacity = capacity
+        self.worker_count = worker_count
+        self._route_indexes = {route: route_index for route_index,route in enumerate(self.routes)}
+        self._route_metrics = multiprocessing.RawArray(RouteMetrics,(worker_count * len(self.routes)))
+        self._gauges = multiprocessing.RawArray(ctypes.c_int64,(worker_count * 3))
+
+    def record(self,worker_index,route,status_code,bytes_received,bytes_sent,phase_durations):
+        route_metrics = self._route_metrics[(worker_index * len(self.routes)) + self._route_indexes.get(route,0)]
+        route_metrics.bytes_received = (route_metrics.bytes_received + bytes_received)
+        route_metrics.bytes_sent = (route_metrics.bytes_sent + bytes_sent)
+        route_metrics.status_counts[status_indexes[status_code]] += 1
+        for phase_index,phase_duration in enumerate(phase_durations):
+            route_metrics.latency_counts[phase_index][bisect.bisect_left(LATENCY_BUCKETS,phase_duration)] += 1
+            route_metrics.latency_sums[phase_index] = (route_metrics.latency_sums[phase_index] + phase_duration)
+
+    def add_gauge(self,worker_index,gauge_index,value):
+        gauge_offset = (worker_index * 3)
+        self._gauges[gauge_offset + gauge_index] = (self._gauges[gauge_offset + gauge_index] + value)
+        if ((gauge_index == GAUGE_CONNECTIONS) and (value > 0) and (sum(self._gauges[GAUGE_CONNECTIONS::3]) >= self.capacity)):
+            self._gauges[gauge_offset + GAUGE_SATURATED] = (self._gauges[gauge_offset + GAUGE_SATURATED] + 1)
+
+    def reset_worker(self,worker_index):
+        # Called by the supervisor once the worker has exited, its counters stay for the next worker of this slot
+        gauge_offset = (worker_index * 3)
+        self._gauges[gauge_offset + GAUGE_CONNECTIONS] = 0
+        self._gauges[gauge_offset + GAUGE_WEBSOCKETS] = 0
+
+    def snapshot(self):
+        route_count = len(self.routes)
+        worker_metrics = (RouteMetrics * (self.worker_count * route_count)).from_buffer_copy(self._route_metrics)
+        gauges = list(self._gauges)
+        route_totals = {}
+        for route_index,route in enumerate(self.routes):
+            status_counts = [0] * len(STATUS_CODES)
+            latency_counts = [[0] * (len(LATENCY_BUCKETS) + 1) for phase_index in phase_names]
+            latency_sums = [0.0] * len(phase_names)
+            bytes_received = 0
+            bytes_sent = 0
+            for worker_index in range(self.worker_count):
+                route_metrics = worker_metrics[(worker_index * route_count) + route_index]
+                bytes_received = (bytes_received + route_metrics.bytes_received)
+                bytes_sent = (bytes_sent + route_metrics.bytes_sent)
+                status_counts = [(status_count + worker_count) for status_count,worker_count in zip(status_counts,route_metrics.status_counts)]
+                for phase_index in phase_names:
+                    latency_counts[phase_index] = [(bucket_count + worker_count) for bucket_count,worker_count in zip(latency_counts[phase_index],route_metrics.latency_counts[phase_index])]
+                    latency_sums[phase_index] = (latency_sums[phase_index] + route_metrics.latency_sums[phase_index])
+            route_totals[route] = {
+                "bytes_received": bytes_received,
+                "bytes_sent": bytes_sent,
+                "status_counts": {status_code: status_count for status_code,status_count in zip(STATUS_CODES,status_counts) if status_count},
+                "latency_counts": {phase_name: latency_counts[phase_index] for phase_index,phase_name in phase_names.items()},
+                "latency_sums": {phase_name: latency_sums[phase_index] for phase_index,phase_name in phase_names.items()}
+            }
+        return {
+            "connections": sum(gauges[GAUGE_CONNECTIONS::3]),
+            "websockets": sum(gauges[GAUGE_WEBSOCKETS::3]),
+            "saturated": sum(gauges[GAUGE_SATURATED::3]),
+            "capacity": self.capacity,
+            "routes": route_totals
+        }
+
+    def render(self):
+        # Prometheus text exposition format (version 0.0.4)
+        metrics_snapshot = self.snapshot()
+        metric_lines = [
+            "# HELP outside_requests_total Responses sent, by route and status code.",
+            "# TYPE outside_requests_total counter"
+        ]
+        for route,route_data in metrics_snapshot["routes"].items():
+            for status_code,status_count in route_data["status_counts"].items():
+                metric_lines.append(f"outside_requests_total{{route=\"{escape_label(route)}\",code=\"{str(status_code)}\"}} {str(status_count)}")
+
+        metric_lines.extend([
+            "# HELP outside_request_bytes_total Received request head and body bytes, by route.",
+            "# TYPE outside_request_bytes_total counter"
+        ])
+        for route,route_data in metrics_snapshot["routes"].items():
+            metric_lines.append(f"outside_request_bytes_total{{route=\"{escape_label(route)}\"}} {str(route_data['bytes_received'])}")
+        metric_lines.extend([
+            "# HELP outside_response_bytes_total Sent response head and body bytes, by route.",
+            "# TYPE outside_response_bytes_total counter"
+        ])
+        for route,route_data in metrics_snapshot["routes"].items():
+            metric_lines.append(f"outside_response_bytes_total{{route=\"{escape_label(route)}\"}} {str(route_data['bytes_sent'])}")
+
+        metric_lines.extend([
+            "# HELP outside_request_phase_seconds Time spent receiving the head, running the handler and sending the response, by route.",
+            "# TYPE outside_request_phase_seconds histogram"
+        ])
+        for route,route_data in metrics_snapshot["routes"].items():
+            for phase_name in phase_names.values():
+                labels = f"route=\"{escape_label(route)}\",phase=\"{phase_name}\""
+                latency_counts = route_data["latency_counts"][phase_name]
+                bucket_total = 0
+                for bucket_bound,bucket_count in zip(LATENCY_BUCKETS,latency_counts):
+                    bucket_total = (bucket_total + bucket_count)
+                    metric_lines.append(f"outside_request_phase_seconds_bucket{{{labels},le=\"{str(bucket_bound)}\"}} {str(bucket_total)}")
+                bucket_total = (bucket_total + latency_counts[-1])
+                metric_lines.append(f"outside_request_phase_seconds_bucket{{{labels},le=\"+Inf\"}} {str(bucket_total)}")
+                metric_lines.append(f"outside_request_phase_seconds_sum{{{labels}}} {repr(route_data['latency_sums'][phase_name])}")
+                metric_lines.append(f"outside_request_phase_seconds_count{{{labels}}} {str(bucket_total)}")
+
+        metric_lines.extend([
+            "# HELP outside_connections_active Connections currently served (busy workers).",
+            "# TYPE outside_connections_active gauge",
+            f"outside_connections_active {str(metrics_snapshot['connections'])}",
+            "# HELP outside_websockets_active Open websocket connections.",
+            "# TYPE outside_websockets_active gauge",
+            f"outside_websockets_active {str(metrics_snapshot['websockets'])}",
+            "# HELP outside_connection_capacity Connections which can be served at the same time.",
+            "# TYPE outside_connection_capacity gauge",
+            f"outside_connection_capacity {str(metrics_snapshot['capacity'])}",
+            "# HELP outside_saturation Share of the connection capacity in use.",
+            "# TYPE outside_saturation gauge",
+            f"outside_saturation {repr(metrics_snapshot['connections'] / max(metrics_snapshot['capacity'],1))}",
+            "# HELP outside_saturated_total Connections which took the last free slot, further clients wait in the backlog.",
+            "# TYPE outside_saturated_total counter",
+            f"outside_saturated_total {str(metrics_snapshot['saturated'])}"
+        ])
+        return ("\n".join(metric_lines) + "\n")
+
+def escape_label(label_value):
+    return label_value.replace("\\","\\\\").replace("\"","\\\"").replace("\n","\\n")
+
+def get_metrics(config,routes,capacity,worker_count):
+    global server_metrics
+    if ((server_metrics == None) and config["metrics"]):
+        server_metrics = MetricsStore(routes,capacity,worker_count)
+    return server_metrics
+
+def set_worker_offset(slot_offset):
+    # Acceptor processes number their workers from 0, their slots start after those of the previous acceptors
+    global worker_offset
+    worker_offset = slot_offset
+
+def set_worker(slot_index):
+    # The calling thread counts into this slot (pool threads share the process, so this is per thread)
+    current_worker.index = (worker_offset + slot_index)
+
+def reset_worker(slot_index):
+    if (server_metrics):
+        server_metrics.reset_worker(worker_offset + slot_index)
+
+def record(request_class,status_code,bytes_received,bytes_sent,phase_durations):
+    if (server_metrics):
+        server_metrics.record(getattr(current_worker,"index",0),(request_class.route or UNMATCHED_ROUTE),status_code,bytes_received,bytes_sent,phase_durations)
+
+def connection_opened():
+    if (server_metrics):
+        server_metrics.add_gauge(getattr(current_worker,"index",0),GAUGE_CONNECTIONS,1)
+
+def connection_closed():
+    if (server_metrics):
+        server_metrics.add_gauge(getattr(current_worker,"index",0),GAUGE_CONNECTIONS,-1)
+
+def websocket_opened():
+    if (server_metrics):
+        server_metrics.add_gauge(getattr(current_worker,"index",0),GAUGE_WEBSOCKETS,1)
+
+def websocket_closed():
+    if (server_metrics):
+        server_metrics.add_gauge(getattr(current_worker,"index",0),GAUGE_WEBSOCKETS,-1)
@@ -0,0 +1,179 @@
+import os
+import io
+import time
+import random
+import shutil
+import tempfile
+import threading
+import urllib.parse
+import cProfile
+import pstats
+
+from . import log
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: workers merging into the same profile at once may lose one of the two flushes
+    fcntl = None
+
+# Set from the profile_* config keys by configure(), profile_config stays None while profiling is disabled
+profile_config = None
+profile_directory = None
+created_directory = False
+profiled_routes = frozenset()
+slow_threshold = 0
+
+PROFILE_SUFFIX = ".prof"
+UNMATCHED_ROUTE = "-"
+
+# Profilers can not be nested, so every process profiles at most one request at a time
+profile_lock = threading.Lock()
+route_stats = {}
+# Reentrant, the terminate signal handler may flush while the interrupted code holds it
+stats_lock = threading.RLock()
+stats_pid = None
+last_flush = 0
+
+class RequestProfile:
+    # One profiler per request, enabled around the handler and the send path (also from executor threads)
+    def __init__(self,route):
+        self.route = route
+        self.profiler = cProfile.Profile()
+        self.enabled = False
+
+    def enable(self):
+        if (not self.enabled):
+            self.enabled = True
+            self.profiler.enable()
+
+    def disable(self):
+        if (self.enabled):
+            self.profiler.disable()
+            self.enabled = False
+
+    def wrap(self,route_function):
+        # Non-async handlers of the event loop engine run in an executor thread, which is profiled on its own
+        def profiled_route(request):
+            self.enable()
+            try:
+                return route_function(request)
+            finally:
+                self.disable()
+        return profiled_route
+
+def configure(config):
+    global profile_config,profile_directory,created_directory,profiled_routes,slow_threshold
+    slow_threshold = (config["profile_slow_ms"] / 1000)
+    if ((config["profile_sample_rate"] <= 0) and (not config["profile_routes"])):
+        return
+    profile_config = config
+    profiled_routes = frozenset(config["profile_routes"])
+    if (profile_directory == None):
+        if (config["profile_dir"]):
+            profile_directory = config["profile_dir"]
+            os.makedirs(profile_directory,exist_ok = True)
+        else:
+            profile_directory = tempfile.mkdtemp(prefix = "outside-profile-")
+            created_directory = True
+
+def remove_directory():
+    if (created_directory and profile_directory):
+        shutil.rmtree(profile_directory,ignore_errors = True)
+
+def select(request_class):
+    # Returns None for requests which are not profiled, that is all the disabled hook costs
+    if (not profile_config):
+        return None
+    route = (request_class.route or UNMATCHED_ROUTE)
+    if ((route not in profiled_routes) and (random.random() >= profile_config["profile_sample_rate"])):
+        return None
+    if (not profile_lock.acquire(blocking = False)):
+        return None
+    return RequestProfile(route)
+
+def finish(request_profile):
+    global route_stats,stats_pid,last_flush
+    if (not request_profile):
+        return
+    request_profile.disable()
+    profile_lock.release()
+    with stats_lock:
+        if (stats_pid != os.getpid()):
+            # Forked from a process with profiles of its own, those are flushed by that process
+            route_stats = {}
+            stats_pid = os.getpid()
+            last_flush = time.monotonic()
+        if (request_profile.route in route_stats):
+            route_stats[request_profile.route].add(request_profile.profiler)
+        else:
+            route_stats[request_profile.route] = pstats.Stats(request_profile.profiler)
+        flush_due = ((time.monotonic() - last_flush) >= profile_config["profile_flush_interval"])
+    if (flush_due):
+        flush()
+
+def get_profile_path(route):
+    return os.path.join(profile_directory,(urllib.parse.quote(route,safe = "") + PROFILE_SUFFIX))
+
+def lock_profiles(lock_file,exclusive):
+    # Released when lock_file is closed
+    if (fcntl != None):
+        fcntl.flock(lock_file,(fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH))
+
+def flush():
+    # Merges the profiles of this process into one file per route, shared by all workers
+    global route_stats,last_flush
+    if ((not profile_config) or (stats_pid != os.getpid())):
+        return
+    with stats_lock:
+        flushed_stats = route_stats
+        route_stats = {}
+        last_flush = time.monotonic()
+    if (not flushed_stats):
+        return
+    with open(os.path.join(profile_directory,".lock"),"a") as lock_file:
+        lock_profiles(lock_file,True)
+        for route,stats in flushed_stats.items():
+            profile_path = get_profile_path(route)
+            if (os.path.exists(profile_path)):
+                try:
+                    stats.add(profile_path)
+                except (OSError,EOFError,ValueError,TypeError):
+                    log.warn("PROFILE",f"Replacing unreadable profile {profile_path}.")
+            stats.dump_stats(profile_path + ".tmp")
+            os.replace((profile_path + ".tmp"),profile_path)
+
+def get_routes():
+    if (not profile_directory):
+        return []
+    return sorted(urllib.parse.unquote(file_name[:-len(PROFILE_SUFFIX)]) for file_name in os.listdir(profile_directory) if file_name.endswith(PROFILE_SUFFIX))
+
+def render(route = None,sort_key = "cumulative",limit = 40):
+    # Profiles of other workers show up once they are flushed (every "profile_flush_interval" seconds)
+    flush()
+    report_stream = io.StringIO()
+    with open(os.path.join(profile_directory,".lock"),"a") as lock_file:
+        lock_profiles(lock_file,False)
+        if (route == None):
+            for profiled_route in get_routes():
+                stats = pstats.Stats(get_profile_path(profiled_route),stream = report_stream)
+                report_stream.write(f"{profiled_route}: {str(stats.total_calls)} calls, {stats.total_tt:.3f}s\n")
+            return report_stream.getvalue()
+        stats = pstats.Stats(get_profile_path(route),stream = report_stream)
+    stats.sort_stats(sort_key).print_stats(limit)
+    return report_stream.getvalue()
+
+def check_slow(request_class,status_code,phase_durations):
+    # Wall-clock phase timer, needs no profiler
+    if (slow_threshold and (sum(phase_durations) >= slow_threshold)):
+        log.warn(
+            "PROFILE",
+            "Slow request %s %s (route %s, code %d): head %.1fms, handler %.1fms, send %.1fms.",
+            request_class.method,
+            request_class.url,
+            (request_class.route or UNMATCHED_ROUTE),
+            status_code,
+            (phase_durations[0] * 1000),
+            (phase_durations[1] * 1000),
+            (phase_durations[2] * 1000)
+        )
@@ -1,5 +1,4 @@
 import json
-import traceback
 import sys
 import os.path
 import re
@@ -12,29 +11,89 @@ import signal
 import ssl
 import base64
 import hashlib
+import io
+import asyncio
+import inspect
+import zlib
 
+from . import log
 from . import code_description
 from . import protocol_websocket
+from . import activity_slots
+from . import tls_context
+from . import request_parser
+from . import file_cache
+from . import compression
+from . import pubsub
+from . import metrics
+from . import profiling
+from . import utility
+
+# Linux only, elsewhere the head and the file data are sent as they come
+MSG_MORE = getattr(socket,"MSG_MORE",0)
+TLS_RECORD_SIZE = 16384
+
+def process_request(slot_array,slot_index,connected_socket,address,config,route_table,error_routes):
+    def terminate(signum = None,stackframe = None):
+        close_socket(connected_socket)
+        profiling.flush()
+        log.flush()
+        sys.exit(0)
 
-def process_request(activity_queue,connected_socket,address,config,route_names,routes,error_routes,is_reused = 0):
-    start_time = time.perf_counter()
-    debug_name = f"{address[0]}:{str(address[1])}"
+    signal.signal(signal.SIGINT,terminate)
+    signal.signal(signal.SIGTERM,terminate)
+    metrics.set_worker(slot_index)
+    serve_connection(slot_array[slot_index],connected_socket,address,config,route_table,error_routes)
+    profiling.flush()
+    log.flush()
+    sys.exit(0)
 
+def pool_worker(slot_array,slot_index,main_socket,config,route_table,error_routes):
     def terminate(signum = None,stackframe = None):
-        close_socket(connected_socket)
+        profiling.flush()
+        log.flush()
         sys.exit(0)
-    
-    def close_socket(unknown_socket):
-        try:
-            unknown_socket.shutdown(socket.SHUT_RDWR)
-        except OSError:
-            pass
 
+    def reload_certificate(signum = None,stackframe = None):
+        tls_context.reload_certificate(config)
+
+    signal.signal(signal.SIGINT,terminate)
+    signal.signal(signal.SIGTERM,terminate)
+    if (config["ssl_enabled"] and (config["ssl_reload_signal"] != None)):
+        signal.signal(config["ssl_reload_signal"],reload_certificate)
+    serve_pool(slot_array,slot_index,main_socket,config,route_table,error_routes)
+    profiling.flush()
+    log.flush()
+    sys.exit(0)
+
+def serve_pool(slot_array,slot_index,main_socket,config,route_table,error_routes):
+    activity_slot = slot_array[slot_index]
+    metrics.set_worker(slot_index)
+    while True:
+        activity_slot.set_state(activity_slots.SLOT_IDLE)
         try:
-            unknown_socket.close()
+            accepted_socket,address = main_socket.accept()
         except OSError:
-            pass
-    
+            return
+        activity_slot.set_state(activity_slots.SLOT_RECEIVING)
+        log.debug("POOL/HTTP","Connected to %s:%d.",address[0],address[1])
+        accepted_socket.settimeout(config["process_timeout"])
+        serve_connection(activity_slot,accepted_socket,address,config,route_table,error_routes)
+
+def close_socket(unknown_socket):
+    try:
+        unknown_socket.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+    try:
+        unknown_socket.close()
+    except OSError:
+        pass
+
+def serve_connection(activity_slot,connected_socket,address,config,route_table,error_routes):
+    debug_name = f"{address[0]}:{str(address[1])}"
+
     def get_socket():
         if (config["ssl_enabled"]):
             return connected_ssl_socket
@@ -45,265 +104,598 @@ def process_request(activity_queue,connected_socket,address,config,route_names,r
         recv_data = get_socket().recv(recv_size)
         if (recv_data == b""):
             raise BrokenPipeError
+        # Only counted, a head trickling in must not reset the process_timeout
+        activity_slot.bytes_received = (activity_slot.bytes_received + len(recv_data))
         return recv_data
 
-    def send(data,append_file = None):
-        data_length = len(data)
-        if (append_file):
-            data_length = (data_length + (append_file.read_end - append_file.read_start))
+    def recv_body_into(recv_buffer):
+        recv_size = get_socket().recv_into(recv_buffer)
+        if (recv_size == 0):
+            raise BrokenPipeError
+        activity_slot.report_received(recv_size)
+        return recv_size
+
+    def send(head_data,content = b""):
+        if (isinstance(content,ResponseStream)):
+            send_buffers(get_socket(),[head_data],config["send_size"],activity_slot)
+            send_stream(get_socket(),content,config["send_size"],activity_slot)
+            return
+        file_path = None
+        if (isinstance(content,FilePath)):
+            file_path = content
+            content = b""
+        data_length = (len(head_data) + len(content))
+        if (file_path):
+            data_length = (data_length + file_path._get_length())
         send_size = config["send_size"]
         if (data_length > (config["big_definition_mb"] * 1024 * 1024)):
             send_size = (config["big_send_limit_mb"] * 1024 * 1024)
+        if (file_path and (file_path._cached_content != None)):
+            # The whole response is already in memory, it is handed over in one piece instead of send_size slices
+            send_size = max(send_size,data_length)
         send_socket = get_socket()
 
-        while (len(data) > 0):
-            sent_bytes = send_socket.send(data[:send_size])
-            data = data[sent_bytes:]
-            activity_queue.put(time.time())
-
-        if (append_file):
-            open_file = open(append_file.path,"rb")
-            open_file.seek(append_file.read_start)
-            while (True):
-                limited_read = min((append_file.read_end - open_file.tell()),send_size)
-                current_chunk = open_file.read(limited_read)
-                if (limited_read <= 0):
-                    break
-                send_socket.send(current_chunk)
-                activity_queue.put(time.time())
-
-    signal.signal(signal.SIGINT,terminate)
-    signal.signal(signal.SIGTERM,terminate)
+        pending_buffers = [head_data,content]
+        if (file_path):
+            for file_segment in file_path._get_segments():
+                if (isinstance(file_segment,bytes)):
+                    pending_buffers.append(file_segment)
+                elif (file_path._cached_content != None):
+                    pending_buffers.append(memoryview(file_path._cached_content)[file_segment[0]:file_segment[1]])
+                else:
+                    # MSG_MORE lets the kernel put the head into the packets of the file data, a lone small segment would wait for the delayed ACK
+                    send_buffers(send_socket,pending_buffers,send_size,activity_slot,more_data = True)
+                    pending_buffers = []
+                    send_file(send_socket,file_path.path,file_segment[0],file_segment[1],config,activity_slot)
+        send_buffers(send_socket,pending_buffers,send_size,activity_slot)
+
+    request_profile = None
+    metrics.connection_opened()
     try:
         if (config["ssl_enabled"]):
-            if (is_reused > 0):
-                connected_ssl_socket = connected_socket
-            else:
+            try:
+                connected_ssl_socket = tls_context.get_context(config).wrap_socket(
+                    sock = connected_socket,
+                    server_side = True
+                )
+            except ssl.SSLError as exception:
+                if (exception.reason == "HTTP_REQUEST"):
+                    return
+                else:
+                    raise
+
+        # The parser lives as long as the connection, bytes of pipelined requests stay buffered in it
+        head_parser = request_parser.RequestParser(config)
+        request_timeout = connected_socket.gettimeout()
+        for is_reused in range(config["max_socket_reuse"] + 1):
+            # Request Flow
+            request_class = Request("",{},b"","","",address)
+            ## Receive Request Info + Headers
+            log.debug(debug_name,"Waiting for request info.")
+            try:
+                if ((is_reused > 0) and (not head_parser.find_head())):
+                    # Idle between requests: wait keep_alive_timeout for the first byte, then fall back to the request timeout
+                    activity_slot.set_state(activity_slots.SLOT_KEEP_ALIVE)
+                    get_socket().settimeout(config["keep_alive_timeout"])
+                    try:
+                        head_parser.feed(recv())
+                    except socket.timeout:
+                        log.debug(debug_name,"Keep-alive timed out, closing connection.")
+                        return
+                    except (BrokenPipeError,ConnectionResetError):
+                        log.debug(debug_name,"Connection closed by client.")
+                        return
+                    finally:
+                        get_socket().settimeout(request_timeout)
+                    activity_slot.set_state(activity_slots.SLOT_RECEIVING)
+                start_time = time.perf_counter()
+                while (not head_parser.find_head()):
+                    head_parser.feed(recv())
+                request_size = head_parser.parse_head(request_class)
+                head_time = time.perf_counter()
+                activity_slot.requests = (activity_slot.requests + 1)
+                activity_slot.set_state(activity_slots.SLOT_RECEIVING)
+            except request_parser.RequestHeadError as exception:
+                log.error(debug_name,f"Invalid request head: {exception.message}")
+                response_class = build_error_response(request_class,exception.status_code,exception.message,error_routes,config)
+                if (response_class):
+                    send(build_response_head(response_class),response_class.content)
+                return
+
+            log.debug(debug_name,"Flow: %s",request_class.url)
+
+            ## Check Route
+            responding_route = find_route(request_class,route_table,error_routes)
+            activity_slot.set_state(activity_slots.SLOT_RECEIVING,request_class.route)
+
+            ## Receive Body
+            body_rejection = check_request_body(request_class,config)
+            if (body_rejection):
+                log.warn(debug_name,"Request rejected before receiving its body.")
+                response_class = build_closing_response(request_class,body_rejection,error_routes,config)
+                if (response_class):
+                    send(build_response_head(response_class),response_class.content)
+                return
+            if (expects_continue(request_class) and (not head_parser.buffered())):
+                send(code_description.get_status_line(100) + b"\r\n")
+
+            if (request_class.headers.get("Transfer-Encoding") or request_class.headers.get("Content-Length")):
+                log.debug(debug_name,"Receiving content.")
                 try:
-                    ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
-                    ssl_context.load_cert_chain(config["ssl_certfile"],config["ssl_keyfile"])
-                    connected_ssl_socket = ssl_context.wrap_socket(
-                        sock = connected_socket,
-                        server_side = True
-                    )
-                except ssl.SSLError as exception:
-                    if (exception.reason == "HTTP_REQUEST"):
-                        terminate()
-                    else:
-                        raise
-
-        # Request Flow
-        request_class = Request("",{},b"","","",address)
-        ## Receive Request Info + Headers
-        print(f"[{debug_name} - INFO] Waiting for request info.")
-        header_lines = [b""]
-        while True:
-            recv_data = recv()
-            recv_data = recv_data.replace(b"\r",b"")
-            header_split = recv_data.split(b"\n\n")
-            if (len(header_split) > 1):
-                request_class.content = recv_data[(len(header_split[0]) + 2):]
-                recv_data = header_split[0]
-            recv_data = recv_data.split(b"\n")
-            header_lines[len(header_lines) - 1] = (header_lines[len(header_lines) - 1] + recv_data[0])
-            header_lines = (header_lines + recv_data[1:])
-            if (header_lines[len(header_lines) - 1] == b""):
-                header_lines = header_lines[:-2]
-                break
-            if (len(header_split) > 1):
-                break
-
-        split_preline = header_lines[0].decode("utf-8").split(" ")
-        split_url = split_preline[1].split("?",1)
-        request_class.method = split_preline[0].upper()
-        request_class.url = split_url[0]
-        if (len(split_url) > 1):
-            for param_name,param_values in urllib.parse.parse_qs(split_url[1]).items():
-                request_class.params[param_name] = param_values[0]
-        request_class.version = split_preline[2]
-
-        for header_line in header_lines[1:]:
-            split_line = header_line.decode("utf-8").split(": ")
-            request_class.headers[split_line[0]] = split_line[1]
-
-        request_class._extract_cookies()
-
-        print(f"[{debug_name} - INFO] Flow: {request_class.url}")
-
-        ## Receive Body
-        if (request_class.headers.get("Content-Length")):
-            request_class.headers["Content-Length"] = int(request_class.headers["Content-Length"])
-            if (not request_class.content):
-                request_class.content = b""
-            print(f"[{debug_name} - INFO] Receiving content.")
-            if (request_class.headers["Content-Length"] > (config["max_body_size_mb"] * 1024 * 1024)):
-                print(f"[{debug_name} - ERROR] Content-Length is too high, releasing process.")
-                terminate()
-            while (len(request_class.content) < request_class.headers["Content-Length"]):
-                recv_data = recv(min((request_class.headers["Content-Length"] - len(request_class.content)),config["recv_size"]))
-                request_class.content = (request_class.content + recv_data)
-            print(f"[{debug_name} - INFO] Received {str(len(request_class.content))}B content.")
-
-        ## Check Route
-        responding_route = None
-        for route_name in route_names:
-            if (request_class.url.startswith(route_name)):
-                responding_route = routes[route_name]
-                break
-        if (not responding_route):
-            responding_route = error_routes[404]
-        if (isinstance(responding_route,protocol_websocket.WebSocket)):
-            print(f"[{debug_name} - INFO] Initializing websocket.")
-            if ((request_class.headers.get("Connection")) and ("Upgrade" in request_class.headers["Connection"]) and (request_class.headers.get("Upgrade") == "websocket") and (request_class.headers.get("Sec-WebSocket-Key"))):
-                websocket_connection = protocol_websocket.WebSocketConnection(request_class,get_socket(),activity_queue)
-            else:
-                print(f"[{debug_name} - ERROR] Handshake not accepted.")
-                responding_route = error_routes[400]
-
-        ## Respond
-        if (isinstance(responding_route,protocol_websocket.WebSocket)):
-            response_class = Response(
-                status_code = 101,
-                headers = {
-                    "Upgrade": "websocket",
-                    "Connection": "Upgrade",
-                    "Sec-Websocket-Accept": base64.b64encode(hashlib.sha1(f"{request_class.headers.get('Sec-WebSocket-Key')}258EAFA5-E914-47DA-95CA-C5AB0DC85B11".encode("utf-8")).digest()).decode("utf-8")
-                },
-                content = b""
-            )
-        else:
-            print(f"[{debug_name} - INFO] Generating response.")
-            scheduled_response_class = ScheduledResponse(request_class,responding_route,error_routes)
-            response_class = scheduled_response_class.run()
-            if (not response_class):
-                print(f"[{debug_name} - WARN] ScheduledResponse did not return Response, releasing process.")
-                terminate()
-
-        content_is_file = isinstance(response_class.content,FilePath)
-
-        if (content_is_file):
-            content_length = os.path.getsize(response_class.content.path)
-            if ((config["allow_range_from_mb"] != -1) and (config["allow_range_from_mb"] < (content_length / 1024 / 1024))):
-                response_class.headers["Accept-Ranges"] = "bytes"
-                if (request_class.headers.get("Range")):
-                    response_class.status_code = 206
-                    if (("," in request_class.headers["Range"]) or (not re.match(r"^bytes=(?:([0-9]+)-|-(?:[0-9]+|([0-9]+)-[0-9]+))$",request_class.headers["Range"]))):
-                        response_class = Response(request_class,416,{},"bytes=<range-start>-<range-end>")
-                    else:
-                        range_split = request_class.headers["Range"][6:].split("-")
-                        if (range_split[0] == ""):
-                            range_end = min(int(range_split[1]),(content_length - 1))
-                            response_class.headers["Content-Range"] = f"bytes {str(content_length - range_end)}-{str(content_length - 1)}/{str(content_length)}"
-                            response_class.content.read_end = min(content_length,(content_length - range_end))
-                        elif (range_split[1] == ""):
-                            range_start = max(int(range_split[0]),0)
-                            response_class.headers["Content-Range"] = f"bytes {str(range_start)}-{str(content_length - 1)}/{str(content_length)}"
-                            response_class.content.read_start = max(0,range_start)
-                        else:
-                            range_start = min(int(range_split[1]),(content_length - 1))
-                            range_end = max(int(range_split[0]),0)
-                            response_class.headers["Content-Range"] = f"bytes {str(range_start)}-{str(range_end)}/{str(content_length)}"
-                            response_class.content.read_start = max(0,range_start)
-                            response_class.content.read_end = min(content_length,range_end)
-                        print(f"[{debug_name} - INFO] Chunked file response: {response_class.headers['Content-Range'][6:]}")
-        
-        if (config["pre_send"]):
-            print(f"[{debug_name} - INFO] Running pre_send.")
-            config["pre_send"](response_class)
-        
-        content_is_file = isinstance(response_class.content,FilePath)
-        if (content_is_file):
-            response_class.headers["Content-Length"] = (response_class.content.read_end - response_class.content.read_start)
-        else:
-            response_class.headers["Content-Length"] = len(response_class.content)
-        
-        socket_keep_alive = False
-        if (not response_class.headers.get("Connection")):
-            if (config["keep_alive"] and (is_reused < config["max_socket_reuse"]) and (request_class.headers.get("Connection") == "keep-alive")):
-                response_class.headers["Connection"] = "keep-alive"
-                socket_keep_alive = True
+                    body_receiver = request_parser.BodyReceiver(head_parser,request_class,config)
+                    body_receiver.receive(recv_body_into)
+                except request_parser.RequestBodyError as exception:
+                    log.error(debug_name,f"Invalid request body: {exception.message}")
+                    response_class = build_error_response(request_class,exception.status_code,exception.message,error_routes,config)
+                    if (response_class):
+                        send(build_response_head(response_class),response_class.content)
+                    return
+                body_size = body_receiver.finish(request_class)
+                request_size = (request_size + body_size)
+                log.debug(debug_name,"Received %dB content.",body_size)
+
+            if (isinstance(responding_route,protocol_websocket.WebSocket)):
+                log.debug(debug_name,"Initializing websocket.")
+                if (is_websocket_handshake(request_class)):
+                    websocket_connection = protocol_websocket.WebSocketConnection(request_class,get_socket(),activity_slot,config,pubsub.server_hub)
+                else:
+                    log.error(debug_name,"Handshake not accepted.")
+                    responding_route = error_routes[400]
+
+            ## Respond
+            handler_start_time = time.perf_counter()
+            request_profile = profiling.select(request_class)
+            if (request_profile):
+                request_profile.enable()
+            if (isinstance(responding_route,protocol_websocket.WebSocket)):
+                response_class = build_handshake_response(request_class,websocket_connection)
             else:
-                response_class.headers["Connection"] = "close"
-
-        response_data = (b"HTTP/1.1 " + str(response_class.status_code).encode("utf-8") + b" " + code_description.get_description(response_class.status_code).encode("utf-8") + b"\r\n")
-
-        for header_name in response_class.headers:
-            header_value = response_class.headers[header_name]
-            if (isinstance(header_value,int)):
-                header_value = str(header_value)
-            response_data = (response_data + header_name.encode("utf-8") + b": " + header_value.encode("utf-8") + b"\r\n")
-
-        if (response_class.headers.get("Set-Cookie")):
-            print(f"[{debug_name} - ERROR] Set-Cookie header was returned by ScheduledResponse, add ResponseCookie to Response.cookies instead.")
-            raise RuntimeError("Set-Cookie illegaly set.")
-        for cookie_name,cookie_value in response_class.cookies.items():
-            response_data = (response_data + b"Set-Cookie: " + cookie_name.encode("utf-8") + b"=" + cookie_value.value.encode("utf-8"))
-            if (cookie_value.max_age):
-                response_data = (response_data + f"; Max-Age={str(cookie_value.max_age)}".encode("utf-8"))
-            if (cookie_value.domain):
-                response_data = (response_data + f"; Domain={cookie_value.domain}".encode("utf-8"))
-            if (cookie_value.http_only):
-                response_data = (response_data + f"; HttpOnly".encode("utf-8"))
-            if (cookie_value.secure):
-                response_data = (response_data + f"; Secure".encode("utf-8"))
-            if (cookie_value.path):
-                response_data = (response_data + f"; Path={cookie_value.path}".encode("utf-8"))
-            if (cookie_value.same_site):
-                response_data = (response_data + f"; SameSite={cookie_value.same_site}".encode("utf-8"))
-            response_data = (response_data + b"\r\n")
-
-        print(f"[{debug_name} - INFO] Sending response.")
-        if (content_is_file):
-            response_data = (response_data + b"\r\n")
+                log.debug(debug_name,"Generating response.")
+                activity_slot.set_state(activity_slots.SLOT_HANDLING)
+                scheduled_response_class = ScheduledResponse(request_class,responding_route,error_routes)
+                response_class = scheduled_response_class.run()
+                if (not response_class):
+                    log.warn(debug_name,"ScheduledResponse did not return Response, releasing process.")
+                    return
+
+            response_class = prepare_response(request_class,response_class,config)
+            socket_keep_alive = set_keep_alive(request_class,response_class,config,is_reused)
+            response_data = build_response_head(response_class)
+
+            log.debug(debug_name,"Sending response.")
+            activity_slot.set_state(activity_slots.SLOT_SENDING)
+            send_start_time = time.perf_counter()
+            bytes_sent = activity_slot.bytes_sent
             send(response_data,response_class.content)
-        else:
-            response_data = (response_data + b"\r\n" + response_class.content)
-            send(response_data)
-
-        print(f"[{debug_name} - INFO] Code {str(response_class.status_code)} in {str(round((time.perf_counter() - start_time) * 1000))}ms.")
-        if (isinstance(responding_route,protocol_websocket.WebSocket)):
-            print(f"[{debug_name} - INFO] Handshake complete.")
-            try:
-                responding_route.connection_handler(websocket_connection)
-                websocket_connection.exit()
-            except protocol_websocket.WebSocketExit:
-                pass
+            end_time = time.perf_counter()
+            profiling.finish(request_profile)
+            request_profile = None
+
+            log.debug(debug_name,"Code %d in %dms.",response_class.status_code,round((end_time - start_time) * 1000))
+            log.access(request_class,response_class,(end_time - start_time))
+            phase_durations = ((head_time - start_time),(send_start_time - handler_start_time),(end_time - send_start_time))
+            metrics.record(request_class,response_class.status_code,request_size,(activity_slot.bytes_sent - bytes_sent),phase_durations)
+            profiling.check_slow(request_class,response_class.status_code,phase_durations)
+            if (isinstance(responding_route,protocol_websocket.WebSocket)):
+                log.debug(debug_name,"Handshake complete.")
+                activity_slot.set_state(activity_slots.SLOT_WEBSOCKET)
+                metrics.websocket_opened()
+                try:
+                    responding_route.connection_handler(websocket_connection)
+                    websocket_connection.exit()
+                except protocol_websocket.WebSocketExit:
+                    pass
+                finally:
+                    metrics.websocket_closed()
         
-        if (config["post_callback"]):
-            config["post_callback"](request_class,response_class)
-        if (socket_keep_alive):
-            print(f"[{debug_name} - INFO] Waiting for further requests.")
-            reuse_socket = connected_socket
-            if (config["ssl_enabled"]):
-                reuse_socket = connected_ssl_socket
-            process_request(activity_queue,reuse_socket,address,config,route_names,routes,error_routes,(is_reused + 1))
-        terminate()
+            if (config["post_callback"]):
+                config["post_callback"](request_class,response_class)
+            request_class._close_body()
+            if (not socket_keep_alive):
+                return
+            log.debug(debug_name,"Waiting for further requests.")
 
     except (BrokenPipeError,ConnectionResetError) as exception:
-        print(f"[{debug_name} - ERROR] Connection interrupted.")
+        log.error(debug_name,"Connection interrupted.")
 
     except ssl.SSLError as exception:
-        print(f"[{debug_name} - ERROR] SSL exception: {str(exception)}")
+        log.error(debug_name,f"SSL exception: {str(exception)}")
+
+    except socket.timeout:
+        log.error(debug_name,"Connection timed out.")
 
     except Exception as exception:
-        print("this exc")
-        print(f"[{debug_name} - ERROR] Unexpected exception:")
-        traceback.print_exc()
+        log.exception(debug_name,"Unexpected exception:")
 
     finally:
+        profiling.finish(request_profile)
+        metrics.connection_closed()
         close_socket(connected_socket)
-        sys.exit(1)
+
+def send_stream(send_socket,response_stream,send_size,activity_slot):
+    try:
+        for chunk_data in response_stream:
+            if (response_stream._chunked):
+                send_buffers(send_socket,[f"{len(chunk_data):x}\r\n".encode("utf-8"),chunk_data,b"\r\n"],send_size,activity_slot)
+            else:
+                send_buffers(send_socket,[chunk_data],send_size,activity_slot)
+        if (response_stream._chunked):
+            send_buffers(send_socket,[b"0\r\n\r\n"],send_size,activity_slot)
+    finally:
+        response_stream.close()
+
+def send_file(send_socket,file_path,read_start,read_end,config,activity_slot):
+    with open(file_path,"rb") as open_file:
+        if (isinstance(send_socket,ssl.SSLSocket)):
+            # Data has to be encrypted in userspace, read into one buffer instead of allocating per chunk
+            file_buffer = memoryview(bytearray(min(config["file_buffer_kb"] * 1024,max(read_end - read_start,1))))
+            open_file.seek(read_start)
+            bytes_left = (read_end - read_start)
+            while (bytes_left > 0):
+                read_size = open_file.readinto(file_buffer[:min(bytes_left,len(file_buffer))])
+                if (read_size <= 0):
+                    raise EOFError(f"{file_path} ended before the announced length.")
+                send_socket.sendall(file_buffer[:read_size])
+                bytes_left = (bytes_left - read_size)
+                activity_slot.report(read_size)
+        else:
+            sendfile_size = (config["sendfile_size_mb"] * 1024 * 1024)
+            file_offset = read_start
+            while (file_offset < read_end):
+                sent_bytes = send_socket.sendfile(open_file,file_offset,min((read_end - file_offset),sendfile_size))
+                if (sent_bytes <= 0):
+                    raise EOFError(f"{file_path} ended before the announced length.")
+                file_offset = (file_offset + sent_bytes)
+                activity_slot.report(sent_bytes)
+
+def build_error_response(request_class,status_code,message,error_routes,config):
+    return build_closing_response(request_class,(status_code,message),error_routes,config)
+
+def build_closing_response(request_class,generated_response,error_routes,config):
+    # Responses sent before the request was fully received, the connection is closed afterwards
+    def closing_route(request):
+        return generated_response
+    response_class = ScheduledResponse(request_class,closing_route,error_routes).run()
+    if (not response_class):
+        return None
+    response_class.headers["Connection"] = "close"
+    return prepare_response(request_class,response_class,config)
+
+def check_request_body(request_class,config):
+    # Returns a Response or (status_code, message) if the request has to be rejected before its body is read,
+    # every framing header is read through the case-insensitive request_class.headers
+    request_headers = request_class.headers
+    transfer_encoding = request_headers.get("Transfer-Encoding")
+    content_length = request_headers.get("Content-Length")
+    if (transfer_encoding):
+        if (content_length):
+            return 400,"Content-Length and Transfer-Encoding must not be combined."
+        if (transfer_encoding.split(",")[-1].strip().lower() != "chunked"):
+            return 501,"Only the chunked transfer coding is supported."
+    elif (content_length):
+        if ((not content_length.isascii()) or (not content_length.isdigit())):
+            return 400,"Invalid Content-Length."
+        request_headers["Content-Length"] = int(content_length)
+        if (request_headers["Content-Length"] > (config["max_body_size_mb"] * 1024 * 1024)):
+            return 413,"Request body is too large."
+    if (request_headers.get("Expect") and (not expects_continue(request_class))):
+        return 417,"Only 100-continue is supported."
+    if (config["pre_body"]):
+        return config["pre_body"](request_class)
+    return None
+
+def expects_continue(request_class):
+    request_headers = request_class.headers
+    if ((request_class.version != "HTTP/1.1") or (request_headers.get("Expect","").strip().lower() != "100-continue")):
+        return False
+    return bool(request_headers.get("Transfer-Encoding") or request_headers.get("Content-Length"))
+
+def find_route(request_class,route_table,error_routes):
+    route_entry,request_class.route_params = route_table.find(request_class.url)
+    if (not route_entry):
+        return error_routes[404]
+    request_class.route = route_entry["route"]
+    request_class._compression_level = route_entry["compression_level"]
+
+    route_handlers = route_entry["handlers"]
+    responding_route = (route_handlers.get(request_class.method) or route_handlers.get(None))
+    if (responding_route):
+        return responding_route
+
+    def method_not_allowed(request):
+        response_class = error_routes[405](request,f"{request.method} is not allowed.")
+        if (response_class):
+            response_class.headers["Allow"] = ", ".join(route_handlers.keys())
+        return response_class
+    return method_not_allowed
+
+def prepare_response(request_class,response_class,config):
+    debug_name = f"{request_class.address[0]}:{str(request_class.address[1])}"
+    content_is_file = isinstance(response_class.content,FilePath)
+
+    if (content_is_file):
+        # Validators always describe the original file, the encoding is added to the ETag
+        original_stat = response_class.content._stat_result
+        if (response_class.status_code == 200):
+            variant_path,content_encoding = compression.select_file_variant(request_class,response_class,config)
+            if (variant_path):
+                try:
+                    response_class.content = FilePath(variant_path)
+                    response_class.headers["Content-Encoding"] = content_encoding
+                except OSError:
+                    log.warn(debug_name,"Compressed variant disappeared, sending the file uncompressed.")
+        stat_result = response_class.content._stat_result
+        content_length = stat_result.st_size
+        if (response_class.status_code == 200):
+            # Validators come from the stat result, a 304 never touches the file body
+            response_class.headers.setdefault("ETag",file_cache.get_etag(original_stat,response_class.headers.get("Content-Encoding")))
+            response_class.headers.setdefault("Last-Modified",file_cache.get_last_modified(original_stat))
+            if (config["file_cache_control"]):
+                response_class.headers.setdefault("Cache-Control",config["file_cache_control"])
+            if ((request_class.method in ("GET","HEAD")) and file_cache.is_not_modified(request_class.headers,response_class.headers["ETag"],original_stat)):
+                log.debug(debug_name,"File not modified.")
+                response_class.status_code = 304
+                response_class.content = b""
+                content_is_file = False
+        if (content_is_file and (config["allow_range_from_mb"] != -1) and (config["allow_range_from_mb"] <= (content_length / 1024 / 1024))):
+            response_class.headers["Accept-Ranges"] = "bytes"
+            if ((response_class.status_code == 200) and (request_class.method == "GET") and request_class.headers.get("Range") and is_range_current(request_class,response_class)):
+                byte_ranges = parse_range(request_class.headers["Range"],content_length,config["max_range_count"])
+                if (byte_ranges == []):
+                    log.debug(debug_name,"Range not satisfiable: %s",request_class.headers["Range"])
+                    response_class = Response(
+                        status_code = 416,
+                        headers = {
+                            "Content-Type": "text/plain",
+                            "Content-Range": f"bytes */{str(content_length)}"
+                        },
+                        content = b"416 Range Not Satisfiable"
+                    )
+                    response_class.request = request_class
+                elif (byte_ranges):
+                    response_class.status_code = 206
+                    if (len(byte_ranges) == 1):
+                        response_class.headers["Content-Range"] = f"bytes {str(byte_ranges[0][0])}-{str(byte_ranges[0][1] - 1)}/{str(content_length)}"
+                        response_class.content.read_start,response_class.content.read_end = byte_ranges[0]
+                    else:
+                        set_multipart_ranges(response_class,byte_ranges,content_length)
+                    log.debug(debug_name,"Partial file response: %s",request_class.headers["Range"][6:])
+
+    if (config["pre_send"]):
+        log.debug(debug_name,"Running pre_send.")
+        config["pre_send"](response_class)
+
+    if (isinstance(response_class.content,(bytes,ResponseStream))):
+        compression.compress_response(request_class,response_class,config)
+
+    if (response_class.status_code == 304):
+        response_class.headers.pop("Content-Length",None)
+    elif (isinstance(response_class.content,ResponseStream)):
+        response_class.headers.pop("Content-Length",None)
+        if (request_class.version == "HTTP/1.1"):
+            response_class.headers["Transfer-Encoding"] = "chunked"
+        else:
+            # HTTP/1.0 has no chunked encoding, the end of the body is marked by closing the connection
+            response_class.content._chunked = False
+            response_class.headers["Connection"] = "close"
+    elif (isinstance(response_class.content,FilePath)):
+        response_class.content._cached_content = file_cache.get_content(config,response_class.content.path,response_class.content._stat_result)
+        response_class.headers["Content-Length"] = response_class.content._get_length()
+    else:
+        response_class.headers["Content-Length"] = len(response_class.content)
+    return response_class
+
+def parse_range(range_header,content_length,max_range_count):
+    # None means the header has to be ignored, [] that no range is satisfiable,
+    # otherwise the ranges are returned sorted and coalesced as (start, end) with an exclusive end
+    range_unit,unit_separator,range_specs = range_header.partition("=")
+    if ((not unit_separator) or (range_unit.strip().lower() != "bytes")):
+        return None
+    range_specs = [range_spec.strip() for range_spec in range_specs.split(",") if range_spec.strip()]
+    if ((not range_specs) or (len(range_specs) > max_range_count)):
+        return None
+
+    byte_ranges = []
+    for range_spec in range_specs:
+        range_match = re.fullmatch(r"([0-9]*)\s*-\s*([0-9]*)",range_spec)
+        if ((not range_match) or (not (range_match[1] or range_match[2]))):
+            return None
+        if (not range_match[1]):
+            if (int(range_match[2]) > 0):
+                byte_ranges.append((max((content_length - int(range_match[2])),0),content_length))
+            continue
+        range_start = int(range_match[1])
+        range_end = content_length
+        if (range_match[2]):
+            if (int(range_match[2]) < range_start):
+                return None
+            range_end = min((int(range_match[2]) + 1),content_length)
+        if (range_start < content_length):
+            byte_ranges.append((range_start,range_end))
+
+    coalesced_ranges = []
+    for range_start,range_end in sorted(byte_ranges):
+        if (coalesced_ranges and (range_start <= coalesced_ranges[-1][1])):
+            coalesced_ranges[-1] = (coalesced_ranges[-1][0],max(coalesced_ranges[-1][1],range_end))
+        else:
+            coalesced_ranges.append((range_start,range_end))
+    return coalesced_ranges
+
+def is_range_current(request_class,response_class):
+    # If-Range holds either a strong ETag or the exact Last-Modified date, anything else means the full file is sent
+    if_range = request_class.headers.get("If-Range")
+    if (not if_range):
+        return True
+    if (if_range.startswith("\"") or if_range.startswith("W/")):
+        return (if_range == response_class.headers.get("ETag"))
+    return (if_range == response_class.headers.get("Last-Modified"))
+
+def set_multipart_ranges(response_class,byte_ranges,content_length):
+    boundary = os.urandom(12).hex()
+    part_type = response_class.headers.get("Content-Type","application/octet-stream")
+    file_segments = []
+    for range_start,range_end in byte_ranges:
+        part_separator = ("\r\n" if file_segments else "")
+        file_segments.append(f"{part_separator}--{boundary}\r\nContent-Type: {part_type}\r\nContent-Range: bytes {str(range_start)}-{str(range_end - 1)}/{str(content_length)}\r\n\r\n".encode("utf-8"))
+        file_segments.append((range_start,range_end))
+    file_segments.append(f"\r\n--{boundary}--\r\n".encode("utf-8"))
+    response_class.headers["Content-Type"] = f"multipart/byteranges; boundary={boundary}"
+    response_class.content._segments = file_segments
+
+def is_websocket_handshake(request_class):
+    # Connection and Upgrade hold case-insensitive tokens
+    return (("upgrade" in request_class.headers.get("Connection","").lower()) and (request_class.headers.get("Upgrade","").lower() == "websocket") and (request_class.headers.get("Sec-WebSocket-Key")))
+
+def build_handshake_response(request_class,websocket_connection):
+    response_class = Response(
+        status_code = 101,
+        headers = {
+            "Upgrade": "websocket",
+            "Connection": "Upgrade",
+            "Sec-Websocket-Accept": base64.b64encode(hashlib.sha1(f"{request_class.headers.get('Sec-WebSocket-Key')}258EAFA5-E914-47DA-95CA-C5AB0DC85B11".encode("utf-8")).digest()).decode("utf-8")
+        },
+        content = b""
+    )
+    if (websocket_connection.extensions):
+        response_class.headers["Sec-WebSocket-Extensions"] = websocket_connection.extensions
+    return response_class
+
+def set_keep_alive(request_class,response_class,config,is_reused):
+    if (response_class.headers.get("Connection")):
+        return False
+    # HTTP/1.1 connections are persistent unless the client asks to close, HTTP/1.0 ones only on request
+    connection_header = (request_class.headers.get("Connection") or "").lower()
+    if (request_class.version == "HTTP/1.1"):
+        client_keep_alive = ("close" not in connection_header)
+    else:
+        client_keep_alive = ("keep-alive" in connection_header)
+    if (config["keep_alive"] and (is_reused < config["max_socket_reuse"]) and client_keep_alive):
+        response_class.headers["Connection"] = "keep-alive"
+        response_class.headers["Keep-Alive"] = f"timeout={str(config['keep_alive_timeout'])}, max={str(config['max_socket_reuse'] - is_reused)}"
+        return True
+    response_class.headers["Connection"] = "close"
+    return False
+
+def build_response_head(response_class):
+    if (response_class.headers.get("Set-Cookie")):
+        log.error(response_class.request.address[0],"Set-Cookie header was returned by ScheduledResponse, add ResponseCookie to Response.cookies instead.")
+        raise RuntimeError("Set-Cookie illegaly set.")
+
+    # Collected as str parts and encoded once, the status line comes precomputed from code_description
+    head_lines = []
+    for header_name,header_value in response_class.headers.items():
+        head_lines.append(f"{header_name}: {header_value}\r\n")
+
+    for cookie_name,cookie_value in response_class.cookies.items():
+        head_lines.append(f"Set-Cookie: {cookie_name}={cookie_value.value}")
+        if (cookie_value.max_age):
+            head_lines.append(f"; Max-Age={str(cookie_value.max_age)}")
+        if (cookie_value.domain):
+            head_lines.append(f"; Domain={cookie_value.domain}")
+        if (cookie_value.http_only):
+            head_lines.append("; HttpOnly")
+        if (cookie_value.secure):
+            head_lines.append("; Secure")
+        if (cookie_value.path):
+            head_lines.append(f"; Path={cookie_value.path}")
+        if (cookie_value.same_site):
+            head_lines.append(f"; SameSite={cookie_value.same_site}")
+        head_lines.append("\r\n")
+
+    head_lines.append("\r\n")
+    return (code_description.get_status_line(response_class.status_code) + "".join(head_lines).encode("utf-8"))
+
+def send_buffers(send_socket,buffers,send_size,activity_slot,more_data = False):
+    # Head and body are handed to sendmsg together instead of being concatenated into a new bytes object
+    buffers = [memoryview(buffer) for buffer in buffers if buffer]
+    send_flags = (MSG_MORE if more_data else 0)
+    if (isinstance(send_socket,ssl.SSLSocket)):
+        # SSLSocket has no sendmsg, small responses are still joined so they fit one TLS record
+        if ((len(buffers) > 1) and (sum(len(buffer) for buffer in buffers) <= min(send_size,TLS_RECORD_SIZE))):
+            buffers = [memoryview(b"".join(buffers))]
+    while (buffers):
+        if (isinstance(send_socket,ssl.SSLSocket)):
+            sent_bytes = send_socket.send(buffers[0][:send_size])
+        else:
+            send_parts = []
+            parts_left = send_size
+            for buffer in buffers:
+                send_parts.append(buffer[:parts_left])
+                parts_left = (parts_left - len(send_parts[-1]))
+                if (parts_left <= 0):
+                    break
+            sent_bytes = send_socket.sendmsg(send_parts,[],send_flags)
+        activity_slot.report(sent_bytes)
+        while (sent_bytes > 0):
+            if (sent_bytes >= len(buffers[0])):
+                sent_bytes = (sent_bytes - len(buffers[0]))
+                buffers.pop(0)
+            else:
+                buffers[0] = buffers[0][sent_bytes:]
+                sent_bytes = 0
 
 class Request:
     def __init__(self,method,headers,content,version,url,address):
         self.method = method
-        self.headers = headers
+        self.headers = utility.HeaderDict(headers)
         self.cookies = None
         self.content = content
         self.version = version
         self.url = url
-        self.params = {}
         self.address = address
+        self.route = None
+        self.route_params = {}
+        self._compression_level = None
+        self._params = None
+        self._query = ""
+        self._body_file = None
+
+    @property
+    def params(self):
+        if (self._params == None):
+            self._params = {}
+            if (self._query):
+                for param_name,param_values in urllib.parse.parse_qs(self._query).items():
+                    self._params[param_name] = param_values[0]
+        return self._params
+
+    @params.setter
+    def params(self,params):
+        self._params = params
+
+    @property
+    def content(self):
+        if ((self._content is None) and self._body_file):
+            self._body_file.seek(0)
+            self._content = self._body_file.read()
+        return self._content
+
+    @content.setter
+    def content(self,content):
+        self._content = content
+
+    @property
+    def body_file(self):
+        if (not self._body_file):
+            self._body_file = io.BytesIO(self._content or b"")
+        self._body_file.seek(0)
+        return self._body_file
+
+    def stream(self,chunk_size = 65536):
+        body_file = self.body_file
+        while True:
+            chunk_data = body_file.read(chunk_size)
+            if (not chunk_data):
+                return
+            yield chunk_data
+
+    def _set_body_file(self,body_file):
+        self._body_file = body_file
+        self._content = None
+
+    def _close_body(self):
+        if (self._body_file):
+            self._body_file.close()
 
     def _extract_cookies(self):
         if (self.headers.get("Cookie")):
@@ -339,56 +731,86 @@ class ScheduledResponse:
         self.error_routes = error_routes
 
     def run(self):
-        generated_response = None
         try:
-            generated_response = self.route_function(self.request)
-            if (isinstance(generated_response,tuple)):
-                generated_response = self.error_routes[generated_response[0]](self.request,generated_response[1])
+            generated_response = self._finish_response(self._check_response(self.route_function(self.request)))
+            if (generated_response and isinstance(generated_response.content,ResponseStream)):
+                generated_response.content._peek()
+        except Exception as exception:
+            generated_response = self._finish_response(self._handle_exception(exception))
+        return generated_response
+
+    async def run_async(self,executor = None):
+        try:
+            if (inspect.iscoroutinefunction(self.route_function)):
+                generated_response = await self.route_function(self.request)
             else:
-                generated_response.request = self.request
-                if (generated_response.status_code not in code_description.code_info.keys()):
-                    print(f"[{self.request.address[0]} - ERROR] Unknown status: {str(generated_response.status_code)}")
-                    raise ValueError
-                elif (not isinstance(generated_response.headers,dict)):
-                    print(f"[{self.request.address[0]} - ERROR] Unreadable response.headers value.")
-                    raise ValueError
+                generated_response = await asyncio.get_running_loop().run_in_executor(executor,self.route_function,self.request)
+            generated_response = self._finish_response(self._check_response(generated_response))
+            if (generated_response and isinstance(generated_response.content,ResponseStream)):
+                await generated_response.content._peek_async(executor)
         except Exception as exception:
-            print(f"[{self.request.address[0]} - ERROR] Unexpected server error:")
-            traceback.print_exc()
-            try:
-                generated_response = self.error_routes[500](self.request,f"Unexpected exception: {exception.__class__.__name__}")
-            except Exception:
-                print(f"[{self.request.address[0]} - ERROR] Releasing process, unexpected error-route error:")
-                traceback.print_exc()
+            generated_response = self._finish_response(self._handle_exception(exception))
+        return generated_response
+
+    def _check_response(self,generated_response):
+        if (isinstance(generated_response,tuple)):
+            return self.error_routes[generated_response[0]](self.request,generated_response[1])
+        generated_response.request = self.request
+        if (generated_response.status_code not in code_description.code_info.keys()):
+            log.error(self.request.address[0],f"Unknown status: {str(generated_response.status_code)}")
+            raise ValueError
+        elif (not isinstance(generated_response.headers,dict)):
+            log.error(self.request.address[0],"Unreadable response.headers value.")
+            raise ValueError
+        return generated_response
+
+    def _handle_exception(self,exception):
+        log.exception(self.request.address[0],"Unexpected server error:")
+        try:
+            return self.error_routes[500](self.request,f"Unexpected exception: {exception.__class__.__name__}")
+        except Exception:
+            log.exception(self.request.address[0],"Releasing process, unexpected error-route error:")
+        return None
 
+    def _finish_response(self,generated_response):
         if (not generated_response):
             return None
 
+        if (is_stream_content(generated_response.content)):
+            generated_response.content = ResponseStream(generated_response.content)
+
         if (not generated_response.headers.get("Content-Type")):
             if (isinstance(generated_response.content,str)):
                 generated_response.headers["Content-Type"] = "text/plain"
                 generated_response.content = generated_response.content.encode("utf-8")
             elif (isinstance(generated_response.content,FilePath)):
                 generated_response.headers["Content-Type"] = (mimetypes.guess_type(generated_response.content.path,False)[0] or "text/plain")
-            elif (isinstance(generated_response.content,dict)):
+            elif (isinstance(generated_response.content,JSON_TYPES)):
+                generated_response.headers["Content-Type"] = "application/json"
+                generated_response.content = encode_json(generated_response.content)
+            elif (isinstance(generated_response.content,JSONStream)):
                 generated_response.headers["Content-Type"] = "application/json"
-                generated_response.content = json.dumps(generated_response.content).encode("utf-8")
-            elif (isinstance(generated_response.content,bytes)):
+            elif (isinstance(generated_response.content,(bytes,ResponseStream))):
                 generated_response.headers["Content-Type"] = "text/plain"
             else:
-                print(f"[{self.request.address[0]} - ERROR] Response content type ({type(generated_response.content).__name__}) is not supported.")
+                log.error(self.request.address[0],f"Response content type ({type(generated_response.content).__name__}) is not supported.")
                 raise NotImplementedError
-        elif (not isinstance(generated_response.content,bytes)):
+        elif (isinstance(generated_response.content,str)):
             generated_response.content = generated_response.content.encode("utf-8")
+        elif (isinstance(generated_response.content,JSON_TYPES)):
+            generated_response.content = encode_json(generated_response.content)
 
         return generated_response
 
 class FilePath:
     def __init__(self,path):
         self.path = path
+        self._stat_result = os.stat(self.path)
         self.read_start = 0
-        self.read_end = os.path.getsize(self.path)
+        self.read_end = self._stat_result.st_size
         self._content = None
+        self._cached_content = None
+        self._segments = None
 
     def read(self,read_range = None,twice = False):
         if (twice or (not self._content)):
@@ -400,7 +822,157 @@ class FilePath:
                 self._content = open_file.read()
             open_file.close()
         return self._content
+
+    def _get_segments(self):
+        # Byte strings are sent as they are, (start, end) tuples are read from the file (multipart ranges mix both)
+        if (self._segments != None):
+            return self._segments
+        return [(self.read_start,self.read_end)]
+
+    def _get_length(self):
+        content_length = 0
+        for file_segment in self._get_segments():
+            if (isinstance(file_segment,bytes)):
+                content_length = (content_length + len(file_segment))
+            else:
+                content_length = (content_length + (file_segment[1] - file_segment[0]))
+        return content_length
     
+# Marks the end of a stream, None may be a chunk of a broken stream
+STREAM_END = object()
+JSON_TYPES = (dict,list,tuple,set,frozenset)
+
+class ResponseStream:
+    # Sent with "Transfer-Encoding: chunked", empty chunks are skipped since they would end the body
+    def __init__(self,content,chunk_size = 65536):
+        self.content = content
+        self.chunk_size = chunk_size
+        self._compressor = None
+        self._chunked = True
+        self._content_iterator = None
+        self._first_chunk = STREAM_END
+
+    def __iter__(self):
+        if (self._content_iterator == None):
+            self._content_iterator = self._iter_content()
+        if (self._first_chunk is not STREAM_END):
+            chunk_data = self._encode_chunk(self._first_chunk)
+            if (chunk_data):
+                yield chunk_data
+        for chunk_data in self._content_iterator:
+            chunk_data = self._encode_chunk(chunk_data)
+            if (chunk_data):
+                yield chunk_data
+        if (self._compressor):
+            yield self._compressor.flush()
+
+    async def iter_async(self,executor = None):
+        if (self._first_chunk is not STREAM_END):
+            chunk_data = self._encode_chunk(self._first_chunk)
+            if (chunk_data):
+                yield chunk_data
+        if (hasattr(self.content,"__aiter__")):
+            if (self._content_iterator == None):
+                self._content_iterator = self.content.__aiter__()
+            while True:
+                try:
+                    chunk_data = await self._content_iterator.__anext__()
+                except StopAsyncIteration:
+                    break
+                chunk_data = self._encode_chunk(chunk_data)
+                if (chunk_data):
+                    yield chunk_data
+        else:
+            # Generators may block, every chunk is produced in the executor
+            event_loop = asyncio.get_running_loop()
+            if (self._content_iterator == None):
+                self._content_iterator = self._iter_content()
+            while True:
+                chunk_data = await event_loop.run_in_executor(executor,next,self._content_iterator,STREAM_END)
+                if (chunk_data is STREAM_END):
+                    break
+                chunk_data = self._encode_chunk(chunk_data)
+                if (chunk_data):
+                    yield chunk_data
+        if (self._compressor):
+            yield self._compressor.flush()
+
+    def _peek(self):
+        # The first chunk is produced before the head is sent, a stream of the wrong type is answered with 500 instead of a cut off 200
+        self._content_iterator = self._iter_content()
+        self._check_first_chunk(next(self._content_iterator,STREAM_END))
+
+    async def _peek_async(self,executor = None):
+        if (hasattr(self.content,"__aiter__")):
+            self._content_iterator = self.content.__aiter__()
+            try:
+                first_chunk = await self._content_iterator.__anext__()
+            except StopAsyncIteration:
+                first_chunk = STREAM_END
+        else:
+            self._content_iterator = self._iter_content()
+            first_chunk = await asyncio.get_running_loop().run_in_executor(executor,next,self._content_iterator,STREAM_END)
+        self._check_first_chunk(first_chunk)
+
+    def _check_first_chunk(self,first_chunk):
+        if ((first_chunk is not STREAM_END) and (not isinstance(first_chunk,(bytes,bytearray,memoryview,str)))):
+            self.close()
+            raise TypeError(f"Response streams must produce bytes or str, not {type(first_chunk).__name__}.")
+        self._first_chunk = first_chunk
+
+    def close(self):
+        if (hasattr(self.content,"close")):
+            self.content.close()
+
+    def _iter_content(self):
+        if (hasattr(self.content,"read")):
+            while True:
+                chunk_data = self.content.read(self.chunk_size)
+                if (not chunk_data):
+                    return
+                yield chunk_data
+        elif (hasattr(self.content,"__iter__")):
+            yield from self.content
+        else:
+            raise TypeError("Async iterators can only be streamed by OutsideAsyncHTTP.")
+
+    def _encode_chunk(self,chunk_data):
+        if (isinstance(chunk_data,str)):
+            chunk_data = chunk_data.encode("utf-8")
+        if (self._compressor):
+            chunk_data = (self._compressor.compress(chunk_data) + self._compressor.flush(zlib.Z_SYNC_FLUSH))
+        return chunk_data
+
+class JSONStream(ResponseStream):
+    # Encodes with JSONEncoder.iterencode, slower than json.dumps but the document never exists as a whole in memory
+    def __init__(self,data,chunk_size = 65536):
+        super().__init__(self._encode(data,chunk_size),chunk_size)
+
+    @staticmethod
+    def _encode(data,chunk_size):
+        json_parts = []
+        parts_size = 0
+        for json_part in json.JSONEncoder().iterencode(data):
+            json_parts.append(json_part)
+            parts_size = (parts_size + len(json_part))
+            if (parts_size >= chunk_size):
+                yield "".join(json_parts).encode("utf-8")
+                json_parts = []
+                parts_size = 0
+        if (json_parts):
+            yield "".join(json_parts).encode("utf-8")
+
+def encode_json(content):
+    if (isinstance(content,(set,frozenset))):
+        content = list(content)
+    return json.dumps(content).encode("utf-8")
+
+def is_stream_content(content):
+    # Lists, tuples and sets are iterable too, but they are sent as JSON like dict
+    if (isinstance(content,(str,bytes,bytearray,FilePath,ResponseStream) + JSON_TYPES)):
+        return False
+    return (hasattr(content,"read") or hasattr(content,"__iter__") or hasattr(content,"__aiter__"))
+
 class ResponseCookie:
     def __init__(self,value,max_age,domain,http_only,secure,path,same_site):
         self.value = value
@@ -0,0 +1,296 @@
+import asyncio
+import concurrent.futures
+import sys
+import time
+import ssl
+import signal
+import inspect
+
+from . import log
+from . import protocol_http
+from . import code_description
+from . import protocol_websocket
+from . import request_parser
+from . import tls_context
+from . import pubsub
+from . import metrics
+from . import profiling
+
+# Compressing fewer bytes takes less time than handing the response to the executor
+EXECUTOR_COMPRESS_SIZE = (64 * 1024)
+
+def run_event_loop(loop_index,main_socket,config,route_table,error_routes):
+    def terminate(signum = None,stackframe = None):
+        profiling.flush()
+        log.flush()
+        sys.exit(0)
+
+    def reload_certificate(signum = None,stackframe = None):
+        tls_context.reload_certificate(config)
+
+    signal.signal(signal.SIGINT,terminate)
+    signal.signal(signal.SIGTERM,terminate)
+    if (config["ssl_enabled"] and (config["ssl_reload_signal"] != None)):
+        signal.signal(config["ssl_reload_signal"],reload_certificate)
+    metrics.set_worker(loop_index)
+    asyncio.run(serve_event_loop(main_socket,config,route_table,error_routes))
+    profiling.flush()
+    log.flush()
+    sys.exit(0)
+
+async def serve_event_loop(main_socket,config,route_table,error_routes):
+    event_loop = asyncio.get_running_loop()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers = config["max_workers"])
+    active_connections = set()
+
+    ssl_context = None
+    if (config["ssl_enabled"]):
+        ssl_context = tls_context.get_context(config)
+
+    async def on_connection(reader,writer):
+        if (len(active_connections) >= config["max_connections"]):
+            log.warn("LOOP/HTTP","Too many connections, closing new connection.")
+            writer.close()
+            return
+        current_task = asyncio.current_task()
+        active_connections.add(current_task)
+        try:
+            await serve_connection(reader,writer,config,route_table,error_routes,executor)
+        finally:
+            active_connections.discard(current_task)
+
+    server = await asyncio.start_server(
+        on_connection,
+        sock = main_socket,
+        ssl = ssl_context,
+        backlog = config["backlog_length"]
+    )
+    serve_task = asyncio.ensure_future(server.serve_forever())
+    event_loop.add_signal_handler(signal.SIGINT,serve_task.cancel)
+    event_loop.add_signal_handler(signal.SIGTERM,serve_task.cancel)
+    try:
+        await serve_task
+    except asyncio.CancelledError:
+        pass
+    finally:
+        server.close()
+        for connection_task in list(active_connections):
+            connection_task.cancel()
+        executor.shutdown(wait = False)
+
+def prepares_in_executor(response_class,config):
+    # FilePath responses touch the disk (sidecar stat, compressed variants, cache fills), big bodies may be compressed
+    if (isinstance(response_class.content,protocol_http.FilePath)):
+        return True
+    return (config["compression"] and isinstance(response_class.content,bytes) and (len(response_class.content) >= EXECUTOR_COMPRESS_SIZE))
+
+async def serve_connection(reader,writer,config,route_table,error_routes,executor):
+    event_loop = asyncio.get_running_loop()
+    address = writer.get_extra_info("peername")[:2]
+    debug_name = f"{address[0]}:{str(address[1])}"
+
+    request_profile = None
+    metrics.connection_opened()
+    try:
+        # The parser lives as long as the connection, bytes of pipelined requests stay buffered in it
+        head_parser = request_parser.RequestParser(config)
+        for is_reused in range(config["max_socket_reuse"] + 1):
+            # Request Flow
+            request_class = protocol_http.Request("",{},b"","","",address)
+            ## Receive Request Info + Headers
+            log.debug(debug_name,"Waiting for request info.")
+            try:
+                if ((is_reused > 0) and (not head_parser.find_head())):
+                    # Idle between requests: wait keep_alive_timeout for the first byte, then fall back to the request timeout
+                    try:
+                        recv_data = await asyncio.wait_for(reader.read(config["recv_size"]),config["keep_alive_timeout"])
+                    except asyncio.TimeoutError:
+                        log.debug(debug_name,"Keep-alive timed out, closing connection.")
+                        return
+                    if (not recv_data):
+                        return
+                    head_parser.feed(recv_data)
+                start_time = time.perf_counter()
+                while (not head_parser.find_head()):
+                    recv_data = await asyncio.wait_for(reader.read(config["recv_size"]),config["process_timeout"])
+                    if (not recv_data):
+                        return
+                    head_parser.feed(recv_data)
+                request_size = head_parser.parse_head(request_class)
+                head_time = time.perf_counter()
+            except request_parser.RequestHeadError as exception:
+                log.error(debug_name,f"Invalid request head: {exception.message}")
+                response_class = protocol_http.build_error_response(request_class,exception.status_code,exception.message,error_routes,config)
+                if (response_class):
+                    writer.writelines([protocol_http.build_response_head(response_class),response_class.content])
+                    await writer.drain()
+                return
+
+            log.debug(debug_name,"Flow: %s",request_class.url)
+
+            ## Check Route
+            responding_route = protocol_http.find_route(request_class,route_table,error_routes)
+            websocket_connection = None
+            if (isinstance(responding_route,protocol_websocket.WebSocket)):
+                log.debug(debug_name,"Initializing websocket.")
+                if (not inspect.iscoroutinefunction(responding_route.connection_handler)):
+                    log.error(debug_name,"WebSocket handlers of the event loop engine must be async functions.")
+                    def responding_route(request):
+                        return 501,"Only async WebSocket handlers are supported by this server."
+                elif (not protocol_http.is_websocket_handshake(request_class)):
+                    log.error(debug_name,"Handshake not accepted.")
+                    responding_route = error_routes[400]
+
+            ## Receive Body
+            body_rejection = protocol_http.check_request_body(request_class,config)
+            if (body_rejection):
+                log.warn(debug_name,"Request rejected before receiving its body.")
+                response_class = protocol_http.build_closing_response(request_class,body_rejection,error_routes,config)
+                if (response_class):
+                    writer.writelines([protocol_http.build_response_head(response_class),response_class.content])
+                    await writer.drain()
+                return
+            if (protocol_http.expects_continue(request_class) and (not head_parser.buffered())):
+                writer.write(code_description.get_status_line(100) + b"\r\n")
+                await writer.drain()
+
+            if (request_class.headers.get("Transfer-Encoding") or request_class.headers.get("Content-Length")):
+                log.debug(debug_name,"Receiving content.")
+                try:
+                    body_receiver = request_parser.BodyReceiver(head_parser,request_class,config)
+                    while (body_receiver.wanted_size()):
+                        recv_data = await asyncio.wait_for(reader.read(body_receiver.wanted_size()),config["process_timeout"])
+                        if (not recv_data):
+                            raise BrokenPipeError
+                        if (body_receiver.writes_spool(len(recv_data))):
+                            # Writes past the spool size go to a file on disk
+                            await event_loop.run_in_executor(executor,body_receiver.feed,recv_data)
+                        else:
+                            body_receiver.feed(recv_data)
+                except request_parser.RequestBodyError as exception:
+                    log.error(debug_name,f"Invalid request body: {exception.message}")
+                    response_class = protocol_http.build_error_response(request_class,exception.status_code,exception.message,error_routes,config)
+                    if (response_class):
+                        writer.writelines([protocol_http.build_response_head(response_class),response_class.content])
+                        await writer.drain()
+                    return
+                body_size = body_receiver.finish(request_class)
+                request_size = (request_size + body_size)
+                log.debug(debug_name,"Received %dB content.",body_size)
+
+            ## Respond
+            handler_start_time = time.perf_counter()
+            request_profile = profiling.select(request_class)
+            if (isinstance(responding_route,protocol_websocket.WebSocket)):
+                # Bytes following the handshake already belong to the websocket
+                websocket_connection = protocol_websocket.AsyncWebSocketConnection(request_class,reader,writer,config,pubsub.server_hub,head_parser.take(head_parser.buffered()))
+                response_class = protocol_http.build_handshake_response(request_class,websocket_connection)
+            else:
+                log.debug(debug_name,"Generating response.")
+                if (request_profile):
+                    # While an async handler or the send path awaits, other connections of this loop run under the profiler too
+                    if (inspect.iscoroutinefunction(responding_route)):
+                        request_profile.enable()
+                    else:
+                        responding_route = request_profile.wrap(responding_route)
+                scheduled_response_class = protocol_http.ScheduledResponse(request_class,responding_route,error_routes)
+                response_class = await scheduled_response_class.run_async(executor)
+                if (not response_class):
+                    log.warn(debug_name,"ScheduledResponse did not return Response, closing connection.")
+                    return
+
+            if (prepares_in_executor(response_class,config)):
+                response_class = await event_loop.run_in_executor(executor,protocol_http.prepare_response,request_class,response_class,config)
+            else:
+                response_class = protocol_http.prepare_response(request_class,response_class,config)
+            socket_keep_alive = protocol_http.set_keep_alive(request_class,response_class,config,is_reused)
+            response_data = protocol_http.build_response_head(response_class)
+
+            log.debug(debug_name,"Sending response.")
+            send_start_time = time.perf_counter()
+            if (request_profile):
+                request_profile.enable()
+            bytes_sent = len(response_data)
+            if (isinstance(response_class.content,protocol_http.FilePath)):
+                writer.write(response_data)
+                file_path = response_class.content
+                for file_segment in file_path._get_segments():
+                    if (isinstance(file_segment,bytes)):
+                        writer.write(file_segment)
+                        bytes_sent = (bytes_sent + len(file_segment))
+                        continue
+                    bytes_sent = (bytes_sent + (file_segment[1] - file_segment[0]))
+                    if (file_path._cached_content != None):
+                        writer.write(memoryview(file_path._cached_content)[file_segment[0]:file_segment[1]])
+                    else:
+                        await writer.drain()
+                        with open(file_path.path,"rb") as open_file:
+                            await event_loop.sendfile(
+                                writer.transport,
+                                open_file,
+                                offset = file_segment[0],
+                                count = (file_segment[1] - file_segment[0])
+                            )
+            elif (isinstance(response_class.content,protocol_http.ResponseStream)):
+                writer.write(response_data)
+                try:
+                    async for chunk_data in response_class.content.iter_async(executor):
+                        if (response_class.content._chunked):
+                            chunk_head = f"{len(chunk_data):x}\r\n".encode("utf-8")
+                            writer.writelines([chunk_head,chunk_data,b"\r\n"])
+                            bytes_sent = (bytes_sent + len(chunk_head) + 2)
+                        else:
+                            writer.write(chunk_data)
+                        bytes_sent = (bytes_sent + len(chunk_data))
+                        await writer.drain()
+                    if (response_class.content._chunked):
+                        writer.write(b"0\r\n\r\n")
+                        bytes_sent = (bytes_sent + 5)
+                finally:
+                    response_class.content.close()
+            else:
+                writer.writelines([response_data,response_class.content])
+                bytes_sent = (bytes_sent + len(response_class.content))
+            await writer.drain()
+            end_time = time.perf_counter()
+            profiling.finish(request_profile)
+            request_profile = None
+
+            log.debug(debug_name,"Code %d in %dms.",response_class.status_code,round((end_time - start_time) * 1000))
+            log.access(request_class,response_class,(end_time - start_time))
+            phase_durations = ((head_time - start_time),(send_start_time - handler_start_time),(end_time - send_start_time))
+            metrics.record(request_class,response_class.status_code,request_size,bytes_sent,phase_durations)
+            profiling.check_slow(request_class,response_class.status_code,phase_durations)
+            if (websocket_connection):
+                log.debug(debug_name,"Handshake complete.")
+                metrics.websocket_opened()
+                try:
+                    await websocket_connection.run(responding_route.connection_handler)
+                finally:
+                    metrics.websocket_closed()
+            if (config["post_callback"]):
+                config["post_callback"](request_class,response_class)
+            request_class._close_body()
+            if (not socket_keep_alive):
+                return
+            log.debug(debug_name,"Waiting for further requests.")
+
+    except (BrokenPipeError,ConnectionResetError,asyncio.IncompleteReadError):
+        log.error(debug_name,"Connection interrupted.")
+
+    except asyncio.TimeoutError:
+        log.error(debug_name,"Connection timed out.")
+
+    except ssl.SSLError as exception:
+        log.error(debug_name,f"SSL exception: {str(exception)}")
+
+    except asyncio.CancelledError:
+        raise
+
+    except Exception:
+        log.exception(debug_name,"Unexpected exception:")
+
+    finally:
+        profiling.finish(request_profile)
+        metrics.connection_closed()
+        writer.close()
@@ -1,157 +1,649 @@
 import os
-import time
 import struct
 import threading
-import traceback
 import signal
+import collections
+import time
+import zlib
+import socket
+import asyncio
+import inspect
+
+from . import log
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Payloads above this size are received in parts, so memory only grows with data which actually arrived
+PAYLOAD_PART_SIZE = (4 * 1024 * 1024)
+NUMPY_MASK_SIZE = 4096
+DEFLATE_TAIL = b"\x00\x00\xff\xff"
+MAX_FRAME_SIZE = (8 * 1024 * 1024)
 
 def toggle_mask(payload_data,mask_key):
-    toggled_data = bytearray()
-    for byte in range(len(payload_data)):
-        toggled_data.append(payload_data[byte] ^ mask_key[byte % 4])
-    return toggled_data
+    payload_length = len(payload_data)
+    if ((numpy != None) and (payload_length >= NUMPY_MASK_SIZE) and isinstance(payload_data,bytearray)):
+        # XOR the payload in place, four bytes at a time
+        word_count = (payload_length // 4)
+        payload_words = numpy.frombuffer(payload_data,dtype = numpy.uint32,count = word_count)
+        payload_words ^= numpy.frombuffer(mask_key,dtype = numpy.uint32)[0]
+        for byte in range((word_count * 4),payload_length):
+            payload_data[byte] = (payload_data[byte] ^ mask_key[byte % 4])
+        return payload_data
+    # Without numpy the whole payload is XORed as one big integer, which runs word-wide in C
+    mask_data = (bytes(mask_key) * ((payload_length // 4) + 1))[:payload_length]
+    return (int.from_bytes(payload_data,"little") ^ int.from_bytes(mask_data,"little")).to_bytes(payload_length,"little")
+
+def build_frame_header(fin_frame,opcode,payload_length,compressed_frame = False):
+    header_data = bytearray()
+    header_data.append((fin_frame << 7) | (compressed_frame << 6) | opcode)
+    if (payload_length <= 125):
+        header_data.append(payload_length | 0x00)
+    elif (payload_length <= (2 ** 16 - 1)):
+        header_data.append(126 | 0x00)
+        header_data.extend(payload_length.to_bytes(2,"big"))
+    else:
+        header_data.append(127 | 0x00)
+        header_data.extend(payload_length.to_bytes(8,"big"))
+    return header_data
+
+def build_frames(data,compressed_message = False):
+    # Headers and payload slices of all frames of a binary message, compressed messages only mark their first frame
+    message_parts = []
+    data_length = len(data)
+    data_cursor = 0
+    while ((data_cursor < data_length) or (data_cursor == 0)):
+        cursor_limiter = min((data_cursor + MAX_FRAME_SIZE),data_length)
+        if (data_cursor == 0):
+            frame_opcode = 2
+        else:
+            frame_opcode = 0
+        message_parts.append(build_frame_header((cursor_limiter == data_length),frame_opcode,(cursor_limiter - data_cursor),(compressed_message and (data_cursor == 0))))
+        message_parts.append(data[data_cursor:cursor_limiter])
+        data_cursor = cursor_limiter
+        if (data_cursor == data_length):
+            break
+    return message_parts
+
+def build_message(data):
+    # All frames of an uncompressed binary message, ready to be sent to any connection
+    return b"".join(build_frames(data))
+
+class FrameReader:
+    # Frame headers are parsed from one reusable buffer, which is refilled with recv_into, several small frames need only one recv
+    def __init__(self,http_socket,activity_slot,max_message_size,buffer_size = 65536):
+        self._socket = http_socket
+        self._activity_slot = activity_slot
+        self._max_message_size = max_message_size
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        self._end = 0
+
+    def read_frame(self,assembled_size = 0):
+        # assembled_size is the size of the message's earlier frames, the limit is checked before any payload is received
+        self._fill(2)
+        first_byte = self._buffer[self._start]
+        second_byte = self._buffer[(self._start + 1)]
+        self._start = (self._start + 2)
+
+        payload_length = (second_byte & 0x7F)
+        if (payload_length == 126):
+            payload_length = int.from_bytes(self._read(2),"big")
+        elif (payload_length == 127):
+            payload_length = int.from_bytes(self._read(8),"big")
+        if (exceeds_message_size(first_byte,payload_length,assembled_size,self._max_message_size)):
+            raise FrameError("Message exceeds websocket_max_message_mb.")
+
+        mask_key = None
+        if (second_byte & 0x80):
+            mask_key = bytes(self._read(4))
+
+        payload_data = self._read_payload(payload_length)
+        if (mask_key and payload_data):
+            payload_data = toggle_mask(payload_data,mask_key)
+        return ((first_byte & 0x80) != 0),(first_byte & 0x0F),payload_data,((first_byte & 0x40) != 0)
+
+    def _fill(self,size):
+        if ((self._end - self._start) >= size):
+            return
+        if ((self._start + size) > len(self._buffer)):
+            self._view[:(self._end - self._start)] = self._view[self._start:self._end]
+            self._end = (self._end - self._start)
+            self._start = 0
+        while ((self._end - self._start) < size):
+            recv_size = self._socket.recv_into(self._view[self._end:])
+            if (recv_size == 0):
+                raise BrokenPipeError
+            self._end = (self._end + recv_size)
+            self._activity_slot.report_received(recv_size)
+
+    def _read(self,size):
+        self._fill(size)
+        read_data = self._view[self._start:(self._start + size)]
+        self._start = (self._start + size)
+        return read_data
+
+    def _read_payload(self,payload_length):
+        if (payload_length <= PAYLOAD_PART_SIZE):
+            return self._read_part(payload_length)
+        payload_parts = []
+        while (payload_length > 0):
+            payload_parts.append(self._read_part(min(payload_length,PAYLOAD_PART_SIZE)))
+            payload_length = (payload_length - len(payload_parts[-1]))
+        return bytearray().join(payload_parts)
+
+    def _read_part(self,part_length):
+        # Takes what is already buffered, the rest is received straight into the payload
+        part_data = bytearray(part_length)
+        buffered_length = min(part_length,(self._end - self._start))
+        part_data[:buffered_length] = self._view[self._start:(self._start + buffered_length)]
+        self._start = (self._start + buffered_length)
+
+        part_view = memoryview(part_data)
+        part_position = buffered_length
+        while (part_position < part_length):
+            recv_size = self._socket.recv_into(part_view[part_position:])
+            if (recv_size == 0):
+                raise BrokenPipeError
+            part_position = (part_position + recv_size)
+            self._activity_slot.report_received(recv_size)
+        part_view.release()
+        return part_data
+
+class DeflateContext:
+    # permessage-deflate (RFC 7692) state of one connection, the zlib contexts are kept between messages unless "no_context_takeover" was negotiated
+    def __init__(self,config,server_window_bits,server_no_context_takeover):
+        self.level = config["websocket_deflate_level"]
+        self.min_size = config["websocket_deflate_min_size"]
+        self.window_bits = server_window_bits
+        self.no_context_takeover = server_no_context_takeover
+        self._compressor = None
+        self._decompressor = zlib.decompressobj(-15)
+
+    def compress(self,data):
+        if ((self._compressor == None) or self.no_context_takeover):
+            self._compressor = zlib.compressobj(self.level,zlib.DEFLATED,-self.window_bits)
+        compressed_data = (self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH))
+        if (compressed_data.endswith(DEFLATE_TAIL)):
+            compressed_data = compressed_data[:-4]
+        return compressed_data
+
+    def decompress(self,data,max_size):
+        # Inflated data is limited to max_size, a small message must not be able to unpack into gigabytes
+        decompressed_data = self._decompressor.decompress((bytes(data) + DEFLATE_TAIL),(max_size + 1))
+        if (len(decompressed_data) > max_size):
+            raise FrameError("Message exceeds websocket_max_message_mb after decompressing.")
+        return decompressed_data
+
+def negotiate_deflate(extensions_header,config):
+    # Accepts the first permessage-deflate offer we can serve, returns the Sec-WebSocket-Extensions response value and the DeflateContext
+    if ((not config["websocket_deflate"]) or (not extensions_header)):
+        return None,None
+    for extension_offer in extensions_header.split(","):
+        offer_parts = [offer_part.strip() for offer_part in extension_offer.split(";")]
+        if (offer_parts[0].lower() != "permessage-deflate"):
+            continue
+        offer_parameters = {}
+        offer_valid = True
+        for offer_part in offer_parts[1:]:
+            parameter_name,value_separator,parameter_value = offer_part.partition("=")
+            parameter_name = parameter_name.strip().lower()
+            parameter_value = parameter_value.strip().strip("\"")
+            if ((parameter_name in offer_parameters) or (parameter_name not in ("server_no_context_takeover","client_no_context_takeover","server_max_window_bits","client_max_window_bits"))):
+                offer_valid = False
+                break
+            offer_parameters[parameter_name] = parameter_value
+        if (not offer_valid):
+            continue
+
+        server_window_bits = config["websocket_deflate_window_bits"]
+        if ("server_max_window_bits" in offer_parameters):
+            if ((not offer_parameters["server_max_window_bits"].isdigit()) or (not (8 <= int(offer_parameters["server_max_window_bits"]) <= 15))):
+                continue
+            server_window_bits = min(server_window_bits,int(offer_parameters["server_max_window_bits"]))
+        if (server_window_bits < 9):
+            # zlib cannot produce raw deflate streams with an 8 bit window
+            continue
+        if (offer_parameters.get("client_max_window_bits") and ((not offer_parameters["client_max_window_bits"].isdigit()) or (not (8 <= int(offer_parameters["client_max_window_bits"]) <= 15)))):
+            continue
+
+        server_no_context_takeover = (("server_no_context_takeover" in offer_parameters) or config["websocket_deflate_no_context_takeover"])
+        response_parts = ["permessage-deflate"]
+        if (server_no_context_takeover):
+            response_parts.append("server_no_context_takeover")
+        if ("client_no_context_takeover" in offer_parameters):
+            response_parts.append("client_no_context_takeover")
+        if (server_window_bits < 15):
+            response_parts.append(f"server_max_window_bits={str(server_window_bits)}")
+        return "; ".join(response_parts),DeflateContext(config,server_window_bits,server_no_context_takeover)
+    return None,None
+
+def exceeds_message_size(first_byte,payload_length,assembled_size,max_message_size):
+    # Control frames (opcode 8 and above) are not part of the message they may interrupt
+    if (first_byte & 0x08):
+        return (payload_length > max_message_size)
+    return ((assembled_size + payload_length) > max_message_size)
+
+class MessageAssembler:
+    # Joins the data frames of a message, control frames may arrive in between and are handled by the caller
+    def __init__(self,deflate,max_message_size):
+        self._deflate = deflate
+        self._max_message_size = max_message_size
+        self._parts = []
+        self._size = 0
+        self._compressed = False
+
+    @property
+    def size(self):
+        return self._size
+
+    def add_frame(self,frame_fin,frame_opcode,payload_data,frame_compressed):
+        # Returns the message once its last frame arrived, None before that
+        if ((frame_opcode == 0) != (len(self._parts) > 0)):
+            raise FrameError("Continuation frame outside of a message or new message inside of one.")
+        if (frame_compressed and ((frame_opcode == 0) or (not self._deflate))):
+            raise FrameError("RSV1 set without negotiated compression or on a continuation frame.")
+        if (frame_opcode != 0):
+            self._compressed = frame_compressed
+        self._parts.append(payload_data)
+        self._size = (self._size + len(payload_data))
+        if (self._size > self._max_message_size):
+            raise FrameError("Message exceeds websocket_max_message_mb.")
+        if (not frame_fin):
+            return None
+
+        # Single-frame messages are handed over as received, without another copy
+        msg_data = self._parts[0]
+        if (len(self._parts) > 1):
+            msg_data = bytearray().join(self._parts)
+        self._parts = []
+        self._size = 0
+        if (self._compressed):
+            msg_data = self._deflate.decompress(msg_data,self._max_message_size)
+        return msg_data
+
+class MessageQueue:
+    # Bounded queue between the receiving thread and the handler: when it is full the thread stops reading the socket, so the client is slowed down by TCP
+    def __init__(self,max_length):
+        self.max_length = max_length
+        self._messages = collections.deque()
+        self._condition = threading.Condition()
+        self._closed = False
+
+    def put(self,message):
+        with self._condition:
+            while ((len(self._messages) >= self.max_length) and (not self._closed)):
+                self._condition.wait()
+            if (self._closed):
+                return False
+            self._messages.append(message)
+            self._condition.notify_all()
+            return True
+
+    def get(self,timeout = None):
+        # Returns None if no message arrived in time, raises EOFError once the queue is closed and empty
+        with self._condition:
+            if (timeout != None):
+                end_time = (time.monotonic() + timeout)
+            while ((not self._messages) and (not self._closed)):
+                if (timeout == None):
+                    self._condition.wait()
+                else:
+                    time_left = (end_time - time.monotonic())
+                    if (time_left <= 0):
+                        return None
+                    self._condition.wait(time_left)
+            if (not self._messages):
+                raise EOFError
+            message = self._messages.popleft()
+            self._condition.notify_all()
+            return message
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def __len__(self):
+        return len(self._messages)
 
 class WebSocket:
     def __init__(self):
         self.connection_handler = None
 
 class WebSocketConnection:
-    def __init__(self,request_class,http_socket,activity_queue):
+    def __init__(self,request_class,http_socket,activity_slot,config,hub = None):
         self.request = request_class
         self.on_exit = None
         self._socket = http_socket
-        self._activity_queue = activity_queue
+        self._activity_slot = activity_slot
         self._exited = False
-        
-        pipe_tuple = os.pipe()
+        self._send_lock = threading.Lock()
+        self._messages = MessageQueue(config["websocket_queue_length"])
+        self._max_message_size = (config["websocket_max_message_mb"] * 1024 * 1024)
+        self.extensions,self._deflate = negotiate_deflate(request_class.headers.get("Sec-WebSocket-Extensions"),config)
+        self._hub = hub
+        self._hub_socket = None
+
         self._recv_thread = threading.Thread(
             target = self._recv_thread_function,
-            args = [pipe_tuple[1],self._socket]
+            args = [self._socket],
+            daemon = True
         )
         self._recv_thread.start()
-        self.pipe = os.fdopen(pipe_tuple[0],"rb")
 
     def exit(self):
         if (self._exited):
-            return
+            raise WebSocketExit
+        self._exited = True
+        self._messages.close()
+        if (self._hub_socket):
+            try:
+                self._hub_socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._hub_socket.close()
         if (self.on_exit):
             try:
                 self.on_exit()
             except Exception:
-                print(f"[{self.request.address[0]}:{str(self.request.address[1])} - Error] Unexpected exception while executing on_exit:")
-                traceback.print_exc()
+                log.exception(f"{self.request.address[0]}:{str(self.request.address[1])}","Unexpected exception while executing on_exit:")
         try:
             self._send_frame(True,8,b"")
         except Exception:
             pass
-        self._exited = True
-        self._activity_queue.put(time.time())
+        self._activity_slot.report()
         raise WebSocketExit
-    
-    def recv(self):
-        msg_length = int.from_bytes(self.pipe.read(4),"big")
-        thread_status = int.from_bytes(self.pipe.read(1),"big")
-        if (thread_status == 0):
+
+    def recv(self,timeout = None):
+        # Blocks until a message arrives, with a timeout None is returned if none arrived in time (timeout = 0 only polls)
+        try:
+            return self._messages.get(timeout)
+        except EOFError:
             self.exit()
-        msg_data = self.pipe.read(msg_length)
-        return msg_data
-    
+
+    def pending(self):
+        return len(self._messages)
+
+    def subscribe(self,topic):
+        # Messages published to the topic by any process are sent to this connection as they are
+        if (not self._hub):
+            raise RuntimeError("The websocket hub is disabled (see config \"websocket_hub\").")
+        with self._send_lock:
+            if (not self._hub_socket):
+                self._hub_socket = self._hub.connect()
+                threading.Thread(
+                    target = self._hub_thread_function,
+                    args = [self._hub_socket],
+                    daemon = True
+                ).start()
+            self._hub.subscribe(self._hub_socket,topic)
+
+    def unsubscribe(self,topic):
+        if (self._hub_socket):
+            with self._send_lock:
+                self._hub.unsubscribe(self._hub_socket,topic)
+
     def send(self,data):
-        data_length = len(data)
-        data_cursor = 0
-        while (data_cursor < data_length):
-            next_frame = (data_cursor + (8 * 1024 * 1024))
-            cursor_limiter = min(next_frame,data_length)
-            frame_data = data[data_cursor:cursor_limiter]
-            if (data_cursor == 0):
-                frame_opcode = 2
-            else:
-                frame_opcode = 0
-            fin_frame = (cursor_limiter == data_length)
-            self._send_frame(fin_frame,frame_opcode,frame_data)
-            data_cursor = next_frame
-
-    def _recv_thread_function(self,write_pipe,http_socket):
+        # Compressed messages only mark their first frame, continuation frames never carry RSV1.
+        # The lock is held for the whole message, neither a ping reply nor a relayed hub message may land between its frames
+        # (RFC 6455, section 5.4), and the deflate context has to compress messages in the order they are sent
+        with self._send_lock:
+            compressed_message = False
+            if (self._deflate and (len(data) >= self._deflate.min_size)):
+                data = self._deflate.compress(data)
+                compressed_message = True
+            data_length = len(data)
+            data_cursor = 0
+            while (data_cursor < data_length):
+                next_frame = (data_cursor + MAX_FRAME_SIZE)
+                cursor_limiter = min(next_frame,data_length)
+                frame_data = data[data_cursor:cursor_limiter]
+                if (data_cursor == 0):
+                    frame_opcode = 2
+                else:
+                    frame_opcode = 0
+                fin_frame = (cursor_limiter == data_length)
+                self._write_frame(fin_frame,frame_opcode,frame_data,(compressed_message and (data_cursor == 0)))
+                data_cursor = next_frame
+
+    def _recv_thread_function(self,http_socket):
+        debug_name = f"{self.request.address[0]}:{str(self.request.address[1])}"
         try:
+            frame_reader = FrameReader(http_socket,self._activity_slot,self._max_message_size)
+            message_assembler = MessageAssembler(self._deflate,self._max_message_size)
             while True:
-                msg_data = bytearray()
-                fin_frame = False
-                while (not fin_frame):
-                    received_header = http_socket.recv(2)
-                    self._activity_queue.put(time.time())
-
-                    header_data = {}
-
-                    header_raw = [
-                        int.from_bytes(received_header[:1],"big"),
-                        int.from_bytes(received_header[1:],"big")
-                    ]
-                    fin_frame = ((header_raw[0] & 0x80) != 0)
-                    header_data["rsv1"] = ((header_raw[0] & 0x80) != 0)
-                    header_data["rsv2"] = ((header_raw[0] & 0x80) != 0)
-                    header_data["rsv3"] = ((header_raw[0] & 0x80) != 0)
-                    header_data["opcode"] = (header_raw[0] & 0x0F)
-                    header_data["mask"] = ((header_raw[1] & 0x80) != 0)
-                    header_data["mask_key"] = None
-                    header_data["payload_length"] = (header_raw[1] & 0x7F)
-
-                    if (header_data["payload_length"] == 126):
-                        header_data["payload_length"] = int.from_bytes(http_socket.recv(2),"big")
-                    elif (header_data["payload_length"] == 127):
-                        header_data["payload_length"] = int.from_bytes(http_socket.recv(8),"big")
-
-                    if (header_data["mask"]):
-                        header_data["mask_key"] = http_socket.recv(4)
-
-                    payload_data = bytearray()
-                    payload_left = header_data["payload_length"]
-
-                    while (payload_left > 0):
-                        recv_size = min(payload_left,1)
-                        recv_data = http_socket.recv(recv_size)
-                        if (not recv_data):
-                            raise WebSocketExit
-                        payload_data.extend(recv_data)
-                        payload_left = (payload_left - len(recv_data))
-
-                    if (header_data["mask"]):
-                        payload_data = toggle_mask(payload_data,header_data["mask_key"])
-
-                    if ((header_data["opcode"] == 0) or (header_data["opcode"] == 1) or (header_data["opcode"] == 2)):
-                        msg_data.extend(payload_data)
-                    elif (header_data["opcode"] == 8):
-                        raise BrokenPipeError
-                    elif (header_data["opcode"] == 9):
-                        self._send_frame(True,10,b"")
-                
-                os.write(write_pipe,len(msg_data).to_bytes(4,"big"))
-                os.write(write_pipe,(1).to_bytes(1,"big"))
-                os.write(write_pipe,msg_data)
+                frame_fin,frame_opcode,payload_data,frame_compressed = frame_reader.read_frame(message_assembler.size)
+                if (frame_opcode == 8):
+                    raise BrokenPipeError
+                elif (frame_opcode == 9):
+                    self._send_frame(True,10,payload_data)
+                elif (frame_opcode in (0,1,2)):
+                    msg_data = message_assembler.add_frame(frame_fin,frame_opcode,payload_data,frame_compressed)
+                    if ((msg_data != None) and (not self._messages.put(msg_data))):
+                        return
+        except (BrokenPipeError,ConnectionResetError,OSError):
+            if (not self._exited):
+                log.debug(debug_name,"WebSocket closed by the client.")
+        except FrameError as exception:
+            log.warn(debug_name,f"Invalid websocket message, closing connection: {exception.message}")
         except Exception:
-            print("caught an exception inside thread")
-            os.write(write_pipe,(0).to_bytes(4,"big"))
-            os.write(write_pipe,(0).to_bytes(1,"big"))
-            self.exit()
-
-    def _send_frame(self,fin_frame,opcode,payload_data):
-        self._activity_queue.put(time.time())
-        header_data = bytearray()
+            log.exception(debug_name,"Unexpected exception while receiving websocket frames:")
+        finally:
+            self._messages.close()
 
-        header_data.append((fin_frame << 7) | opcode)
+    def _hub_thread_function(self,hub_socket):
+        # Relays published messages, each one holds complete frames so it is sent in one piece between our own frames
+        debug_name = f"{self.request.address[0]}:{str(self.request.address[1])}"
+        try:
+            for message_data in self._hub.iter_messages(hub_socket):
+                self._activity_slot.report(len(message_data))
+                with self._send_lock:
+                    self._socket.sendall(message_data)
+        except OSError:
+            pass
+        if (not self._exited):
+            # The hub drops subscribers which fall too far behind
+            log.warn(debug_name,"Disconnected from the websocket hub, closing connection.")
+            try:
+                self._socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
 
-        payload_length = len(payload_data)
-        if (payload_length <= 125):
-            header_data.append(payload_length | 0x00)
-        elif (payload_length <= (2 ** 16 - 1)):
-            header_data.append(126 | 0x00)
-            header_data.extend(payload_length.to_bytes(2,"big"))
-        else:
-            header_data.append(127 | 0x00)
-            header_data.extend(payload_length.to_bytes(8,"big"))
+    def _send_frame(self,fin_frame,opcode,payload_data,compressed_frame = False):
+        with self._send_lock:
+            self._write_frame(fin_frame,opcode,payload_data,compressed_frame)
 
+    def _write_frame(self,fin_frame,opcode,payload_data,compressed_frame = False):
+        # The caller holds _send_lock
+        self._activity_slot.report(len(payload_data))
+        header_data = build_frame_header(fin_frame,opcode,len(payload_data),compressed_frame)
         self._socket.sendall(bytes(header_data) + bytes(payload_data))
-        return
     
+class AsyncWebSocketConnection:
+    # Connection of the event loop engine: frames are received by a task on the loop, which also pings idle clients
+    def __init__(self,request_class,reader,writer,config,hub = None,received_data = b""):
+        self.request = request_class
+        self.on_exit = None
+        self._reader = reader
+        self._writer = writer
+        self._received_data = received_data
+        self._exited = False
+        self._messages = asyncio.Queue(config["websocket_queue_length"])
+        self._max_message_size = (config["websocket_max_message_mb"] * 1024 * 1024)
+        self._ping_interval = config["websocket_ping_interval"]
+        self._ping_timeout = config["websocket_ping_timeout"]
+        self.extensions,self._deflate = negotiate_deflate(request_class.headers.get("Sec-WebSocket-Extensions"),config)
+        self._hub = hub
+        self._hub_writer = None
+        self._tasks = []
+        self._last_received = 0
+        self._debug_name = f"{request_class.address[0]}:{str(request_class.address[1])}"
+
+    async def run(self,connection_handler):
+        self._last_received = asyncio.get_running_loop().time()
+        self._tasks.append(asyncio.ensure_future(self._recv_loop()))
+        if (self._ping_interval > 0):
+            self._tasks.append(asyncio.ensure_future(self._ping_loop()))
+        try:
+            await connection_handler(self)
+            await self.exit()
+        except WebSocketExit:
+            pass
+        finally:
+            for connection_task in self._tasks:
+                connection_task.cancel()
+
+    async def exit(self):
+        if (self._exited):
+            raise WebSocketExit
+        self._exited = True
+        if (self.on_exit):
+            try:
+                if (inspect.iscoroutinefunction(self.on_exit)):
+                    await self.on_exit()
+                else:
+                    self.on_exit()
+            except Exception:
+                log.exception(self._debug_name,"Unexpected exception while executing on_exit:")
+        try:
+            self._writer.write(build_frame_header(True,8,0))
+            await asyncio.wait_for(self._writer.drain(),self._ping_timeout)
+        except Exception:
+            pass
+        if (self._hub_writer):
+            self._hub_writer.close()
+        raise WebSocketExit
+
+    async def recv(self,timeout = None):
+        # Waits until a message arrives, with a timeout None is returned if none arrived in time (timeout = 0 only polls)
+        if (self._exited):
+            raise WebSocketExit
+        if (timeout == None):
+            msg_data = await self._messages.get()
+        elif (timeout <= 0):
+            try:
+                msg_data = self._messages.get_nowait()
+            except asyncio.QueueEmpty:
+                return None
+        else:
+            try:
+                msg_data = await asyncio.wait_for(self._messages.get(),timeout)
+            except asyncio.TimeoutError:
+                return None
+        if (msg_data == None):
+            await self.exit()
+        return msg_data
+
+    def pending(self):
+        return self._messages.qsize()
+
+    async def send(self,data):
+        compressed_message = False
+        if (self._deflate and (len(data) >= self._deflate.min_size)):
+            data = self._deflate.compress(data)
+            compressed_message = True
+        self._writer.writelines(build_frames(data,compressed_message))
+        await self._writer.drain()
+
+    async def subscribe(self,topic):
+        if (not self._hub):
+            raise RuntimeError("The websocket hub is disabled (see config \"websocket_hub\").")
+        if (not self._hub_writer):
+            hub_reader,self._hub_writer = await asyncio.open_unix_connection(self._hub.socket_path)
+            self._tasks.append(asyncio.ensure_future(self._relay_hub(hub_reader)))
+        await self._hub.subscribe_async(self._hub_writer,topic)
+
+    async def unsubscribe(self,topic):
+        if (self._hub_writer):
+            await self._hub.unsubscribe_async(self._hub_writer,topic)
+
+    async def _read(self,size):
+        # Bytes which arrived together with the handshake are read first
+        if (not self._received_data):
+            return await self._reader.readexactly(size)
+        read_data = self._received_data[:size]
+        self._received_data = self._received_data[size:]
+        if (len(read_data) < size):
+            read_data = (read_data + await self._reader.readexactly(size - len(read_data)))
+        return read_data
+
+    async def _read_frame(self,assembled_size = 0):
+        frame_header = await self._read(2)
+        payload_length = (frame_header[1] & 0x7F)
+        if (payload_length == 126):
+            payload_length = int.from_bytes(await self._read(2),"big")
+        elif (payload_length == 127):
+            payload_length = int.from_bytes(await self._read(8),"big")
+        if (exceeds_message_size(frame_header[0],payload_length,assembled_size,self._max_message_size)):
+            # Checked before reading, the stream reader buffers the whole payload
+            raise FrameError("Message exceeds websocket_max_message_mb.")
+
+        mask_key = None
+        if (frame_header[1] & 0x80):
+            mask_key = await self._read(4)
+        payload_data = await self._read(payload_length)
+        if (mask_key and payload_data):
+            payload_data = toggle_mask(payload_data,mask_key)
+        return ((frame_header[0] & 0x80) != 0),(frame_header[0] & 0x0F),payload_data,((frame_header[0] & 0x40) != 0)
+
+    async def _recv_loop(self):
+        event_loop = asyncio.get_running_loop()
+        try:
+            message_assembler = MessageAssembler(self._deflate,self._max_message_size)
+            while True:
+                frame_fin,frame_opcode,payload_data,frame_compressed = await self._read_frame(message_assembler.size)
+                self._last_received = event_loop.time()
+                if (frame_opcode == 8):
+                    break
+                elif (frame_opcode == 9):
+                    self._writer.writelines([build_frame_header(True,10,len(payload_data)),payload_data])
+                    await self._writer.drain()
+                elif (frame_opcode in (0,1,2)):
+                    msg_data = message_assembler.add_frame(frame_fin,frame_opcode,payload_data,frame_compressed)
+                    if (msg_data != None):
+                        await self._messages.put(msg_data)
+        except (asyncio.IncompleteReadError,ConnectionError,OSError):
+            pass
+        except FrameError as exception:
+            log.warn(self._debug_name,f"Invalid websocket message, closing connection: {exception.message}")
+        except Exception:
+            log.exception(self._debug_name,"Unexpected exception while receiving websocket frames:")
+        if (not self._exited):
+            log.debug(self._debug_name,"WebSocket closed by the client.")
+        await self._messages.put(None)
+
+    async def _ping_loop(self):
+        # Any received frame counts as a sign of life, only silent connections are pinged
+        event_loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self._ping_interval)
+            if ((event_loop.time() - self._last_received) < self._ping_interval):
+                continue
+            ping_time = event_loop.time()
+            self._writer.write(build_frame_header(True,9,0))
+            await asyncio.sleep(self._ping_timeout)
+            if (self._last_received < ping_time):
+                log.warn(self._debug_name,"No pong within websocket_ping_timeout, closing connection.")
+                self._writer.transport.abort()
+                return
+
+    async def _relay_hub(self,hub_reader):
+        async for message_data in self._hub.iter_messages_async(hub_reader):
+            self._writer.write(message_data)
+            await self._writer.drain()
+        if (not self._exited):
+            # The hub drops subscribers which fall too far behind
+            log.warn(self._debug_name,"Disconnected from the websocket hub, closing connection.")
+            self._writer.transport.abort()
+
 class WebSocketExit(Exception):
     pass
+
+class FrameError(Exception):
+    def __init__(self,message):
+        super().__init__(message)
+        self.message = message
@@ -0,0 +1,258 @@
+import os
+import sys
+import socket
+import selectors
+import struct
+import signal
+import shutil
+import tempfile
+import threading
+import collections
+import multiprocessing
+import asyncio
+
+from . import log
+from . import protocol_websocket
+
+# Every process reaches the hub over its Unix socket
+server_hub = None
+
+COMMAND_SUBSCRIBE = 1
+COMMAND_UNSUBSCRIBE = 2
+COMMAND_PUBLISH = 3
+
+# Command, topic length, payload length
+COMMAND_HEADER = struct.Struct("!BHI")
+# Length of a message sent to subscribers
+MESSAGE_HEADER = struct.Struct("!I")
+
+class PubSubHub:
+    # Messages are framed once by the publisher, the hub process hands the same frame bytes to every subscribed connection
+    def __init__(self,config):
+        self.max_queue_length = config["websocket_hub_queue_length"]
+        self.socket_path = None
+        self._directory = None
+        self._process = None
+        self._client_socket = None
+        self._client_pid = None
+        self._client_lock = threading.Lock()
+
+    def start(self):
+        self._directory = tempfile.mkdtemp(prefix = "outside-hub-")
+        self.socket_path = os.path.join(self._directory,"hub.sock")
+        listening_socket = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+        listening_socket.bind(self.socket_path)
+        listening_socket.listen(128)
+        self._process = multiprocessing.Process(
+            target = run_hub,
+            name = "[outside] websocket hub",
+            daemon = False,
+            args = [listening_socket,self.max_queue_length]
+        )
+        self._process.start()
+        listening_socket.close()
+
+    def stop(self):
+        if (self._process):
+            self._process.terminate()
+            self._process.join()
+            self._process = None
+        if (self._directory):
+            shutil.rmtree(self._directory,ignore_errors = True)
+            self._directory = None
+
+    def connect(self):
+        hub_socket = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+        hub_socket.connect(self.socket_path)
+        return hub_socket
+
+    def publish(self,topic,data):
+        frame_data = protocol_websocket.build_message(data)
+        with self._client_lock:
+            # Forked processes must not share the socket of their parent
+            if (self._client_pid != os.getpid()):
+                self._client_socket = self.connect()
+                self._client_pid = os.getpid()
+            send_message(self._client_socket,COMMAND_PUBLISH,topic,frame_data)
+
+    def subscribe(self,hub_socket,topic):
+        send_message(hub_socket,COMMAND_SUBSCRIBE,topic)
+
+    def unsubscribe(self,hub_socket,topic):
+        send_message(hub_socket,COMMAND_UNSUBSCRIBE,topic)
+
+    async def subscribe_async(self,hub_writer,topic):
+        hub_writer.write(build_command(COMMAND_SUBSCRIBE,topic))
+        await hub_writer.drain()
+
+    async def unsubscribe_async(self,hub_writer,topic):
+        hub_writer.write(build_command(COMMAND_UNSUBSCRIBE,topic))
+        await hub_writer.drain()
+
+    async def iter_messages_async(self,hub_reader):
+        while True:
+            try:
+                message_header = await hub_reader.readexactly(MESSAGE_HEADER.size)
+                message_data = await hub_reader.readexactly(MESSAGE_HEADER.unpack(message_header)[0])
+            except (asyncio.IncompleteReadError,ConnectionError):
+                return
+            yield message_data
+
+    def iter_messages(self,hub_socket):
+        # Yields the published messages (complete websocket frames) until the hub closes the socket
+        hub_reader = hub_socket.makefile("rb")
+        while True:
+            message_header = hub_reader.read(MESSAGE_HEADER.size)
+            if (len(message_header) < MESSAGE_HEADER.size):
+                return
+            message_length = MESSAGE_HEADER.unpack(message_header)[0]
+            message_data = hub_reader.read(message_length)
+            if (len(message_data) < message_length):
+                return
+            yield message_data
+
+class HubClient:
+    def __init__(self,client_socket,max_queue_length):
+        self.socket = client_socket
+        self.max_queue_length = max_queue_length
+        self.topics = set()
+        self.received_data = bytearray()
+        self.queue = collections.deque()
+        self.queue_offset = 0
+        self.closed = False
+
+    def flush(self):
+        # Returns False once the socket would block, the rest is sent when it becomes writable
+        while self.queue:
+            try:
+                sent_size = self.socket.send(memoryview(self.queue[0])[self.queue_offset:])
+            except BlockingIOError:
+                return False
+            self.queue_offset = (self.queue_offset + sent_size)
+            if (self.queue_offset >= len(self.queue[0])):
+                self.queue.popleft()
+                self.queue_offset = 0
+        return True
+
+def build_command(command,topic,payload_length = 0):
+    topic_data = topic.encode("utf-8")
+    return (COMMAND_HEADER.pack(command,len(topic_data),payload_length) + topic_data)
+
+def send_message(hub_socket,command,topic,frame_data = None):
+    # Published frames carry their message header already, the hub passes them on without building anything
+    if (frame_data == None):
+        hub_socket.sendall(build_command(command,topic))
+        return
+    hub_socket.sendall(build_command(command,topic,(MESSAGE_HEADER.size + len(frame_data))) + MESSAGE_HEADER.pack(len(frame_data)))
+    hub_socket.sendall(frame_data)
+
+def run_hub(listening_socket,max_queue_length):
+    def terminate(signum = None,stackframe = None):
+        sys.exit(0)
+
+    signal.signal(signal.SIGINT,terminate)
+    signal.signal(signal.SIGTERM,terminate)
+
+    hub_selector = selectors.DefaultSelector()
+    listening_socket.setblocking(False)
+    hub_selector.register(listening_socket,selectors.EVENT_READ,None)
+    topics = {}
+
+    def close_client(hub_client):
+        if (hub_client.closed):
+            return
+        hub_client.closed = True
+        for topic in hub_client.topics:
+            topics[topic].discard(hub_client)
+            if (not topics[topic]):
+                del topics[topic]
+        hub_selector.unregister(hub_client.socket)
+        hub_client.socket.close()
+
+    def publish(topic,message_data):
+        for hub_client in list(topics.get(topic,())):
+            if (len(hub_client.queue) >= hub_client.max_queue_length):
+                # Slow consumers are dropped instead of letting their queue grow without limit
+                log.warn("HUB/WEBSOCKET","Subscriber queue is full, disconnecting it.")
+                close_client(hub_client)
+                continue
+            hub_client.queue.append(message_data)
+            if (len(hub_client.queue) > 1):
+                continue
+            try:
+                if (not hub_client.flush()):
+                    hub_selector.modify(hub_client.socket,(selectors.EVENT_READ | selectors.EVENT_WRITE),hub_client)
+            except OSError:
+                close_client(hub_client)
+
+    def handle_commands(hub_client):
+        received_data = hub_client.received_data
+        read_position = 0
+        while ((len(received_data) - read_position) >= COMMAND_HEADER.size):
+            command,topic_length,payload_length = COMMAND_HEADER.unpack_from(received_data,read_position)
+            message_end = (read_position + COMMAND_HEADER.size + topic_length + payload_length)
+            if (len(received_data) < message_end):
+                break
+            topic_start = (read_position + COMMAND_HEADER.size)
+            topic = bytes(received_data[topic_start:(topic_start + topic_length)])
+            if (command == COMMAND_SUBSCRIBE):
+                hub_client.topics.add(topic)
+                topics.setdefault(topic,set()).add(hub_client)
+            elif (command == COMMAND_UNSUBSCRIBE):
+                hub_client.topics.discard(topic)
+                if (topic in topics):
+                    topics[topic].discard(hub_client)
+                    if (not topics[topic]):
+                        del topics[topic]
+            elif (command == COMMAND_PUBLISH):
+                # The message is copied out once and shared by the queues of all subscribers
+                with memoryview(received_data) as received_view:
+                    message_data = bytes(received_view[(topic_start + topic_length):message_end])
+                publish(topic,message_data)
+            read_position = message_end
+        del received_data[:read_position]
+
+    while True:
+        for selector_key,selector_events in hub_selector.select():
+            if (selector_key.data == None):
+                try:
+                    client_socket,client_address = listening_socket.accept()
+                except BlockingIOError:
+                    continue
+                client_socket.setblocking(False)
+                hub_selector.register(client_socket,selectors.EVENT_READ,HubClient(client_socket,max_queue_length))
+                continue
+
+            hub_client = selector_key.data
+            if (hub_client.closed):
+                continue
+            if (selector_events & selectors.EVENT_WRITE):
+                try:
+                    if (hub_client.flush()):
+                        hub_selector.modify(hub_client.socket,selectors.EVENT_READ,hub_client)
+                except OSError:
+                    close_client(hub_client)
+                    continue
+            if (selector_events & selectors.EVENT_READ):
+                try:
+                    received_data = hub_client.socket.recv(262144)
+                except BlockingIOError:
+                    continue
+                except OSError:
+                    received_data = b""
+                if (not received_data):
+                    close_client(hub_client)
+                    continue
+                hub_client.received_data.extend(received_data)
+                handle_commands(hub_client)
+
+def get_hub(config):
+    global server_hub
+    if ((server_hub == None) and config["websocket_hub"]):
+        server_hub = PubSubHub(config)
+        server_hub.start()
+    return server_hub
+
+def stop_hub():
+    if (server_hub):
+        server_hub.stop()
@@ -0,0 +1,262 @@
+import tempfile
+
+CHUNK_SIZE = 0
+CHUNK_DATA = 1
+CHUNK_DATA_END = 2
+CHUNK_TRAILER = 3
+
+class RequestParser:
+    def __init__(self,config):
+        self.max_head_size = (config["max_head_size_kb"] * 1024)
+        self.max_header_count = config["max_header_count"]
+        self.max_url_length = config["max_url_length"]
+        self._buffer = bytearray()
+        self._search_start = 0
+        self._line_checked = False
+        self._head_end = None
+        self._body_start = None
+        self._chunk_state = CHUNK_SIZE
+        self._chunk_left = 0
+
+    def feed(self,data):
+        self._buffer.extend(data)
+
+    def find_head(self):
+        if (self._head_end != None):
+            return True
+
+        if ((self._search_start == 0) and self._buffer and (self._buffer[0] in (13,10))):
+            # Ignore empty lines in front of the request line (e.g. after a previous body)
+            del self._buffer[:(len(self._buffer) - len(self._buffer.lstrip(b"\r\n")))]
+
+        if (not self._line_checked):
+            line_end = self._buffer.find(b"\n")
+            if (((line_end == -1) and (len(self._buffer) > self.max_url_length)) or (line_end > self.max_url_length)):
+                raise RequestHeadError(414,"Request line is too long.")
+            self._line_checked = (line_end != -1)
+
+        head_end = self._buffer.find(b"\n\r\n",self._search_start)
+        body_start = (head_end + 3)
+        short_end = self._buffer.find(b"\n\n",self._search_start)
+        if ((short_end != -1) and ((head_end == -1) or (short_end < head_end))):
+            head_end = short_end
+            body_start = (short_end + 2)
+
+        if (head_end == -1):
+            if (len(self._buffer) > self.max_head_size):
+                raise RequestHeadError(431,"Request head is too large.")
+            self._search_start = max((len(self._buffer) - 2),0)
+            return False
+        if (head_end > self.max_head_size):
+            raise RequestHeadError(431,"Request head is too large.")
+
+        self._head_end = head_end
+        self._body_start = body_start
+        return True
+
+    def parse_head(self,request_class):
+        # Returns the size of the head including its terminating empty line
+        head_data = self._buffer[:self._head_end]
+        head_size = self._body_start
+        del self._buffer[:self._body_start]
+        self._search_start = 0
+        self._line_checked = False
+        self._head_end = None
+        self._body_start = None
+
+        try:
+            head_lines = head_data.decode("utf-8").split("\n")
+        except UnicodeDecodeError:
+            raise RequestHeadError(400,"Request head is not valid UTF-8.")
+        if ((len(head_lines) - 1) > self.max_header_count):
+            raise RequestHeadError(431,"Too many header fields.")
+
+        request_line = head_lines[0].split(" ")
+        if (len(request_line) != 3):
+            raise RequestHeadError(400,"Malformed request line.")
+        request_class.method = request_line[0].upper()
+        request_class.url,query_separator,request_class._query = request_line[1].partition("?")
+        request_class.version = request_line[2].rstrip("\r")
+
+        # Names are stored lowercased (see utility.HeaderDict), whitespace around them or folded lines would hide framing headers
+        header_fields = {}
+        for header_line in head_lines[1:]:
+            header_name,header_separator,header_value = header_line.partition(":")
+            if ((not header_separator) or (not header_name) or (header_name != header_name.strip())):
+                raise RequestHeadError(400,"Malformed header field.")
+            header_name = header_name.lower()
+            header_value = header_value.strip()
+            if (header_name in header_fields):
+                # Repeated fields are combined into one list (a repeated Content-Length then fails its validation)
+                header_value = (header_fields[header_name] + ("; " if (header_name == "cookie") else ", ") + header_value)
+            header_fields[header_name] = header_value
+        dict.update(request_class.headers,header_fields)
+
+        request_class._extract_cookies()
+        return head_size
+
+    def take(self,max_size):
+        taken_data = bytes(self._buffer[:max_size])
+        del self._buffer[:max_size]
+        return taken_data
+
+    def buffered(self):
+        return len(self._buffer)
+
+    def take_chunk(self):
+        # Decodes "Transfer-Encoding: chunked" from the buffer: returns body bytes, b"" once the body and its trailers are complete,
+        # or None if more data has to be fed
+        while True:
+            if (self._chunk_state == CHUNK_DATA):
+                if (not self._buffer):
+                    return None
+                chunk_data = self.take(self._chunk_left)
+                self._chunk_left = (self._chunk_left - len(chunk_data))
+                if (self._chunk_left == 0):
+                    self._chunk_state = CHUNK_DATA_END
+                return chunk_data
+
+            if (self._chunk_state == CHUNK_DATA_END):
+                if (self._buffer.startswith(b"\r\n")):
+                    del self._buffer[:2]
+                elif (self._buffer.startswith(b"\n")):
+                    del self._buffer[:1]
+                elif (len(self._buffer) < 2):
+                    return None
+                else:
+                    raise RequestBodyError(400,"Chunk data is not followed by CRLF.")
+                self._chunk_state = CHUNK_SIZE
+                continue
+
+            line_end = self._buffer.find(b"\n")
+            if (line_end == -1):
+                if (len(self._buffer) > self.max_head_size):
+                    raise RequestBodyError(400,"Chunk line is too long.")
+                return None
+            chunk_line = bytes(self._buffer[:line_end]).rstrip(b"\r")
+            del self._buffer[:(line_end + 1)]
+
+            if (self._chunk_state == CHUNK_TRAILER):
+                if (not chunk_line):
+                    self._chunk_state = CHUNK_SIZE
+                    return b""
+                continue
+
+            chunk_size = chunk_line.partition(b";")[0].strip()
+            if ((not chunk_size) or (len(chunk_size) > 16) or chunk_size.strip(b"0123456789abcdefABCDEF")):
+                raise RequestBodyError(400,"Invalid chunk size.")
+            self._chunk_left = int(chunk_size,16)
+            if (self._chunk_left == 0):
+                self._chunk_state = CHUNK_TRAILER
+            else:
+                self._chunk_state = CHUNK_DATA
+
+class BodyReceiver:
+    # Receives the body announced by "Content-Length" or "Transfer-Encoding: chunked" (see check_request_body),
+    # both engines read from their sockets and hand the data over with receive() or feed()
+    def __init__(self,head_parser,request_class,config):
+        self.head_parser = head_parser
+        self.chunked = bool(request_class.headers.get("Transfer-Encoding"))
+        self.spool_size = (config["body_spool_mb"] * 1024 * 1024)
+        self.max_body_size = (config["max_body_size_mb"] * 1024 * 1024)
+        self.buffer_size = (config["body_buffer_kb"] * 1024)
+        self.body_size = 0
+        self._body_left = (0 if self.chunked else request_class.headers["Content-Length"])
+        self._body_file = None
+        self._body_buffer = None
+        self._body_view = None
+        self._recv_view = None
+        self._complete = False
+
+        if (self.chunked or (self._body_left > self.spool_size)):
+            self._body_file = tempfile.SpooledTemporaryFile(max_size = self.spool_size)
+        else:
+            # Bodies that stay in memory are read straight into their final buffer
+            self._body_buffer = bytearray(self._body_left)
+            self._body_view = memoryview(self._body_buffer)
+        if (self.chunked):
+            self._take_chunks()
+        else:
+            self.feed(head_parser.take(self._body_left))
+
+    def receive(self,recv_into):
+        # Reads the rest of the body with recv_into(buffer), which returns the number of bytes it wrote into the buffer
+        while (not self._complete):
+            if (self._body_view != None):
+                self._set_received(recv_into(self._body_view[self.body_size:]))
+                continue
+            if (self._recv_view == None):
+                self._recv_view = memoryview(bytearray(self.buffer_size))
+            recv_size = recv_into(self._recv_view[:self.wanted_size()])
+            self.feed(self._recv_view[:recv_size])
+
+    def wanted_size(self):
+        # Number of bytes to read next, 0 once the body is complete
+        if (self._complete):
+            return 0
+        if (self.chunked):
+            return self.buffer_size
+        return min(self._body_left,self.buffer_size)
+
+    def writes_spool(self,data_size):
+        # Whether feeding data_size bytes can write to the spool file on disk
+        return ((self._body_file != None) and ((self.body_size + data_size) > self.spool_size))
+
+    def feed(self,data):
+        if (self.chunked):
+            self.head_parser.feed(data)
+            self._take_chunks()
+        elif (self._body_view != None):
+            self._body_view[self.body_size:(self.body_size + len(data))] = data
+            self._set_received(len(data))
+        else:
+            self._body_file.write(data)
+            self._set_received(len(data))
+
+    def finish(self,request_class):
+        # Hands the body to the request, returns its size
+        if (self._body_view != None):
+            self._body_view.release()
+            request_class.content = bytes(self._body_buffer)
+        elif (self.body_size > self.spool_size):
+            request_class._set_body_file(self._body_file)
+        else:
+            self._body_file.seek(0)
+            request_class.content = self._body_file.read()
+            self._body_file.close()
+        return self.body_size
+
+    def close(self):
+        if (self._body_file != None):
+            self._body_file.close()
+
+    def _set_received(self,data_size):
+        self.body_size = (self.body_size + data_size)
+        self._body_left = (self._body_left - data_size)
+        self._complete = (self._body_left == 0)
+
+    def _take_chunks(self):
+        try:
+            while True:
+                chunk_data = self.head_parser.take_chunk()
+                if (chunk_data == None):
+                    return
+                if (not chunk_data):
+                    self._complete = True
+                    return
+                self.body_size = (self.body_size + len(chunk_data))
+                if (self.body_size > self.max_body_size):
+                    raise RequestBodyError(413,"Request body is too large.")
+                self._body_file.write(chunk_data)
+        except RequestBodyError:
+            self.close()
+            raise
+
+class RequestHeadError(Exception):
+    def __init__(self,status_code,message):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+
+class RequestBodyError(RequestHeadError):
+    pass
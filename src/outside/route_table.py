@@ -0,0 +1,102 @@
+import re
+import urllib.parse
+
+class RouteNode:
+    def __init__(self,label):
+        self.label = label
+        self.children = {}
+        self.param_children = {}
+        self.exact_entry = None
+        self.prefix_entry = None
+
+class RouteTable:
+    def __init__(self,routes):
+        self._root = RouteNode("")
+        for route,route_data in routes.items():
+            self.add_route(route,route_data["handlers"],route_data["exact"],route_data["compression_level"])
+
+    def add_route(self,route,handlers,exact = False,compression_level = None):
+        current_node = self._root
+        for route_part in re.split(r"(\{[^/{}]+\})",route):
+            if (not route_part):
+                continue
+            if ((route_part[0] == "{") and (route_part[-1] == "}")):
+                param_name = route_part[1:-1]
+                if (param_name not in current_node.param_children):
+                    current_node.param_children[param_name] = RouteNode(route_part)
+                current_node = current_node.param_children[param_name]
+            else:
+                current_node = self._insert_static(current_node,route_part)
+
+        route_entry = {
+            "route": route,
+            "handlers": handlers,
+            "compression_level": compression_level
+        }
+        if (exact):
+            current_node.exact_entry = route_entry
+        else:
+            current_node.prefix_entry = route_entry
+
+    def find(self,url):
+        found_match = self._search(self._root,url,0,{})
+        if (not found_match):
+            return None,{}
+        return found_match[2],found_match[3]
+
+    def _insert_static(self,parent_node,route_part):
+        while (route_part):
+            child_node = parent_node.children.get(route_part[0])
+            if (not child_node):
+                child_node = RouteNode(route_part)
+                parent_node.children[route_part[0]] = child_node
+                return child_node
+
+            common_length = 0
+            max_length = min(len(child_node.label),len(route_part))
+            while ((common_length < max_length) and (child_node.label[common_length] == route_part[common_length])):
+                common_length = (common_length + 1)
+
+            if (common_length < len(child_node.label)):
+                split_node = RouteNode(child_node.label[:common_length])
+                child_node.label = child_node.label[common_length:]
+                split_node.children[child_node.label[0]] = child_node
+                parent_node.children[route_part[0]] = split_node
+                child_node = split_node
+
+            parent_node = child_node
+            route_part = route_part[common_length:]
+        return parent_node
+
+    def _search(self,current_node,url,position,route_params):
+        # Matches are ranked by (exact, matched length), so the longest prefix route wins unless an exact route matches
+        best_match = None
+        if (current_node.prefix_entry):
+            best_match = (False,position,current_node.prefix_entry,route_params)
+        if (position == len(url)):
+            if (current_node.exact_entry):
+                return (True,position,current_node.exact_entry,route_params)
+            return best_match
+
+        child_node = current_node.children.get(url[position])
+        if (child_node and url.startswith(child_node.label,position)):
+            child_match = self._search(child_node,url,(position + len(child_node.label)),route_params)
+            if (child_match and ((not best_match) or (child_match[:2] > best_match[:2]))):
+                best_match = child_match
+                if (best_match[0]):
+                    return best_match
+
+        if (current_node.param_children):
+            param_end = url.find("/",position)
+            if (param_end == -1):
+                param_end = len(url)
+            if (param_end > position):
+                param_value = urllib.parse.unquote(url[position:param_end])
+                for param_name,param_node in current_node.param_children.items():
+                    param_match = self._search(param_node,url,param_end,{**route_params,param_name: param_value})
+                    if (param_match and ((not best_match) or (param_match[:2] > best_match[:2]))):
+                        best_match = param_match
+                        if (best_match[0]):
+                            return best_match
+
+        return best_match
@@ -0,0 +1,35 @@
+import ssl
+
+from . import log
+
+# One context for all workers, so they also share its session ticket keys
+server_context = None
+
+def create_context(config):
+    ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ssl_context.load_cert_chain(config["ssl_certfile"],config["ssl_keyfile"])
+    if (config["ssl_session_tickets"] > 0):
+        ssl_context.num_tickets = config["ssl_session_tickets"]
+    else:
+        ssl_context.options |= ssl.OP_NO_TICKET
+    if (config["ssl_alpn_protocols"]):
+        ssl_context.set_alpn_protocols(config["ssl_alpn_protocols"])
+    return ssl_context
+
+def get_context(config):
+    global server_context
+    if (server_context == None):
+        server_context = create_context(config)
+    return server_context
+
+def reload_certificate(config):
+    if (server_context == None):
+        return
+    try:
+        # Validate on a spare context first, a failed load_cert_chain can leave the key and certificate mismatched
+        ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER).load_cert_chain(config["ssl_certfile"],config["ssl_keyfile"])
+        server_context.load_cert_chain(config["ssl_certfile"],config["ssl_keyfile"])
+    except (OSError,ssl.SSLError) as exception:
+        log.error("TLS",f"Certificate reload failed, keeping the current certificate: {str(exception)}")
+        return
+    log.info("TLS","Certificate reloaded.")
@@ -1,5 +1,39 @@
 def get_insensitive_header(headers,header_name):
+    if (isinstance(headers,HeaderDict)):
+        return headers.get(header_name)
     for current_name in headers.keys():
         if (current_name.lower() == header_name.lower()):
-            return headers[header_name]
+            return headers[current_name]
     return None
+
+class HeaderDict(dict):
+    # Request headers, field names are stored lowercased so every lookup is case-insensitive (RFC 9110, section 5.1)
+    def __init__(self,headers = {}):
+        super().__init__()
+        if (headers):
+            self.update(headers)
+
+    def __getitem__(self,header_name):
+        return super().__getitem__(header_name.lower())
+
+    def __setitem__(self,header_name,header_value):
+        super().__setitem__(header_name.lower(),header_value)
+
+    def __delitem__(self,header_name):
+        super().__delitem__(header_name.lower())
+
+    def __contains__(self,header_name):
+        return super().__contains__(header_name.lower())
+
+    def get(self,header_name,default = None):
+        return super().get(header_name.lower(),default)
+
+    def pop(self,header_name,*default):
+        return super().pop(header_name.lower(),*default)
+
+    def setdefault(self,header_name,default = None):
+        return super().setdefault(header_name.lower(),default)
+
+    def update(self,headers = {},**extra_headers):
+        for header_name,header_value in dict(headers,**extra_headers).items():
+            self[header_name] = header_value
@@ -0,0 +1,22 @@
+import unittest
+
+import outside
+import outside.activity_slots
+
+class ActivitySlotTest(unittest.TestCase):
+    def test_describe_reports_the_worker_state(self):
+        activity_slot = outside.activity_slots.create_slots(1)[0]
+        activity_slot.reset(outside.activity_slots.SLOT_RECEIVING)
+        activity_slot.report_received(300)
+        activity_slot.set_state(outside.activity_slots.SLOT_SENDING,"/download")
+        activity_slot.requests = 2
+        activity_slot.report(4096)
+        self.assertTrue(activity_slot.describe().startswith("sending /download, 2 requests, 300B received, 4096B sent, idle for "))
+
+    def test_describe_without_route(self):
+        activity_slot = outside.activity_slots.create_slots(1)[0]
+        activity_slot.reset()
+        self.assertTrue(activity_slot.describe().startswith("idle -, 0 requests"))
+
+if (__name__ == "__main__"):
+    unittest.main()
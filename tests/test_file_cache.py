@@ -0,0 +1,33 @@
+import types
+import unittest
+
+import outside
+import outside.file_cache
+
+class SharedFileCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.file_cache = outside.file_cache.SharedFileCache((64 * 1024),1024)
+        self.stat_result = types.SimpleNamespace(st_mtime_ns = 1,st_size = 5)
+
+    def test_store_and_lookup(self):
+        self.file_cache.store("/a.txt",self.stat_result,b"hello")
+        self.assertEqual(self.file_cache.lookup("/a.txt",self.stat_result),b"hello")
+        self.assertIsNone(self.file_cache.lookup("/b.txt",self.stat_result))
+        self.assertIsNone(self.file_cache.lookup("/a.txt",types.SimpleNamespace(st_mtime_ns = 2,st_size = 5)))
+
+    def test_entry_being_written_is_a_miss(self):
+        self.file_cache.store("/a.txt",self.stat_result,b"hello")
+        entry_index = self.file_cache._find_entry(b"/a.txt")
+        self.file_cache._entries[entry_index].generation += 1
+        self.assertIsNone(self.file_cache.lookup("/a.txt",self.stat_result))
+
+    def test_held_store_lock_blocks_nothing(self):
+        # Stands in for a worker killed while storing
+        self.file_cache.store("/a.txt",self.stat_result,b"hello")
+        self.file_cache._store_lock.acquire()
+        self.file_cache.store("/b.txt",self.stat_result,b"world")
+        self.assertEqual(self.file_cache.lookup("/a.txt",self.stat_result),b"hello")
+        self.assertIsNone(self.file_cache.lookup("/b.txt",self.stat_result))
+
+if (__name__ == "__main__"):
+    unittest.main()
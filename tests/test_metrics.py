@@ -0,0 +1,37 @@
+import unittest
+
+import outside
+import outside.metrics
+
+class MetricsStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.metrics_store = outside.metrics.MetricsStore(["/a"],4,3)
+
+    def test_slots_are_added_up(self):
+        self.metrics_store.record(0,"/a",200,10,20,(0.001,0.002,0.003))
+        self.metrics_store.record(2,"/a",200,1,2,(0.001,0.002,0.003))
+        self.metrics_store.record(1,"/missing",404,5,5,(0.001,0.001,0.001))
+        metrics_snapshot = self.metrics_store.snapshot()
+        self.assertEqual(metrics_snapshot["routes"]["/a"]["status_counts"],{200: 2})
+        self.assertEqual(metrics_snapshot["routes"]["/a"]["bytes_sent"],22)
+        self.assertEqual(sum(metrics_snapshot["routes"]["/a"]["latency_counts"]["send"]),2)
+        self.assertEqual(metrics_snapshot["routes"][outside.metrics.UNMATCHED_ROUTE]["status_counts"],{404: 1})
+
+    def test_reaped_worker_gauges_are_cleared(self):
+        self.metrics_store.add_gauge(0,outside.metrics.GAUGE_CONNECTIONS,1)
+        self.metrics_store.add_gauge(1,outside.metrics.GAUGE_CONNECTIONS,1)
+        self.metrics_store.add_gauge(1,outside.metrics.GAUGE_WEBSOCKETS,1)
+        self.metrics_store.record(1,"/a",200,1,1,(0,0,0))
+        self.metrics_store.reset_worker(1)
+        metrics_snapshot = self.metrics_store.snapshot()
+        self.assertEqual((metrics_snapshot["connections"],metrics_snapshot["websockets"]),(1,0))
+        self.assertEqual(metrics_snapshot["routes"]["/a"]["status_counts"],{200: 1})
+
+    def test_saturation_counts_all_slots(self):
+        for worker_index in (0,1,2,2):
+            self.metrics_store.add_gauge(worker_index,outside.metrics.GAUGE_CONNECTIONS,1)
+        self.assertEqual(self.metrics_store.snapshot()["saturated"],1)
+        self.assertIn("outside_connections_active 4",self.metrics_store.render())
+
+if (__name__ == "__main__"):
+    unittest.main()
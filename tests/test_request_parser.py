@@ -0,0 +1,114 @@
+import tempfile
+import unittest
+
+import outside
+import outside.protocol_http
+import outside.request_parser
+
+def parse_request(request_data):
+    config = outside.OutsideHTTP(("127.0.0.1",0)).config
+    head_parser = outside.request_parser.RequestParser(config)
+    head_parser.feed(request_data)
+    request_class = outside.protocol_http.Request("",{},b"","","",("127.0.0.1",0))
+    if (not head_parser.find_head()):
+        raise AssertionError("Request head is incomplete.")
+    head_parser.parse_head(request_class)
+    return head_parser,request_class,config
+
+class HeaderCaseTest(unittest.TestCase):
+    def test_lookup_ignores_case(self):
+        head_parser,request_class,config = parse_request(b"GET / HTTP/1.1\r\nHost: a\r\naccept-encoding: gzip\r\nX-Custom: 1\r\n\r\n")
+        self.assertEqual(request_class.headers["Accept-Encoding"],"gzip")
+        self.assertEqual(request_class.headers.get("x-custom"),"1")
+        self.assertIn("HOST",request_class.headers)
+        self.assertEqual(outside.utility.get_insensitive_header(request_class.headers,"X-CUSTOM"),"1")
+
+    def test_lowercase_content_length_frames_body(self):
+        # The body holds a request line, it must be read as body and not served as the next pipelined request
+        body_data = b"GET /u/7 HTTP/1.1\r\nHost: a\r\n\r\n"
+        head_parser,request_class,config = parse_request(b"POST /a HTTP/1.1\r\nhost: a\r\ncontent-length: " + str(len(body_data)).encode("utf-8") + b"\r\n\r\n" + body_data)
+        self.assertIsNone(outside.protocol_http.check_request_body(request_class,config))
+        self.assertEqual(request_class.headers["Content-Length"],len(body_data))
+        self.assertEqual(head_parser.take(request_class.headers["Content-Length"]),body_data)
+        self.assertEqual(head_parser.buffered(),0)
+        self.assertFalse(head_parser.find_head())
+
+    def test_lowercase_transfer_encoding_frames_body(self):
+        head_parser,request_class,config = parse_request(b"POST /a HTTP/1.1\r\nhost: a\r\ntransfer-encoding: chunked\r\n\r\n5\r\nhello\r\n0\r\n\r\nGET /b HTTP/1.1\r\n\r\n")
+        self.assertIsNone(outside.protocol_http.check_request_body(request_class,config))
+        self.assertEqual(head_parser.take_chunk(),b"hello")
+        self.assertEqual(head_parser.take_chunk(),b"")
+        self.assertTrue(head_parser.find_head())
+
+    def test_repeated_content_length_is_rejected(self):
+        head_parser,request_class,config = parse_request(b"POST /a HTTP/1.1\r\nContent-Length: 5\r\ncontent-length: 30\r\n\r\nhello")
+        self.assertEqual(outside.protocol_http.check_request_body(request_class,config)[0],400)
+
+    def test_whitespace_before_colon_is_rejected(self):
+        with self.assertRaises(outside.request_parser.RequestHeadError) as raised:
+            parse_request(b"POST /a HTTP/1.1\r\nContent-Length : 5\r\n\r\nhello")
+        self.assertEqual(raised.exception.status_code,400)
+
+    def test_websocket_handshake_tokens(self):
+        head_parser,request_class,config = parse_request(b"GET /ws HTTP/1.1\r\nconnection: keep-alive, upgrade\r\nupgrade: WebSocket\r\nsec-websocket-key: a2V5\r\n\r\n")
+        self.assertTrue(outside.protocol_http.is_websocket_handshake(request_class))
+
+class BodyCheckTest(unittest.TestCase):
+    def test_lowercase_framing_conflict_is_rejected(self):
+        head_parser,request_class,config = parse_request(b"POST /a HTTP/1.1\r\ncontent-length: 5\r\ntransfer-encoding: chunked\r\n\r\n")
+        self.assertEqual(outside.protocol_http.check_request_body(request_class,config)[0],400)
+
+    def test_non_ascii_content_length_is_rejected(self):
+        head_parser,request_class,config = parse_request("POST /a HTTP/1.1\r\nContent-Length: ５\r\n\r\n".encode("utf-8"))
+        self.assertEqual(outside.protocol_http.check_request_body(request_class,config)[0],400)
+
+    def test_lowercase_expect_continue(self):
+        head_parser,request_class,config = parse_request(b"POST /a HTTP/1.1\r\nexpect: 100-Continue\r\ncontent-length: 5\r\n\r\n")
+        self.assertTrue(outside.protocol_http.expects_continue(request_class))
+        self.assertIsNone(outside.protocol_http.check_request_body(request_class,config))
+
+    def test_unsupported_expectation(self):
+        head_parser,request_class,config = parse_request(b"POST /a HTTP/1.1\r\nexpect: something\r\ncontent-length: 5\r\n\r\n")
+        self.assertEqual(outside.protocol_http.check_request_body(request_class,config)[0],417)
+
+class BodyReceiverTest(unittest.TestCase):
+    def receive_body(self,request_data,read_data,**config_values):
+        head_parser,request_class,config = parse_request(request_data)
+        config.update(config_values)
+        self.assertIsNone(outside.protocol_http.check_request_body(request_class,config))
+        read_data = bytearray(read_data)
+        def recv_into(recv_buffer):
+            recv_size = min(len(recv_buffer),len(read_data),3)
+            recv_buffer[:recv_size] = read_data[:recv_size]
+            del read_data[:recv_size]
+            return recv_size
+        body_receiver = outside.request_parser.BodyReceiver(head_parser,request_class,config)
+        body_receiver.receive(recv_into)
+        self.assertEqual(body_receiver.finish(request_class),len(request_class.content))
+        return head_parser,request_class
+
+    def test_content_length_in_memory(self):
+        head_parser,request_class = self.receive_body(b"POST /a HTTP/1.1\r\nContent-Length: 11\r\n\r\nhello",b" worldGET")
+        self.assertEqual(request_class.content,b"hello world")
+        self.assertEqual(head_parser.buffered(),0)
+
+    def test_content_length_spooled(self):
+        body_data = (b"x" * (1024 * 1024 + 5))
+        head_parser,request_class = self.receive_body(b"POST /a HTTP/1.1\r\nContent-Length: " + str(len(body_data)).encode("utf-8") + b"\r\n\r\nxx",body_data[2:],body_spool_mb = 1)
+        self.assertIsInstance(request_class._body_file,tempfile.SpooledTemporaryFile)
+        self.assertEqual(request_class.content,body_data)
+
+    def test_chunked(self):
+        head_parser,request_class = self.receive_body(b"POST /a HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n5\r\nhel",b"lo\r\n6;x=y\r\n world\r\n0\r\nTrailer: 1\r\n\r\n")
+        self.assertEqual(request_class.content,b"hello world")
+
+    def test_chunked_too_large(self):
+        head_parser,request_class,config = parse_request(b"POST /a HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n")
+        config["max_body_size_mb"] = 1
+        body_receiver = outside.request_parser.BodyReceiver(head_parser,request_class,config)
+        with self.assertRaises(outside.request_parser.RequestBodyError) as raised:
+            body_receiver.feed(b"100001\r\n" + (b"x" * 0x100001) + b"\r\n")
+        self.assertEqual(raised.exception.status_code,413)
+
+if (__name__ == "__main__"):
+    unittest.main()
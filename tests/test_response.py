@@ -0,0 +1,35 @@
+import unittest
+
+import outside
+import outside.protocol_http
+
+def run_route(route_function):
+    server = outside.OutsideHTTP(("127.0.0.1",0))
+    server.config["log_level"] = "NONE"
+    outside.log.configure(server.config)
+    request_class = outside.protocol_http.Request("GET",{},b"","HTTP/1.1","/",("127.0.0.1",0))
+    return outside.protocol_http.ScheduledResponse(request_class,route_function,server._error_routes).run()
+
+class ResponseContentTest(unittest.TestCase):
+    def test_sequences_are_sent_as_json(self):
+        for content,json_data in (([1,2,3],b"[1, 2, 3]"),((1,2),b"[1, 2]"),({3},b"[3]")):
+            response_class = run_route(lambda request: outside.protocol_http.Response(200,{},content))
+            self.assertEqual(response_class.headers["Content-Type"],"application/json")
+            self.assertEqual(response_class.content,json_data)
+
+    def test_generator_is_streamed(self):
+        def generate_parts():
+            yield b"a"
+            yield "b"
+        response_class = run_route(lambda request: outside.protocol_http.Response(200,{},generate_parts()))
+        self.assertIsInstance(response_class.content,outside.protocol_http.ResponseStream)
+        self.assertEqual(b"".join(response_class.content),b"ab")
+
+    def test_stream_of_wrong_type_is_answered_with_500(self):
+        def generate_numbers():
+            yield 1
+        response_class = run_route(lambda request: outside.protocol_http.Response(200,{},generate_numbers()))
+        self.assertEqual(response_class.status_code,500)
+
+if (__name__ == "__main__"):
+    unittest.main()
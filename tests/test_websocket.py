@@ -0,0 +1,70 @@
+import socket
+import threading
+import time
+import unittest
+
+import outside
+import outside.activity_slots
+import outside.protocol_http
+import outside.protocol_websocket
+
+def build_header(first_byte,payload_length):
+    header_data = bytearray([first_byte,(0x80 | 127)])
+    header_data.extend(payload_length.to_bytes(8,"big"))
+    return bytes(header_data + b"\x00\x00\x00\x00")
+
+class FrameLimitTest(unittest.TestCase):
+    def setUp(self):
+        self.sending_socket,self.receiving_socket = socket.socketpair()
+        self.receiving_socket.settimeout(5)
+        self.frame_reader = outside.protocol_websocket.FrameReader(self.receiving_socket,outside.activity_slots.create_slots(1)[0],1024)
+
+    def tearDown(self):
+        self.sending_socket.close()
+        self.receiving_socket.close()
+
+    def test_declared_length_is_rejected_before_the_payload(self):
+        # Nothing but the header is sent, a reader which waited for the payload would time out instead
+        self.sending_socket.sendall(build_header(0x82,(1024 ** 4)))
+        with self.assertRaises(outside.protocol_websocket.FrameError):
+            self.frame_reader.read_frame()
+
+    def test_assembled_size_counts(self):
+        self.sending_socket.sendall(build_header(0x00,512))
+        with self.assertRaises(outside.protocol_websocket.FrameError):
+            self.frame_reader.read_frame(600)
+
+    def test_frame_within_limit(self):
+        self.sending_socket.sendall(build_header(0x82,1024) + bytes(1024))
+        frame_fin,frame_opcode,payload_data,frame_compressed = self.frame_reader.read_frame()
+        self.assertEqual((frame_fin,frame_opcode,len(payload_data)),(True,2,1024))
+
+class RecordingSocket:
+    # Waits in the first sendall so another thread can try to send in between
+    def __init__(self):
+        self.sent_data = []
+        self.on_first_send = None
+
+    def sendall(self,data):
+        self.sent_data.append(bytes(data))
+        if (len(self.sent_data) == 1):
+            self.on_first_send()
+            time.sleep(0.1)
+
+    def recv_into(self,recv_buffer):
+        return 0
+
+class SendLockTest(unittest.TestCase):
+    def test_control_frame_waits_for_the_whole_message(self):
+        config = outside.OutsideHTTP(("127.0.0.1",0)).config
+        request_class = outside.protocol_http.Request("GET",{},b"","HTTP/1.1","/ws",("127.0.0.1",0))
+        recording_socket = RecordingSocket()
+        websocket_connection = outside.protocol_websocket.WebSocketConnection(request_class,recording_socket,outside.activity_slots.create_slots(1)[0],config)
+        pong_thread = threading.Thread(target = websocket_connection._send_frame,args = [True,10,b"ping"])
+        recording_socket.on_first_send = pong_thread.start
+        websocket_connection.send(bytes(outside.protocol_websocket.MAX_FRAME_SIZE * 2 + 1))
+        pong_thread.join()
+        self.assertEqual([sent_data[0] for sent_data in recording_socket.sent_data],[0x02,0x00,0x80,0x8A])
+
+if (__name__ == "__main__"):
+    unittest.main()